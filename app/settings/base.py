@@ -190,4 +190,10 @@ LOGIN_REDIRECT_URL = '/'
 
 
 
-SITE_ID = 1
\ No newline at end of file
+SITE_ID = 1
+
+
+# Duración en meses de los períodos de los cortes de existencia 
+# (inventory.models.StockCheckpoint). Debe ser un divisor de 12.
+
+STOCK_CHECKPOINT_PERIOD_MONTHS = 1
\ No newline at end of file
@@ -0,0 +1,28 @@
+# Generated by Django 3.1.14 on 2026-10-18 16:24
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('audit', '0015_auto_20210128_2153'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='historicalitem',
+            name='cost',
+            field=models.DecimalField(blank=True, decimal_places=4, default=0, editable=False, help_text='costo promedio ponderado en moneda local.', max_digits=22, verbose_name='costo promedio'),
+        ),
+        migrations.AddField(
+            model_name='historicalmovement',
+            name='cost',
+            field=models.DecimalField(decimal_places=4, default=0, editable=False, help_text='costo promedio del artículo en este movimiento.', max_digits=22, verbose_name='costo unitario'),
+        ),
+        migrations.AddField(
+            model_name='historicalmovement',
+            name='cost_quantity',
+            field=models.DecimalField(decimal_places=2, default=0, editable=False, max_digits=22, verbose_name='existencia para el costo'),
+        ),
+    ]
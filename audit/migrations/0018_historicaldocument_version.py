@@ -0,0 +1,23 @@
+# Generated by Django 3.1.14 on 2026-10-18 16:42
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('audit', '0017_historicalcompany_valuation'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='historicaldocument',
+            name='update_date',
+            field=models.DateTimeField(blank=True, editable=False, null=True, verbose_name='fecha de modificación'),
+        ),
+        migrations.AddField(
+            model_name='historicaldocument',
+            name='version',
+            field=models.PositiveIntegerField(default=1, editable=False, verbose_name='versión'),
+        ),
+    ]
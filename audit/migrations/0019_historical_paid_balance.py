@@ -0,0 +1,23 @@
+# Generated by Django 3.1.14 on 2026-10-18 16:48
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('audit', '0018_historicaldocument_version'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='historicaldocument',
+            name='balance',
+            field=models.DecimalField(decimal_places=4, default=0, editable=False, max_digits=32, verbose_name='balance'),
+        ),
+        migrations.AddField(
+            model_name='historicaldocument',
+            name='paid',
+            field=models.DecimalField(decimal_places=4, default=0, editable=False, max_digits=32, verbose_name='pagado'),
+        ),
+    ]
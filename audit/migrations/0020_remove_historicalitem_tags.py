@@ -0,0 +1,17 @@
+# Generated by Django 3.1.14 on 2026-10-18 18:23
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('audit', '0019_historical_paid_balance'),
+    ]
+
+    operations = [
+        migrations.RemoveField(
+            model_name='historicalitem',
+            name='tags',
+        ),
+    ]
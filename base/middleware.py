@@ -12,10 +12,11 @@ def get_or_add_company_to_request(request, view_kwargs=None):
     Si no exite, se intentará obtener la instancia de la empresa actual y 
     agregarla al request.company.
     """
+    if getattr(request, "company", None) is not None:
+        return request.company
     try:
-        request.company = getattr(request, "company", 
-                Company.objects.get(pk=view_kwargs["company"]))
-    except (KeyError):
+        request.company = Company.objects.get(pk=view_kwargs["company"])
+    except (KeyError, TypeError):
         request.company = None
     return request.company
 
@@ -108,6 +108,18 @@ def svg(*args, **kwargs):
 def pagination(page_obj, request, **kwargs):
     kwargs["size"] = kwargs.get("size", "small")
     kwargs.update({"page_obj": page_obj, "request": request})
+    if getattr(page_obj, "is_cursor", False):
+        # Paginación por cursor: solo enlaces a la primera, anterior y 
+        # siguiente página, conservando los demás parámetros de la url.
+        cursor_kwarg = page_obj.paginator.cursor_kwarg
+        params = request.GET.copy()
+        params.pop(cursor_kwarg, None)
+        kwargs["first_url"] = f"?{params.urlencode()}"
+        for name, cursor in (("previous_url", page_obj.get_previous_cursor()),
+            ("next_url", page_obj.get_next_cursor())):
+            if cursor:
+                params[cursor_kwarg] = cursor
+                kwargs[name] = f"?{params.urlencode()}"
     return kwargs
 
 
@@ -143,11 +155,8 @@ def breadcrumb(request, limit=20):
         "cssclass": "active",
     })
 
-    for n in range(limit):
-        current = current.parent
-        if current is None:
-            break
-
+    ancestors = current.get_ancestors()
+    for current in reversed(ancestors[max(0, len(ancestors) - limit):]):
         links.append({
             "name": str(current),
             "url": current.get_absolute_url(request.company),
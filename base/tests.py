@@ -1,6 +1,7 @@
 
 from django.test import TestCase, RequestFactory
 from django.http import HttpResponse
+from django.core.cache import cache
 from django.views.generic import (TemplateView)
 from base.middleware import (CheckUserInCompanyMiddleware, CompanyMiddleware)
 
@@ -12,6 +13,12 @@ class BaseTestCase(TestCase):
 
     def setUp(self):
         from company.models import CompanyPermission
+        from module.models import Module
+        # La base de datos se revierte en cada prueba y los ids se reutilizan,
+        # la caché y el árbol de módulos no deben conservar datos de otra 
+        # prueba.
+        cache.clear()
+        Module.invalidate_tree()
         CompanyPermission.populate()
 
 
@@ -0,0 +1,18 @@
+# Generated by Django 3.1.14 on 2026-10-18 16:29
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('company', '0003_company_logo'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='company',
+            name='valuation',
+            field=models.CharField(choices=[('average', 'Costo promedio'), ('fifo', 'Primero en entrar, primero en salir (FIFO)')], default='average', help_text='Con FIFO se mantienen además capas de costo por cada entrada de inventario.', max_length=20, verbose_name='valoración del inventario'),
+        ),
+    ]
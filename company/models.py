@@ -1,4 +1,7 @@
-from django.db import models
+from django.db import models, transaction
+from django.db.models import Exists, OuterRef
+from django.db.models.signals import m2m_changed
+from django.dispatch import receiver
 from django.conf import settings
 from django.core.exceptions import ValidationError
 from django.contrib.sites.models import Site
@@ -27,6 +30,13 @@ class Company(ModelBase):
     company = None
     tags = None
 
+    AVERAGE = "average"
+    FIFO = "fifo"
+    VALUATION_CHOICES = (
+        (AVERAGE, _l("Costo promedio")),
+        (FIFO, _l("Primero en entrar, primero en salir (FIFO)")),
+    )
+
     site = models.ForeignKey(Site, on_delete=models.PROTECT, editable=False)
 
     users = models.ManyToManyField(settings.AUTH_USER_MODEL, blank=True)
@@ -45,6 +55,11 @@ class Company(ModelBase):
 
     is_active = models.BooleanField(_l("activo"), default=True)
 
+    valuation = models.CharField(_l("valoración del inventario"), 
+    max_length=20, choices=VALUATION_CHOICES, default=AVERAGE,
+    help_text=_l("Con FIFO se mantienen además capas de costo por cada "
+    "entrada de inventario."))
+
     create_user = models.ForeignKey(settings.AUTH_USER_MODEL, 
     related_name="create_user_company_set", on_delete=models.PROTECT, null=True, 
     blank=True, editable=True)
@@ -56,6 +71,9 @@ class Company(ModelBase):
 
     on_site = CurrentSiteManager()
 
+    # Roles de un usuario en la empresa (ver get_user_role).
+    ADMIN, MEMBER = "admin", "member"
+
     class Meta:
         verbose_name = _l("empresa")
         verbose_name_plural = _l("empresas")
@@ -80,23 +98,45 @@ class Company(ModelBase):
             return out
         return super().save(*args, **kwargs)
         
+    def get_user_role(self, user) -> str:
+        """
+        Obtiene el rol del usuario en esta empresa: ADMIN, MEMBER o None si 
+        no tiene acceso.
+
+        El rol se guarda en el propio usuario (request.user vive lo que dura
+        la petición), así el middleware, las vistas y los permisos hacen una
+        sola consulta de dos EXISTS por petición. No se guarda entre 
+        peticiones, para que un usuario retirado de la empresa pierda el 
+        acceso de inmediato en todos los procesos.
+        """
+        if (not self.pk) or (not getattr(user, "pk", None)):
+            return None
+
+        roles = getattr(user, "_company_roles", None)
+        if roles is None:
+            roles = user._company_roles = dict()
+        if self.pk not in roles:
+            is_admin, is_member = Company.objects.filter(pk=self.pk).annotate(
+                is_admin=Exists(Company.admin_users.through.objects.filter(
+                    company=OuterRef("pk"), user=user.pk)),
+                is_member=Exists(Company.users.through.objects.filter(
+                    company=OuterRef("pk"), user=user.pk)),
+            ).values_list("is_admin", "is_member").first() or (False, False)
+            roles[self.pk] = (self.ADMIN if is_admin else 
+                self.MEMBER if is_member else None)
+        return roles[self.pk]
+
     def user_has_access(self, user) -> bool:
         """Comprueba si el usuario tiene acceso a esta empresa."""
-        if (user in self.users.all()) or (user in self.admin_users.all()):
-            return True
-        return False
+        return self.get_user_role(user) is not None
 
     def user_is_admin(self, user) -> bool:
         """Comprueba si el usuario es administrador en esta empresa."""
-        if (user in self.admin_users.all()):
-            return True
-        return False
+        return self.get_user_role(user) == self.ADMIN
     
     def user_is_simple(self, user) -> bool:
         """Comprueba si el usuario tiene acceso pero no es administrador."""
-        if (user in self.users.all()) and (not user in self.admin_users.all()):
-            return True
-        return False
+        return self.get_user_role(user) == self.MEMBER
 
     def get_user_list(self, is_active=True):
         """Obtiene todos los usuarios que tinen acceso a esta empresa."""
@@ -104,8 +144,9 @@ class Company(ModelBase):
         return qs.filter(is_active=is_active)
 
     def get_cascading_modules(self, parent=None):
+        """Obtiene los módulos y sus hijos, del árbol en memoria."""
         out = []
-        for obj in Module.objects.filter(parent=parent):
+        for obj in Module.get_children(parent):
             out.append({
                 "name": _(obj.name), 
                 "description": _(obj.description),
@@ -200,53 +241,88 @@ class CompanyPermission(ModelBase):
         self.description = " ".join(self.description.split())
 
     @classmethod
-    def populate(cls, company: Company=None, generic_permissions: list=None):
+    def get_generic_permissions(cls) -> dict:
         """
-        Registra los permisos para cada empresa registrada, o solo para la 
-        empresa indicada.
+        Obtiene los permisos que debe tener cada empresa, uno por cada 
+        acción de cada modelo de APP_LABELS, como {codename: name}.
+        """
+        generic_permissions = dict()
+
+        for app_label, app_title in cls.APP_LABELS:
+            try:
+                models = list(apps.get_app_config(app_label).get_models())
+            except (BaseException) as e:
+                raise e.__class__(f"{app_label}. {e}") from e
+
+            for model in models:
+                if "historical" in model._meta.model_name:
+                    continue
+                for action, action_title in cls.ACTIONS:
+                    permission = cls(
+                        codename=f"{app_label}.{action}_{model._meta.model_name}".lower(),
+                        name=f"{action_title} {model._meta.verbose_name}".title())
+                    permission.clean()
+                    generic_permissions[permission.codename] = permission.name
+        return generic_permissions
+
+    @classmethod
+    def populate(cls, company: Company=None, generic_permissions: list=None,
+        batch_size: int=1000) -> tuple:
+        """
+        Sincroniza los permisos de cada empresa registrada, o solo de la 
+        empresa indicada, con los permisos genéricos: crea los que falten y 
+        borra los que ya no estén (puede ser que se crearon en un momento, 
+        pero ya el modelo o aplicación por la que fueron creados no existe).
+
+        Los permisos existentes se obtienen con una consulta por cada lote de
+        empresas, los que faltan se crean con bulk_create y los sobrantes se 
+        borran por lotes. Es idempotente y se puede ejecutar a la vez en 
+        varios procesos (ej. durante un despliegue): los permisos que otro 
+        proceso haya creado se ignoran gracias a la restricción única.
+
+        Returns:
+            tuple: (cantidad de permisos creados, cantidad de borrados).
         """
         if not generic_permissions:
-            generic_permissions = []
-
-            for app_label, app_title in cls.APP_LABELS:
-                try:
-                    models = list(apps.get_app_config(app_label).get_models())
-                except (BaseException) as e:
-                    raise e.__class__(f"{app_label}. {e}") from e
-
-                for model in models:
-                    if "historical" in model._meta.model_name:
-                        continue
-                    for action, action_title in cls.ACTIONS:
-                        codename = f"{app_label}.{action}_{model._meta.model_name}".lower()
-                        name = f"{action_title} {model._meta.verbose_name}".title()
-                        generic_permissions.append((codename, name))
+            generic_permissions = cls.get_generic_permissions()
+        generic_permissions = dict(generic_permissions)
 
         if company != None:
-            # Se borran los permisos que no estén en generic_permissions. Puede
-            # ser que se crearon en un momento, pero ya el modelo o aplicación
-            # por la que fueron creados ya no existe.
-            db_codenames = CompanyPermission.objects.values_list("codename", flat=True)
-            delete_codenames = []
-            for db_codename in db_codenames:
-                if not db_codename in dict(generic_permissions).keys():
-                    delete_codenames.append(db_codename)
-            CompanyPermission.objects.filter(codename__in=delete_codenames).delete()
-
-            for codename, name in generic_permissions:
-                permission = CompanyPermission(
-                    company=company, codename=codename, name=name)
-                permission.clean()
-                # El permiso se creará solo si no existe.
-                try:
-                    CompanyPermission.objects.get(company=company, 
-                        codename=permission.codename)
-                except (CompanyPermission.DoesNotExist):
-                    permission.save()
-            return
-        
-        for company in Company.objects.all():
-            cls.populate(company, generic_permissions)
+            companies = [company.pk]
+        else:
+            companies = list(Company.objects.order_by("pk").values_list("pk", 
+                flat=True))
+
+        # Empresas por lote, de modo que cada lote ronde batch_size permisos.
+        step = max(1, batch_size // max(1, len(generic_permissions)))
+        created = deleted = 0
+        for i in range(0, len(companies), step):
+            chunk = companies[i:i + step]
+            existing = dict()
+            stale = []
+            for pk, company_id, codename in cls.objects.filter(
+                company__in=chunk).values_list("pk", "company_id", "codename"):
+                existing.setdefault(company_id, set()).add(codename)
+                if not codename in generic_permissions:
+                    stale.append(pk)
+
+            new = [cls(company_id=company_id, codename=codename, name=name)
+                for company_id in chunk 
+                for codename, name in generic_permissions.items()
+                if not codename in existing.get(company_id, ())]
+
+            if (not new) and (not stale):
+                continue
+
+            with transaction.atomic():
+                cls.objects.bulk_create(new, batch_size=batch_size, 
+                    ignore_conflicts=True)
+                for j in range(0, len(stale), batch_size):
+                    cls.objects.filter(pk__in=stale[j:j + batch_size]).delete()
+            created += len(new)
+            deleted += len(stale)
+
+        return created, deleted
 
 
 class CompanyPermissionGroup(ModelBase):
@@ -280,4 +356,29 @@ class CompanyPermissionGroup(ModelBase):
 
     def clean(self):
         self.codename = self.format_codename(self.codename, allowed="_")
-        self.name = " ".join(self.name.split())
\ No newline at end of file
+        self.name = " ".join(self.name.split())
+
+
+@receiver(m2m_changed, sender=Company.users.through)
+@receiver(m2m_changed, sender=Company.admin_users.through)
+def reset_company_roles(sender, instance, action, reverse, **kwargs):
+    """
+    Descarta los roles guardados en el usuario (ver Company.get_user_role) 
+    cuando cambian sus empresas desde la relación inversa.
+    """
+    if reverse and action in ("post_add", "post_remove", "post_clear"):
+        instance._company_roles = None
+
+
+@receiver(m2m_changed)
+def reset_company_permissions(sender, instance, action, model, **kwargs):
+    """
+    Descarta los permisos guardados en el usuario (ver user.models.User.
+    get_company_permission_codenames) cuando cambian sus permisos o grupos 
+    desde el propio usuario.
+    """
+    if action not in ("post_add", "post_remove", "post_clear"):
+        return
+    if issubclass(model, (CompanyPermission, CompanyPermissionGroup)) and (
+        not isinstance(instance, (CompanyPermission, CompanyPermissionGroup))):
+        instance._company_permissions = None
@@ -1,6 +1,8 @@
 from django.test import TestCase
 
+from base.tests import BaseTestCase
 from company.models import Company, CompanyPermission, CompanyPermissionGroup
+from user.models import User
 from user.tests.tests_models import get_or_create_user
 
 
@@ -18,4 +20,131 @@ class CompanyPermissionModelTest(TestCase):
     model = CompanyPermission
 
     def test_populate_method(self):
-        self.model.populate()
\ No newline at end of file
+        self.model.populate()
+
+    def test_populate_is_idempotent_and_per_company(self):
+        company, other = Company(name="Test"), Company(name="Test 2")
+        for obj in (company, other):
+            obj.clean()
+            obj.save()
+        generic_permissions = self.model.get_generic_permissions()
+        self.assertEqual(self.model.objects.filter(company=company).count(), 
+            len(generic_permissions))
+
+        # Si no hay cambios, solo se consultan los permisos existentes.
+        with self.assertNumQueries(2):
+            self.assertEqual(self.model.populate(), (0, 0))
+
+        self.model.objects.create(company=company, codename="test.view_test",
+            name="test")
+        self.model.objects.filter(company=company, 
+            codename="user.view_user").delete()
+        self.assertEqual(self.model.populate(company), (1, 1))
+        self.assertFalse(self.model.objects.filter(
+            codename="test.view_test").exists())
+        self.assertEqual(self.model.objects.filter(company=other).count(), 
+            len(generic_permissions))
+
+class CompanyModelTest(BaseTestCase):
+
+    def test_user_role_is_memoized_per_request(self):
+        company = get_or_create_company()
+        user = get_or_create_user()
+        self.assertTrue(company.user_has_access(user))
+        self.assertTrue(company.user_is_simple(user))
+        self.assertFalse(company.user_is_admin(user))
+
+        # Dentro de la misma petición (mismo usuario) no se consulta de nuevo,
+        # y en otra petición se consulta una sola vez.
+        with self.assertNumQueries(0):
+            company.user_has_access(user)
+        other = User.objects.get(pk=user.pk)
+        with self.assertNumQueries(1):
+            self.assertTrue(company.user_has_access(other))
+            self.assertFalse(company.user_is_admin(other))
+
+        # Los cambios se ven en la siguiente petición.
+        company.admin_users.add(user)
+        self.assertTrue(company.user_is_admin(User.objects.get(pk=user.pk)))
+        company.users.remove(user)
+        company.admin_users.remove(user)
+        self.assertFalse(company.user_has_access(User.objects.get(pk=user.pk)))
+
+        # Cambios desde el usuario (relación inversa).
+        user = User.objects.get(pk=user.pk)
+        user.company_set.add(company)
+        self.assertTrue(company.user_has_access(user))
+        user.company_set.clear()
+        self.assertFalse(company.user_has_access(user))
+
+    def test_user_permissions_are_memoized_per_request(self):
+        company = get_or_create_company()
+        user = get_or_create_user()
+        self.assertFalse(user.has_company_permission(company, 
+            "document.add_document"))
+
+        user.assign_company_permission("document.add_document", company)
+        user = User.objects.get(pk=user.pk)
+        self.assertTrue(user.has_company_permission(company, 
+            "document.add_document"))
+        # Una sola carga por petición.
+        with self.assertNumQueries(0):
+            self.assertTrue(user.has_company_permission(company, 
+                ("user.add_user", "document.add_document")))
+            self.assertFalse(user.has_company_permission(company, 
+                "user.add_user"))
+            self.assertEqual(user.get_company_permission_codenames(company), 
+                frozenset({"document.add_document"}))
+        # En la siguiente petición se consulta de nuevo (acceso y permisos).
+        user = User.objects.get(pk=user.pk)
+        with self.assertNumQueries(2):
+            self.assertTrue(user.has_company_permission(company, 
+                "document.add_document"))
+
+        # Permisos a través de un grupo.
+        group = CompanyPermissionGroup.objects.create(company=company, 
+            codename="test", name="test")
+        group.permissions.add(CompanyPermission.objects.get(company=company, 
+            codename="user.add_user"))
+        user.company_groups.add(group)
+        self.assertTrue(user.has_company_permission(company, "user.add_user"))
+        group.delete()
+        user = User.objects.get(pk=user.pk)
+        self.assertFalse(user.has_company_permission(company, "user.add_user"))
+
+        # Cambios desde el permiso (relación inversa).
+        permission = CompanyPermission.objects.get(company=company, 
+            codename="document.add_document")
+        permission.user_set.clear()
+        user = User.objects.get(pk=user.pk)
+        self.assertFalse(user.has_company_permission(company, permission))
+
+        # Sin acceso a la empresa no hay permisos.
+        user.company_permissions.add(permission)
+        company.users.remove(user)
+        user = User.objects.get(pk=user.pk)
+        self.assertFalse(user.has_company_permission(company, permission))
+
+    def test_superuser_has_all_company_permissions(self):
+        """
+        Los superusuarios tienen todos los permisos de las empresas a las que
+        pertenecen, incluso los que no están registrados.
+        """
+        company = get_or_create_company()
+        user = get_or_create_user()
+        user.is_superuser = True
+        user.save()
+        user = User.objects.get(pk=user.pk)
+        codenames = set(CompanyPermission.objects.filter(company=company
+            ).values_list("codename", flat=True))
+        self.assertTrue(codenames)
+        self.assertEqual(user.get_company_permission_codenames(company), 
+            codenames)
+        self.assertTrue(user.has_company_permission(company, "user.add_user"))
+        self.assertTrue(user.has_company_permission(company, "app.unknown"))
+
+        company.users.remove(user)
+        user = User.objects.get(pk=user.pk)
+        self.assertFalse(user.has_company_permission(company, "user.add_user"))
+        self.assertEqual(user.get_company_permission_codenames(company), 
+            frozenset())
@@ -1,6 +1,7 @@
 from django.contrib import admin
 
-from .models import (DocumentType, Document)
+from .models import (DocumentType, Document, DocumentSequence, 
+    DocumentSequenceReservation)
 
 
 @admin.register(Document)
@@ -10,4 +11,13 @@ class DocumentAdmin(admin.ModelAdmin):
 
 @admin.register(DocumentType)
 class DocumentTypeAdmin(admin.ModelAdmin):
-    pass
\ No newline at end of file
+    pass
+
+@admin.register(DocumentSequence)
+class DocumentSequenceAdmin(admin.ModelAdmin):
+    pass
+
+
+@admin.register(DocumentSequenceReservation)
+class DocumentSequenceReservationAdmin(admin.ModelAdmin):
+    pass
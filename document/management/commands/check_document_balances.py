@@ -0,0 +1,45 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from company.models import Company
+from document.models import Document
+
+
+class Command(BaseCommand):
+    help = ("Verifica que los pagos y el saldo guardados en los documentos de "
+        "las empresas indicadas (o de todas) coincidan con sus transacciones. "
+        "Con --repair corrige las diferencias encontradas.")
+
+    def add_arguments(self, parser):
+        parser.add_argument("--company", type=int, nargs="*", default=None,
+            help="ids de las empresas a verificar. Por defecto todas.")
+        parser.add_argument("--repair", action="store_true", default=False,
+            help="corrige los documentos con diferencias.")
+
+    def handle(self, *args, **options):
+        qs = Company.objects.all()
+        if options["company"]:
+            qs = qs.filter(pk__in=options["company"])
+            if not qs:
+                raise CommandError("No existen las empresas indicadas.")
+
+        for company in qs:
+            documents = Document.objects.filter(doctype__company=company)
+            drift = Document.get_payments_drift(documents)
+            count = 0
+            for document in drift:
+                count += 1
+                self.stdout.write(f"  {document} ({document.pk}): pagado "
+                    f"{document.paid:,} -> {document.real_paid:,}, balance "
+                    f"{document.balance:,} -> {document.real_balance:,}")
+
+            if not count:
+                self.stdout.write(self.style.SUCCESS(f"{company}: sin "
+                    "diferencias."))
+            elif options["repair"]:
+                Document.update_payments_for(Document.objects.filter(
+                    pk__in=drift.values("pk")))
+                self.stdout.write(self.style.SUCCESS(f"{company}: {count:,} "
+                    "documentos corregidos."))
+            else:
+                self.stdout.write(self.style.WARNING(f"{company}: {count:,} "
+                    "documentos con diferencias."))
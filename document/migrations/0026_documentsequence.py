@@ -0,0 +1,48 @@
+# Generated by Django 3.1.14 on 2026-10-18 16:40
+
+from django.db import migrations, models
+import django.db.models.deletion
+import unoletutils.libs.text
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('company', '0004_company_valuation'),
+        ('document', '0025_document_is_printed'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DocumentSequenceReservation',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('first', models.PositiveIntegerField(verbose_name='desde')),
+                ('last', models.PositiveIntegerField(verbose_name='hasta')),
+                ('description', models.CharField(blank=True, help_text='por ejemplo, la terminal que usará el rango.', max_length=100, verbose_name='descripción')),
+                ('create_date', models.DateTimeField(auto_now_add=True)),
+                ('company', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='company.company', verbose_name='Empresa')),
+                ('doctype', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='document.documenttype', verbose_name='tipo de documento')),
+            ],
+            options={
+                'verbose_name': 'reserva de secuencias',
+                'verbose_name_plural': 'reservas de secuencias',
+                'ordering': ['doctype', 'first'],
+            },
+            bases=(models.Model, unoletutils.libs.text.Text),
+        ),
+        migrations.CreateModel(
+            name='DocumentSequence',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('last', models.PositiveIntegerField(default=0, verbose_name='última secuencia')),
+                ('company', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='company.company', verbose_name='Empresa')),
+                ('doctype', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, to='document.documenttype', verbose_name='tipo de documento')),
+            ],
+            options={
+                'verbose_name': 'secuencia de documentos',
+                'verbose_name_plural': 'secuencias de documentos',
+            },
+            bases=(models.Model, unoletutils.libs.text.Text),
+        ),
+    ]
@@ -0,0 +1,27 @@
+# Generated by Django 3.1.14 on 2026-10-18 16:48
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('document', '0027_document_version'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='document',
+            name='balance',
+            field=models.DecimalField(decimal_places=4, default=0, editable=False, max_digits=32, verbose_name='balance'),
+        ),
+        migrations.AddField(
+            model_name='document',
+            name='paid',
+            field=models.DecimalField(decimal_places=4, default=0, editable=False, max_digits=32, verbose_name='pagado'),
+        ),
+        migrations.AddIndex(
+            model_name='document',
+            index=models.Index(condition=models.Q(balance__gt=0), fields=['person'], name='document_pending_balance_idx'),
+        ),
+    ]
@@ -0,0 +1,27 @@
+from django.db import migrations
+from django.db.models import Sum, Subquery, OuterRef, DecimalField
+from django.db.models.functions import Coalesce
+
+
+def populate_paid_balance(apps, schema_editor):
+    """Calcula los pagos y el saldo de los documentos ya registrados."""
+    Document = apps.get_model("document", "Document")
+    Transaction = apps.get_model("finance", "Transaction")
+
+    payments = Transaction.objects.filter(document=OuterRef("pk")).order_by(
+        ).values("document").annotate(s=Sum("amount")).values("s")
+    paid = Coalesce(Subquery(payments), 0, output_field=DecimalField())
+    total = Coalesce("total", 0, output_field=DecimalField())
+    Document.objects.update(paid=paid, balance=total - paid)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('document', '0028_document_paid_balance'),
+        ('finance', '0015_auto_20210124_2044'),
+    ]
+
+    operations = [
+        migrations.RunPython(populate_paid_balance, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 3.1.14 on 2026-10-18 17:21
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('document', '0029_populate_document_paid_balance'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='document',
+            index=models.Index(fields=['create_date', 'id'], name='document_create_date_id_idx'),
+        ),
+    ]
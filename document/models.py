@@ -1,7 +1,10 @@
+import contextlib
+import threading
 from decimal import Decimal
 
-from django.db import models
-from django.db.models import Sum, F
+from django.db import models, transaction, IntegrityError
+from django.db.models import Sum, F, Q, Subquery, OuterRef, DecimalField
+from django.db.models.functions import Coalesce
 from django.conf import settings
 from django.utils import timezone
 from django.utils.translation import gettext as _
@@ -12,7 +15,13 @@ from django.urls import reverse_lazy
 
 from unoletutils.libs import utils
 from unoletutils.models import ModelBase
-from finance.models import (Transaction)
+from finance.models import (Transaction, TaxReceiptAuthorization, 
+    TaxReceiptNumber)
+
+
+# Documentos pendientes de calcular dentro de Document.deferred_totals, por 
+# hilo (cada solicitud se atiende en un hilo).
+_deferred = threading.local()
 
 
 def get_default_currency():
@@ -244,6 +253,15 @@ class Document(ModelBase):
     total = models.DecimalField(_l("total"), max_digits=32, 
     decimal_places=2, null=True, blank=True, editable=False)
 
+    # Suma de los pagos (transacciones) y saldo pendiente (total - pagado).
+    # Se mantienen con update_payments cada vez que cambian las transacciones
+    # o el total del documento.
+    paid = models.DecimalField(_l("pagado"), max_digits=32, decimal_places=4,
+    default=0, editable=False)
+
+    balance = models.DecimalField(_l("balance"), max_digits=32, 
+    decimal_places=4, default=0, editable=False)
+
     # Seguimiento.
 
     create_user = models.ForeignKey(settings.AUTH_USER_MODEL, 
@@ -252,6 +270,14 @@ class Document(ModelBase):
     create_date = models.DateTimeField(_l("fecha de creación"), 
     auto_now_add=True)
 
+    # Versión del documento. Aumenta cada vez que cambia el documento, sus 
+    # movimientos, notas o pagos (ver touch).
+    version = models.PositiveIntegerField(_l("versión"), default=1, 
+    editable=False)
+
+    update_date = models.DateTimeField(_l("fecha de modificación"), 
+    auto_now=True, null=True)
+
     # Manejadores.
 
     objects = models.Manager()
@@ -275,13 +301,21 @@ class Document(ModelBase):
             models.UniqueConstraint(fields=("doctype", "sequence"), 
                 name="unique_document_doctype_sequence")
         ]
+        indexes = [
+            # Documentos pendientes de pago (balance > 0), por persona.
+            models.Index(fields=("person",), condition=Q(balance__gt=0),
+                name="document_pending_balance_idx"),
+            # Paginación por cursor del listado (ver DocumentListView).
+            models.Index(fields=("create_date", "id"), 
+                name="document_create_date_id_idx"),
+        ]
 
     def __str__(self):
         return self.get_number()
 
     def get_reverse_kwargs(self):
         """Obtiene el diccionario para construir la URL con reverse."""
-        return {"company": self.doctype.company.pk,
+        return {"company": self.doctype.company_id,
             "generictype": self.doctype.generic, "pk": self.pk}
 
     def get_absolute_url(self, mode="update"):
@@ -327,10 +361,6 @@ class Document(ModelBase):
     
     def save(self, *args, **kwargs):
         if not self.pk:
-            self.sequence = self.get_next_sequence_for_type(self.doctype)
-            if not self.number:
-                self.number = "{:0>12}".format(self.sequence)
-
             if not self.person_name:
                 self.person_name = str(self.person)
         
@@ -338,7 +368,222 @@ class Document(ModelBase):
             self.currency_rate = self.currency.rate or 1
 
         self.validate_transfer_warehouse()
-        return super().save(*args, **kwargs)
+
+        if not self.pk:
+            # La secuencia se asigna en la misma transacción en que se crea el
+            # documento, así si falla la creación la secuencia no se pierde.
+            # Si ya tiene una secuencia de un rango reservado, se respeta.
+            with transaction.atomic():
+                if not DocumentSequence.is_reserved(self.doctype, 
+                    self.sequence):
+                    self.sequence = DocumentSequence.next(self.doctype)
+                if not self.number:
+                    self.number = "{:0>12}".format(self.sequence)
+                out = super().save(*args, **kwargs)
+                # Normalmente se crea sin totales; si los trae (p. ej. una 
+                # copia) se suman al balance de la persona.
+                if self.person_id and (self.total or self.paid or 
+                    self.balance):
+                    self.update_person_balances()
+                return out
+
+        # La versión solo se modifica con touch, y los pagos con 
+        # update_payments, para que una instancia desactualizada no los 
+        # sobrescriba.
+        if not kwargs.get("update_fields"):
+            kwargs["update_fields"] = [f.name for f in self._meta.concrete_fields
+                if (not f.primary_key) and (f.name not in self.MANAGED_FIELDS)]
+
+        # Si cambia el almacén o el tipo del documento, sus movimientos se 
+        # revierten en la existencia con los valores anteriores y se aplican 
+        # nuevamente con los nuevos.
+        # Igualmente, si cambia la fecha, la tasa o el tipo, se recalcula el 
+        # costo promedio de sus artículos.
+        from inventory.models import StockBalance
+        with transaction.atomic():
+            previous = self.get_values_in_db()
+            out = super().save(*args, **kwargs)
+            self.touch(self.pk)
+            if not previous:
+                return out
+            person_values = self.get_person_values()
+            if person_values != {k: previous[k] for k in person_values}:
+                self.update_person_balances(previous)
+            values = self.get_stock_values()
+            previous_stock = {k: previous[k] for k in values}
+            if previous_stock != values:
+                StockBalance.apply_document(self, previous_stock, sign=-1)
+                StockBalance.apply_document(self, sign=1)
+            previous_cost = {k: previous[k] for k in self.COST_VALUES_FIELDS}
+            if previous_cost != self.get_cost_values():
+                self.update_items_cost(previous_cost)
+            if (previous_stock != values) or (
+                previous_cost != self.get_cost_values()):
+                self.update_items_layers(previous)
+        return out
+
+    def delete(self, *args, **kwargs):
+        from inventory.models import StockBalance
+        with transaction.atomic():
+            previous = self.get_values_in_db()
+            items = list(self.movement_set.values_list("item_id", flat=True))
+            StockBalance.apply_document(self, previous, sign=-1)
+            self.update_items_layers(previous, deleted=True)
+            # Un documento eliminado ya no debe calcularse en deferred_totals.
+            if getattr(_deferred, "documents", None):
+                _deferred.documents.pop(self.pk, None)
+            out = super().delete(*args, **kwargs)
+            self.update_items_cost(previous, items)
+            if previous:
+                self.update_person_balances(previous, deleted=True)
+        return out
+
+    # Campos que no se guardan en save, se actualizan con consultas propias.
+    MANAGED_FIELDS = ("version", "paid", "balance")
+
+    def allocate_tax_receipt_number(self):
+        """
+        Asigna al documento el siguiente comprobante fiscal de su tipo, si 
+        aún no tiene uno, y lo devuelve. No se asigna al guardar sino al 
+        imprimir (ver DocumentPrintView), así la falta de comprobantes no 
+        impide registrar el documento. Lanza ValidationError si no hay 
+        comprobantes disponibles.
+        """
+        if (not self.doctype.tax_receipt_id) or self.tax_receipt_number_id:
+            return self.tax_receipt_number
+
+        with transaction.atomic():
+            # El bloqueo evita que dos impresiones simultáneas le asignen dos
+            # comprobantes al mismo documento.
+            current = Document.objects.select_for_update().filter(
+                pk=self.pk).values_list("tax_receipt_number", flat=True).get()
+            if current:
+                self.tax_receipt_number = TaxReceiptNumber.objects.get(
+                    pk=current)
+                return self.tax_receipt_number
+            self.tax_receipt_number = TaxReceiptAuthorization.allocate(
+                self.doctype.tax_receipt)
+            Document.objects.filter(pk=self.pk).update(
+                tax_receipt_number=self.tax_receipt_number)
+        return self.tax_receipt_number
+
+    # Campos (relativos al movimiento) que determinan cómo los movimientos de
+    # este documento afectan el costo promedio.
+    COST_VALUES_FIELDS = ("document__date", "document__currency_rate",
+        "document__doctype__generic", "document__doctype__affect_cost")
+
+    def get_stock_values(self) -> dict:
+        """
+        Obtiene los valores de este documento que determinan cómo sus 
+        movimientos afectan la existencia. Ver inventory.models.StockBalance.
+        """
+        return {
+            "document__doctype__company_id": self.doctype.company_id,
+            "document__doctype__generic": self.doctype.generic,
+            "document__warehouse_id": self.warehouse_id,
+            "document__transfer_warehouse_id": self.transfer_warehouse_id,
+            "document__date": self._meta.get_field("date").to_python(
+                self.date),
+        }
+
+    def get_stock_values_in_db(self) -> dict:
+        """Igual que get_stock_values pero con los valores guardados."""
+        values = self.get_values_in_db()
+        if values:
+            return {k: values[k] for k in self.get_stock_values()}
+
+    def get_cost_values(self) -> dict:
+        """
+        Obtiene los valores de este documento que determinan cómo sus 
+        movimientos afectan el costo promedio, con las claves de 
+        COST_VALUES_FIELDS.
+        """
+        return {
+            "document__date": self._meta.get_field("date").to_python(
+                self.date),
+            "document__currency_rate": self._meta.get_field(
+                "currency_rate").to_python(self.currency_rate),
+            "document__doctype__generic": self.doctype.generic,
+            "document__doctype__affect_cost": self.doctype.affect_cost,
+        }
+
+    def get_values_in_db(self) -> dict:
+        """
+        Obtiene en una sola consulta los valores guardados de este documento
+        que afectan la existencia, el costo y el balance de la persona (con el
+        prefijo 'document__').
+        """
+        values = Document.objects.filter(pk=self.pk).values(
+            "doctype__company_id", "doctype__generic", "doctype__affect_cost",
+            "warehouse_id", "transfer_warehouse_id", "date", 
+            "currency_rate", "person_id", "total", "paid", "balance").first()
+        if values:
+            return {f"document__{k}": v for k, v in values.items()}
+
+    def get_person_values(self) -> dict:
+        """
+        Obtiene los valores de este documento que determinan cómo afecta el 
+        balance de su persona. Ver person.models.PersonBalance.
+        """
+        return {
+            "document__person_id": self.person_id,
+            "document__doctype__generic": self.doctype.generic,
+            "document__date": self._meta.get_field("date").to_python(
+                self.date),
+        }
+
+    def update_person_balances(self, previous: dict=None, 
+        deleted: bool=False):
+        """
+        Aplica al balance (person.models.PersonBalance) la diferencia entre 
+        los valores anteriores de este documento (previous, ver 
+        get_values_in_db) y los guardados ahora. Si el documento fue 
+        eliminado (deleted) solo se restan los anteriores.
+        """
+        from person.models import PersonBalance
+        current = None if deleted else self.get_values_in_db()
+        PersonBalance.apply_document(previous, current)
+
+    def update_items_cost(self, previous: dict, items: list=None):
+        """
+        Recalcula el costo promedio de los artículos de este documento (o de
+        los artículos indicados) desde la fecha más antigua entre la anterior
+        (previous) y la actual, si el documento antes o ahora afecta el costo.
+        """
+        from inventory.models import Item, Movement
+        dates = [previous["document__date"]]
+        affects = Movement.values_affect_cost(dict(previous, item_id=True))
+        if items is None:
+            items = self.movement_set.values_list("item_id", flat=True)
+            values = self.get_cost_values()
+            dates.append(values["document__date"])
+            affects = affects or Movement.values_affect_cost(
+                dict(values, item_id=True))
+        if affects:
+            for item in Item.objects.filter(pk__in=set(items)):
+                item.update_cost(min(dates))
+
+    def update_items_layers(self, previous: dict, deleted: bool=False):
+        """
+        Reprocesa las capas de costo FIFO de los artículos de este documento
+        desde la fecha más antigua entre la anterior (previous) y la actual.
+        Si el documento está por eliminarse (deleted), se omiten sus 
+        movimientos.
+        """
+        from inventory.models import CostLayer
+        if not CostLayer.is_enabled(self.doctype.company):
+            return
+        types = CostLayer.get_types()
+        if ((previous["document__doctype__generic"] not in types) and 
+            (deleted or (self.doctype.generic not in types))):
+            return
+        date = min(previous["document__date"], 
+            self._meta.get_field("date").to_python(self.date))
+        exclude = {"document": self.pk} if deleted else None
+        items = self.movement_set.filter(item__isnull=False).order_by(
+            ).values_list("item_id", flat=True).distinct()
+        for item_id in items:
+            CostLayer.replay(item_id, date, exclude=exclude)
 
     def is_inventory_input(self):
         generics = DocumentType.TYPES_THAT_AFFECT_THE_INVENTORY_AS_INPUT
@@ -357,12 +602,12 @@ class Document(ModelBase):
         out = {"amount": 0, "discount": 0, "tax": 0, "total": 0, 
             "movements": qs, "updated": False}
 
-        if qs:
-            out["amount"] = qs.aggregate(s=Sum(F("quantity") * F("price")))["s"]
-            out["discount"] = qs.aggregate(s=Sum("discount"))["s"]
-            out["tax"] = qs.aggregate(s=Sum("tax"))["s"]
-            out["total"] = qs.aggregate(s=Sum(
-                ((F("quantity") * F("price")) - F("discount")) + F("tax") ))["s"]
+        # Todos los totales en una sola consulta.
+        amount = F("quantity") * F("price")
+        totals = qs.order_by().aggregate(amount=Sum(amount), 
+            discount=Sum("discount"), tax=Sum("tax"), 
+            total=Sum((amount - F("discount")) + F("tax")))
+        out.update({k: v or 0 for k, v in totals.items()})
 
         # Actualizamos los campos si exiten diferencias.
         if ((out["amount"] != self.amount) or (out["discount"] != self.discount)
@@ -371,10 +616,62 @@ class Document(ModelBase):
             self.discount = out["discount"]
             self.tax = out["tax"]
             self.total = out["total"]
-            self.save_without_historical_record()
+            # Valores anteriores para el balance de la persona.
+            previous = self.get_values_in_db() if self.person_id else None
+            self.save_without_historical_record(update_fields=("amount", 
+                "discount", "tax", "total"))
+            self.update_payments(previous)
             out["updated"] = True
 
         return out
+
+    @staticmethod
+    def touch(pk: int):
+        """
+        Aumenta la versión y la fecha de modificación del documento indicado,
+        usadas por las vistas para responder 304 si no hubo cambios.
+        """
+        Document.objects.filter(pk=pk).update(version=F("version") + 1, 
+            update_date=timezone.now())
+
+    def schedule_calculate(self):
+        """
+        Calcula los totales del documento, o si se está dentro de un bloque 
+        deferred_totals, lo marca para calcularlo una sola vez al salir.
+        """
+        documents = getattr(_deferred, "documents", None)
+        if documents is None:
+            return self.calculate()
+        documents.setdefault(self.pk, self)
+
+    @contextlib.contextmanager
+    def deferred_totals(self=None):
+        """
+        Posterga el cálculo de los totales de los documentos modificados 
+        dentro del bloque, de modo que cada uno se calcula una sola vez al 
+        salir, en la misma transacción. Puede usarse desde una instancia o 
+        desde la clase, y anidarse:
+
+            with document.deferred_totals():
+                for movement in movements:
+                    movement.save()
+
+        Si ocurre una excepción, la transacción se revierte y no se calcula.
+        """
+        if getattr(_deferred, "documents", None) is not None:
+            # Ya estamos dentro de un bloque; el más externo calculará.
+            yield
+            return
+
+        _deferred.documents = dict()
+        try:
+            with transaction.atomic():
+                yield
+                while _deferred.documents:
+                    _, document = _deferred.documents.popitem()
+                    document.calculate()
+        finally:
+            _deferred.documents = None
     
     def get_number(self, doctype=None, sequence=None) -> str:
         """Contruye y obtiene el número visible del documento con su tipo."""
@@ -391,18 +688,11 @@ class Document(ModelBase):
 
     @classmethod
     def get_next_sequence_for_type(cls, doctype=None):
-        """Obtiene la siguiente secuencia para el tipo de documento indicado."""
-        try:
-            mx = Document.objects.filter(
-                doctype=doctype).order_by("-sequence")[0]
-        except (IndexError):
-            return 1
-        
-        if mx.sequence == None:
-            mx.sequence = 1
-            mx.number = "{:0>12}".format(1)
-            mx.save()
-        return mx.sequence + 1
+        """
+        Obtiene (sin reservarla) la siguiente secuencia para el tipo de 
+        documento indicado. Para asignarla use DocumentSequence.next.
+        """
+        return DocumentSequence.peek(doctype)
 
     def get_person_name(self):
         return str(self.person or self.person_name)
@@ -412,13 +702,63 @@ class Document(ModelBase):
         return self.movement_set.all()
 
     def get_balance(self) -> Decimal:
-        """Obtiene el saldo de este documento."""
-        self.calculate() # Actualizamos primero por si acaso.
-        return self.total - self.get_payments_sum()
+        """Obtiene el saldo de este documento (ver update_payments)."""
+        return self.balance
 
-    def get_payments_sum(self):
+    def get_payments_sum(self) -> Decimal:
         """Obtiene la sumatoria de los pagos realizados."""
-        return self.get_transactions().aggregate(s=Sum("amount"))["s"] or 0
+        return self.paid
+
+    @staticmethod
+    def get_payments_expressions() -> dict:
+        """
+        Obtiene las expresiones que calculan, desde las transacciones, los 
+        valores de los campos paid y balance de cada documento.
+        """
+        payments = Transaction.objects.filter(document=OuterRef("pk")
+            ).order_by().values("document").annotate(s=Sum("amount")
+            ).values("s")
+        paid = Coalesce(Subquery(payments), 0, output_field=DecimalField())
+        total = Coalesce("total", 0, output_field=DecimalField())
+        return {"paid": paid, "balance": total - paid}
+
+    @classmethod
+    def update_payments_for(cls, queryset) -> int:
+        """
+        Recalcula con una sola sentencia UPDATE los pagos y el saldo de los 
+        documentos indicados. Retorna la cantidad de documentos actualizados.
+        """
+        return queryset.update(**cls.get_payments_expressions())
+
+    def update_payments(self, previous: dict=None):
+        """
+        Recalcula los pagos y el saldo de este documento en la base de datos
+        y los actualiza en la instancia. La diferencia se aplica al balance 
+        de la persona respecto de los valores anteriores (previous, ver 
+        get_values_in_db), que si no se indican se leen antes de actualizar.
+        """
+        balances = self.person_id and self.doctype.accept_payments()
+        if balances and (previous is None):
+            previous = self.get_values_in_db()
+        qs = Document.objects.filter(pk=self.pk)
+        self.update_payments_for(qs)
+        self.paid, self.balance = qs.values_list("paid", "balance").get()
+        if balances:
+            self.update_person_balances(previous)
+
+    @classmethod
+    def get_payments_drift(cls, queryset=None) -> models.QuerySet:
+        """
+        Obtiene los documentos cuyos pagos o saldo guardados no coinciden con 
+        sus transacciones. Se anotan los valores correctos en real_paid y 
+        real_balance.
+        """
+        if queryset is None:
+            queryset = Document.objects.all()
+        expressions = cls.get_payments_expressions()
+        qs = queryset.annotate(real_paid=expressions["paid"], 
+            real_balance=expressions["balance"])
+        return qs.exclude(paid=F("real_paid"), balance=F("real_balance"))
 
     def get_credits(self) -> models.QuerySet:
         """
@@ -479,4 +819,199 @@ class DocumentNote(ModelBase):
     def save(self, *args, **kwargs):
         if not self.username:
             self.username = str(self.create_user)
-        return super().save(*args, **kwargs)
\ No newline at end of file
+        out = super().save(*args, **kwargs)
+        Document.touch(self.document_id)
+        return out
+
+    def delete(self, *args, **kwargs):
+        out = super().delete(*args, **kwargs)
+        Document.touch(self.document_id)
+        return out
+
+
+class DocumentSequence(ModelBase):
+    """
+    Contador de la última secuencia asignada para cada tipo de documento.
+
+    La fila del tipo se bloquea con select_for_update mientras se crea el 
+    documento, de modo que dos terminales nunca obtienen la misma secuencia,
+    y como el bloqueo se mantiene hasta el final de la transacción, una 
+    creación fallida no deja huecos en la numeración.
+
+    Para terminales sin conexión se pueden reservar rangos de secuencias 
+    (ver reserve), salvo en los tipos con comprobante fiscal, en los que la 
+    numeración debe ser continua.
+
+    Las métricas de espera por el bloqueo de cada tipo se acumulan en 
+    memoria por proceso (ver get_metrics).
+    """
+    tags = None
+
+    doctype = models.OneToOneField(DocumentType, on_delete=models.CASCADE, 
+    verbose_name=_l("tipo de documento"))
+
+    last = models.PositiveIntegerField(_l("última secuencia"), default=0)
+
+    # Esperas por el bloqueo mayores a estos segundos se registran en el log.
+    SLOW_WAIT_SECONDS = 0.5
+
+    # {doctype_id: {"count", "wait", "max_wait", "conflicts"}}
+    _metrics = dict()
+    _metrics_lock = threading.Lock()
+
+    class Meta:
+        verbose_name = _l("secuencia de documentos")
+        verbose_name_plural = _l("secuencias de documentos")
+
+    def __str__(self):
+        return f"{self.doctype} = {self.last}"
+
+    @classmethod
+    def get_metrics(cls, doctype=None) -> dict:
+        """
+        Obtiene las métricas de contención de este proceso: cantidad de 
+        asignaciones, segundos de espera total y máxima por el bloqueo, y 
+        conflictos al crear el contador.
+        """
+        with cls._metrics_lock:
+            if doctype is not None:
+                return dict(cls._metrics.get(getattr(doctype, "pk", doctype), 
+                    {"count": 0, "wait": 0, "max_wait": 0, "conflicts": 0}))
+            return {k: dict(v) for k, v in cls._metrics.items()}
+
+    @classmethod
+    def _record(cls, doctype_id: int, wait: float, conflicts: int=0):
+        import logging
+        with cls._metrics_lock:
+            metrics = cls._metrics.setdefault(doctype_id, 
+                {"count": 0, "wait": 0, "max_wait": 0, "conflicts": 0})
+            metrics["count"] += 1
+            metrics["wait"] += wait
+            metrics["max_wait"] = max(metrics["max_wait"], wait)
+            metrics["conflicts"] += conflicts
+        if wait > cls.SLOW_WAIT_SECONDS:
+            logging.getLogger(__name__).warning("Espera de %.3fs por la "
+                "secuencia del tipo de documento %s.", wait, doctype_id)
+
+    @staticmethod
+    def get_max_sequence(doctype_id: int) -> int:
+        """Obtiene la mayor secuencia usada o reservada del tipo."""
+        used = Document.objects.filter(doctype=doctype_id).aggregate(
+            m=models.Max("sequence"))["m"] or 0
+        reserved = DocumentSequenceReservation.objects.filter(
+            doctype=doctype_id).aggregate(m=models.Max("last"))["m"] or 0
+        return max(used, reserved)
+
+    @classmethod
+    def peek(cls, doctype) -> int:
+        """Obtiene la siguiente secuencia del tipo, sin reservarla."""
+        doctype_id = getattr(doctype, "pk", doctype)
+        last = cls.objects.filter(doctype=doctype_id).values_list("last", 
+            flat=True).first() or 0
+        return max(last, cls.get_max_sequence(doctype_id)) + 1
+
+    @classmethod
+    def lock(cls, doctype):
+        """
+        Obtiene y bloquea el contador del tipo hasta el final de la 
+        transacción en curso, creándolo si no existe.
+        """
+        import time
+        doctype_id = getattr(doctype, "pk", doctype)
+        start = time.monotonic()
+        conflicts = 0
+        counter = cls.objects.select_for_update().filter(
+            doctype=doctype_id).first()
+        if counter is None:
+            try:
+                with transaction.atomic():
+                    counter = cls.objects.create(doctype_id=doctype_id, 
+                        company_id=DocumentType.objects.filter(
+                        pk=doctype_id).values_list("company_id", flat=True)[0],
+                        last=cls.get_max_sequence(doctype_id))
+            except (IntegrityError):
+                # Otro proceso lo creó al mismo tiempo.
+                conflicts = 1
+                counter = cls.objects.select_for_update().get(
+                    doctype=doctype_id)
+        cls._record(doctype_id, time.monotonic() - start, conflicts)
+        return counter
+
+    @classmethod
+    def next(cls, doctype) -> int:
+        """
+        Asigna la siguiente secuencia del tipo. Debe llamarse dentro de la 
+        transacción que crea el documento para que la numeración sea continua.
+        """
+        with transaction.atomic():
+            counter = cls.lock(doctype)
+            counter.last += 1
+            counter.save(update_fields=["last"])
+        return counter.last
+
+    @classmethod
+    def reserve(cls, doctype, count: int, description: str=""):
+        """
+        Reserva un rango de 'count' secuencias del tipo para usarlas luego 
+        (por ejemplo en una terminal sin conexión). Los documentos creados con
+        una secuencia de un rango reservado la conservan.
+
+        Raises:
+            ValidationError: si el tipo tiene comprobante fiscal, ya que su 
+            numeración debe ser continua, o si 'count' no es positivo.
+
+        Returns:
+            DocumentSequenceReservation
+        """
+        if count < 1:
+            raise ValidationError(_("La cantidad debe ser mayor que cero."))
+        if doctype.tax_receipt_id:
+            raise ValidationError(_("No se pueden reservar secuencias de un "
+                "tipo de documento con comprobante fiscal."))
+        with transaction.atomic():
+            counter = cls.lock(doctype)
+            first = counter.last + 1
+            counter.last += count
+            counter.save(update_fields=["last"])
+            return DocumentSequenceReservation.objects.create(
+                company_id=doctype.company_id, doctype=doctype, first=first, 
+                last=counter.last, description=description)
+
+    @staticmethod
+    def is_reserved(doctype, sequence) -> bool:
+        """
+        Comprueba si la secuencia pertenece a un rango reservado del tipo y 
+        aún no la usa otro documento.
+        """
+        if not sequence:
+            return False
+        doctype_id = getattr(doctype, "pk", doctype)
+        return (DocumentSequenceReservation.objects.filter(doctype=doctype_id,
+            first__lte=sequence, last__gte=sequence).exists() and 
+            not Document.objects.filter(doctype=doctype_id, 
+            sequence=sequence).exists())
+
+
+class DocumentSequenceReservation(ModelBase):
+    """Rango de secuencias reservado de un tipo de documento."""
+    tags = None
+
+    doctype = models.ForeignKey(DocumentType, on_delete=models.CASCADE, 
+    verbose_name=_l("tipo de documento"))
+
+    first = models.PositiveIntegerField(_l("desde"))
+
+    last = models.PositiveIntegerField(_l("hasta"))
+
+    description = models.CharField(_l("descripción"), max_length=100, 
+    blank=True, help_text=_l("por ejemplo, la terminal que usará el rango."))
+
+    create_date = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        verbose_name = _l("reserva de secuencias")
+        verbose_name_plural = _l("reservas de secuencias")
+        ordering = ["doctype", "first"]
+
+    def __str__(self):
+        return f"{self.doctype} {self.first}-{self.last}"
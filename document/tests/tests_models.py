@@ -2,13 +2,15 @@ import copy
 from decimal import Decimal
 
 from django.core.exceptions import ValidationError
+from django.utils import timezone
 
 from base.tests import BaseTestCase
-from document.models import DocumentType, Document
+from document.models import DocumentType, Document, DocumentSequence
 from company.tests.tests_models import get_or_create_company
 from warehouse.tests.tests_models import get_or_create_warehouse
 from inventory.models import (Item, ItemGroup, ItemFamily, Movement)
-from finance.models import Tax
+from finance.models import (Tax, Transaction, TaxReceipt, 
+    TaxReceiptAuthorization)
 
 
 def get_or_create_document():
@@ -77,6 +79,66 @@ class DocumentModelTest(BaseTestCase):
         self.assertEqual(nextn, 50008)
         self.test_str_method(document_2, "TEST-000000050007")
 
+    def test_sequence_counter(self):
+        """La secuencia se asigna del contador, aunque se eliminen documentos."""
+        doctype = self.document.doctype
+        document = copy.copy(self.document)
+        document.pk = None
+        document.number = None
+        document.save()
+        self.assertEqual(document.sequence, self.document.sequence + 1)
+        document.delete()
+
+        document.pk = None
+        document.number = None
+        document.save()
+        self.assertEqual(document.sequence, self.document.sequence + 2)
+        self.assertGreater(DocumentSequence.get_metrics(doctype)["count"], 0)
+
+        # Rango reservado para una terminal sin conexión.
+        reservation = DocumentSequence.reserve(doctype, 10, "caja 2")
+        self.assertEqual(reservation.first, document.sequence + 1)
+        offline = copy.copy(self.document)
+        offline.pk = None
+        offline.number = None
+        offline.sequence = reservation.first + 5
+        offline.save()
+        self.assertEqual(offline.sequence, reservation.first + 5)
+
+        document.pk = None
+        document.number = None
+        document.save()
+        self.assertEqual(document.sequence, reservation.last + 1)
+
+    def test_tax_receipt_number_is_allocated(self):
+        """
+        El comprobante no se asigna al crear el documento, sino con 
+        allocate_tax_receipt_number (al imprimir).
+        """
+        doctype = self.document.doctype
+        doctype.tax_receipt = TaxReceipt.objects.create(
+            company=doctype.company, code="01", name="test")
+        doctype.save()
+        document = copy.copy(self.document)
+        document.pk = None
+        document.number = None
+        # Sin comprobantes disponibles el documento se registra igualmente.
+        document.save()
+        self.assertIsNone(document.tax_receipt_number)
+        self.assertRaises(ValidationError, 
+            document.allocate_tax_receipt_number)
+
+        TaxReceiptAuthorization.objects.create(
+            tax_receipt=doctype.tax_receipt, authorization="1", 
+            authorization_date=timezone.localdate(), first_receipt="B0100000001",
+            last_receipt="B0100000005", lazy=True)
+        document.allocate_tax_receipt_number()
+        self.assertEqual(str(document.tax_receipt_number), "B0100000001")
+        # Una segunda llamada no le asigna otro comprobante.
+        document = Document.objects.get(pk=document.pk)
+        self.assertEqual(str(document.allocate_tax_receipt_number()), 
+            "B0100000001")
+
     def test_calculate_method(self):
         dic = self.document.calculate()
 
@@ -97,6 +159,30 @@ class DocumentModelTest(BaseTestCase):
         self.assertEqual(dic["tax"], self.document.tax)
         self.assertEqual(dic["total"], self.document.total)
 
+    def test_deferred_totals(self):
+        document = copy.copy(self.document)
+        document.pk = None
+        document.clean()
+        document.save()
+        item = Item.objects.create(company=document.doctype.company, 
+            name="test", codename="test")
+
+        with Document.deferred_totals():
+            with document.deferred_totals():
+                movements = [Movement.objects.create(document=document, 
+                    item=item, quantity=1, price=10, discount=0) 
+                    for i in range(3)]
+                movements[0].delete()
+            document.refresh_from_db()
+            self.assertIsNone(document.total)
+        document.refresh_from_db()
+        self.assertEqual(document.total, 20)
+
+        # Al eliminar fuera del bloque el documento se calcula de inmediato.
+        movements[1].delete()
+        document.refresh_from_db()
+        self.assertEqual(document.total, 10)
+
     def test_get_balance_method(self):
         document = copy.copy(self.document)
         document.pk = None
@@ -125,7 +211,47 @@ class DocumentModelTest(BaseTestCase):
         # Nota: convertimos a float porque hemos recibido tipos diferentes.
         self.assertEqual(float(balance), float(document.get_balance()))
 
-    
+    def test_paid_and_balance_follow_transactions(self):
+        document = copy.copy(self.document)
+        document.pk = None
+        document.clean()
+        document.save()
+        item = Item.objects.create(company=document.doctype.company,
+            name="test", code="test", codename="test", description="test")
+        Movement.objects.create(document=document, item=item, quantity=2,
+            price=50, discount=0)
+        document.refresh_from_db()
+        self.assertEqual(document.balance, 100)
+
+        transaction = Transaction(document=document, entry_amount=30)
+        transaction.save()
+        document.refresh_from_db()
+        self.assertEqual((document.paid, document.balance), (30, 70))
+        self.assertIn(document, Document.objects.filter(balance__gt=0))
+
+        # Guardar una instancia desactualizada no sobrescribe los pagos.
+        stale = Document.objects.get(pk=document.pk)
+        Transaction.objects.create(document=document, entry_amount=70)
+        stale.note = "test"
+        stale.save()
+        document.refresh_from_db()
+        self.assertEqual((document.paid, document.balance), (100, 0))
+        self.assertNotIn(document, Document.objects.filter(balance__gt=0))
+
+        transaction.delete()
+        document.refresh_from_db()
+        self.assertEqual((document.paid, document.balance), (70, 30))
+
+        # Las diferencias se detectan y se corrigen.
+        qs = Document.objects.filter(pk=document.pk)
+        qs.update(paid=0, balance=0)
+        drift = Document.get_payments_drift(qs)
+        self.assertEqual([(d.real_paid, d.real_balance) for d in drift],
+            [(70, 30)])
+        Document.update_payments_for(qs)
+        self.assertFalse(Document.get_payments_drift(qs).exists())
+
+
 class DocumentTypeTest(BaseTestCase):
 
     def setUp(self):
@@ -1,11 +1,21 @@
+import copy
+import json
+from unittest import mock
+
+from django.db import connection
 from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse, reverse_lazy
+from django.utils import timezone
 
 from user.models import User
 from document.models import Document
+from document.views import DocumentPrintView
 from user.tests.tests_models import get_or_create_user
 from document.tests.tests_models import get_or_create_document
 from warehouse.tests.tests_models import get_or_create_warehouse
+from finance.models import TaxReceipt, TaxReceiptAuthorization
+from module.models import Module
 
 
 class DocumentUpdateViewTest(TestCase):
@@ -106,3 +116,217 @@ class DocumentUpdateViewTest(TestCase):
 
 
 
+
+
+class DocumentPrintViewTest(TestCase):
+    """Prueba para la vista DocumentPrintView."""
+
+    def setUp(self):
+        self.document = get_or_create_document()
+        self.document.doctype.company.users.add(get_or_create_user())
+        self.client.login(username="test", password="test")
+        self.url = reverse("document-document-print", kwargs={
+            "company": self.document.doctype.company.pk, 
+            "generictype": self.document.doctype.generic,
+            "pk": self.document.pk})
+
+    def test_tax_receipt_number_is_allocated_on_print(self):
+        """
+        Al imprimir se asigna el comprobante. Si no hay disponibles se vuelve
+        al documento con un mensaje y no se imprime.
+        """
+        doctype = self.document.doctype
+        doctype.tax_receipt = TaxReceipt.objects.create(
+            company=doctype.company, code="01", name="test")
+        doctype.save()
+        response = self.client.get(self.url)
+        self.assertRedirects(response, self.document.get_absolute_url(), 
+            fetch_redirect_response=False)
+        self.document.refresh_from_db()
+        self.assertIsNone(self.document.tax_receipt_number)
+
+        TaxReceiptAuthorization.objects.create(
+            tax_receipt=doctype.tax_receipt, authorization="1", 
+            authorization_date=timezone.localdate(), first_receipt="B0100000001",
+            last_receipt="B0100000005", lazy=True)
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 200)
+        self.document.refresh_from_db()
+        self.assertEqual(str(self.document.tax_receipt_number), "B0100000001")
+
+    def test_unauthorized_print_does_not_allocate(self):
+        """
+        Sin permiso para imprimir no se asigna el comprobante ni avanza la 
+        secuencia de la autorización.
+        """
+        doctype = self.document.doctype
+        doctype.tax_receipt = TaxReceipt.objects.create(
+            company=doctype.company, code="01", name="test")
+        doctype.save()
+        authorization = TaxReceiptAuthorization.objects.create(
+            tax_receipt=doctype.tax_receipt, authorization="1", 
+            authorization_date=timezone.localdate(), first_receipt="B0100000001",
+            last_receipt="B0100000005", lazy=True)
+        next_sequence = authorization.next_sequence
+
+        with mock.patch.object(DocumentPrintView, 
+            "company_permission_required", "document.view_document"):
+            response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 403)
+        authorization.refresh_from_db()
+        self.assertEqual(authorization.next_sequence, next_sequence)
+        self.document.refresh_from_db()
+        self.assertIsNone(self.document.tax_receipt_number)
+
+
+class DocumentDetailJsonViewTest(TestCase):
+    """Prueba para la vista document_detail_jsonview."""
+
+    def setUp(self):
+        self.document = get_or_create_document()
+        self.document.doctype.company.users.add(get_or_create_user())
+        self.client.login(username="test", password="test")
+        self.url = reverse("api-document-document-detail", kwargs={
+            "company": self.document.doctype.company.pk, 
+            "document": self.document.pk})
+
+    def test_conditional_get(self):
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 200)
+        etag = response["ETag"]
+        total = response.json()["data"]["document"]["total"]
+
+        # Sin cambios se responde 304 y no se modifica el documento.
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.document.refresh_from_db()
+        self.assertEqual(self.document.total, total)
+
+        # Al modificar el documento cambia la versión.
+        self.document.note = "cambio"
+        self.document.save()
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response["ETag"], etag)
+
+    def test_balance_is_the_stored_balance(self):
+        """El saldo es el guardado en el documento, no se recalcula."""
+        Document.objects.filter(pk=self.document.pk).update(balance=123)
+        response = self.client.get(self.url)
+        self.assertEqual(float(response.json()["data"]["document"][
+            "balance"]), 123)
+
+
+class DocumentListViewTest(TestCase):
+    """Prueba para la vista DocumentListView."""
+
+    def setUp(self):
+        self.document = get_or_create_document()
+        self.document.doctype.company.users.add(get_or_create_user())
+        self.client.login(username="test", password="test")
+        self.url = reverse("document-document-list", kwargs={
+            "company": self.document.doctype.company.pk, 
+            "generictype": self.document.doctype.generic})
+
+    def get_query_count(self):
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 200)
+        return len(context)
+
+    # El árbol de módulos no debe comprobar su versión durante la prueba.
+    @mock.patch.object(Module, "TREE_CHECK_INTERVAL", 3600)
+    def test_query_count_does_not_depend_on_rows(self):
+        self.get_query_count() # Primero se llenan las cachés.
+        count = self.get_query_count()
+        for i in range(5):
+            document = copy.copy(self.document)
+            document.pk = None
+            document.number = None
+            document.save()
+        self.assertEqual(self.get_query_count(), count)
+
+    def test_list_display_plan(self):
+        """Las columnas se compilan una vez y derivan los select_related."""
+        from document.views import DocumentListView
+
+        view = DocumentListView()
+        view._setup(generictype=self.document.doctype.generic)
+        plan = view.get_list_display_plan(Document)
+        self.assertIs(plan, view.get_list_display_plan(Document))
+        self.assertIn("warehouse", plan["select_related"])
+        document = view.annotate_list_display(Document.objects.filter(
+            pk=self.document.pk)).select_related("doctype").get()
+        with self.assertNumQueries(0):
+            values = view.get_list_display_values(document)
+        self.assertEqual(values["get_number"]["value"], document.get_number())
+
+        # Cada vista guarda sus planes, hasta LIST_DISPLAY_PLANS_MAX.
+        from unoletutils.views import ListView
+        self.assertIn(Document, [key[0] for key in 
+            DocumentListView._list_display_plans])
+        self.assertFalse(ListView._list_display_plans)
+        with mock.patch.object(DocumentListView, "LIST_DISPLAY_PLANS_MAX", 0):
+            DocumentListView._list_display_plans.clear()
+            plan = view.get_list_display_plan(Document)
+            self.assertIsNot(plan, view.get_list_display_plan(Document))
+            self.assertFalse(DocumentListView._list_display_plans)
+
+    def test_object_capsule_looks_up_view_first(self):
+        """La cápsula busca los atributos en la vista y luego en el objeto."""
+        from document.views import DocumentListView
+        from unoletutils.views import ObjectCapsule
+
+        view = DocumentListView()
+        self.document.title = "object"
+        capsule = ObjectCapsule(view, self.document)
+        self.assertEqual(capsule.title, view.title)
+        self.assertEqual(capsule.pk, self.document.pk)
+        self.assertEqual(capsule.get_number(), self.document.get_number())
+
+    def test_cursor_pagination(self):
+        from unoletutils.views import CursorPaginator
+
+        for i in range(4):
+            document = copy.copy(self.document)
+            document.pk = None
+            document.number = None
+            document.save()
+        queryset = Document.objects.all()
+        expected = list(queryset.order_by("-create_date", "-id"))
+        paginator = CursorPaginator(queryset, 2, ("-create_date", "-id"))
+
+        # Hacia adelante todas las páginas, y de vuelta hacia atrás.
+        pages = [paginator.page()]
+        while pages[-1].has_next():
+            pages.append(paginator.page(pages[-1].get_next_cursor()))
+        self.assertEqual([obj for page in pages for obj in page], expected)
+        self.assertFalse(pages[0].has_previous())
+        page = paginator.page(pages[-1].get_previous_cursor())
+        self.assertEqual(list(page), list(pages[-2]))
+
+        # Un cursor no válido muestra la primera página.
+        self.assertEqual(list(paginator.page("x")), list(pages[0]))
+
+        response = self.client.get(self.url, {"cursor": 
+            pages[0].get_next_cursor()})
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.context["page_obj"].is_cursor)
+        # El total se guarda en la caché, se muestra como aproximado.
+        self.assertTrue(response.context["paginator"].count_is_approximate)
+
+    def test_export(self):
+        response = self.client.get(self.url, {"export": "csv"})
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.streaming)
+        lines = b"".join(response.streaming_content).decode().splitlines()
+        self.assertEqual(len(lines), 1 + Document.objects.filter(
+            doctype__generic=self.document.doctype.generic).count())
+        self.assertIn(str(self.document), lines[1])
+
+        response = self.client.get(self.url, {"export": "ndjson"})
+        rows = b"".join(response.streaming_content).decode().splitlines()
+        self.assertEqual(json.loads(rows[0])["get_number"], str(self.document))
+
+        response = self.client.get(self.url, {"export": "pdf"})
+        self.assertEqual(response.status_code, 404)
@@ -1,11 +1,15 @@
-from django.shortcuts import render, get_object_or_404
+from django.shortcuts import render, get_object_or_404, redirect
 from django.views.generic import (DetailView, UpdateView, CreateView, ListView)
 from django.utils.translation import gettext as _
 from django.utils.translation import gettext_lazy as _l
 from django.urls import reverse_lazy
 from django.http import JsonResponse, Http404
-from django.db.models import Sum, F
+from django.db.models import Sum, F, Count
+from django.db.models.functions import Coalesce
+from django.views.decorators.http import condition
 from django.core import serializers
+from django.core.exceptions import ValidationError
+from django.contrib import messages
 
 from dal import autocomplete
 
@@ -100,8 +104,23 @@ class DocumentListView(BaseDocument, ListView):
 
     list_display = LIST_DISPLAY_DICT[None]
 
+    # El nombre de la persona se obtiene en la misma consulta del listado 
+    # (ver BaseList.list_display_annotations). El balance está guardado en 
+    # el documento.
+    list_display_annotations = {
+        "get_person_name": Coalesce("person__name", "person_name"),
+    }
+
+    list_select_related = ("doctype", "warehouse", "transfer_warehouse")
+
     list_display_links = ("get_number",)
 
+    # Paginación por cursor sobre el índice (create_date, id), con el total 
+    # de registros guardado un minuto en la caché.
+    pagination_mode = ListView.CURSOR
+    cursor_ordering = ("-create_date", "-id")
+    list_count_timeout = 60
+
     list_display_cssclass = {
         "amount": "text-end intcomma",
         "discount": "text-end intcomma",
@@ -189,6 +208,18 @@ class DocumentPrintView(BaseDocument, DetailPrintView):
     """Imprime un documento."""
     model = Document
 
+    def get(self, request, *args, **kwargs):
+        # El comprobante fiscal se asigna al imprimir el documento por primera
+        # vez, luego de que dispatch comprueba los permisos. Si no hay 
+        # comprobantes disponibles no se imprime.
+        document = self.get_object()
+        try:
+            document.allocate_tax_receipt_number()
+        except (ValidationError) as e:
+            messages.error(request, " ".join(e.messages))
+            return redirect(document.get_absolute_url())
+        return super().get(request, *args, **kwargs)
+
     def get_template_names(self):
         templates = [f"document/document/print.html"]
         if self.generictype:
@@ -198,27 +229,53 @@ class DocumentPrintView(BaseDocument, DetailPrintView):
 
 # Json Views.
 
-def document_detail_jsonview(request, company: int, 
-    document: int) -> JsonResponse:
-    """Retorna el detalle del documento junto a sus movimientos y notas."""
-
-    company = get_object_or_404(Company, pk=company)
-    document = get_object_or_404(Document, pk=document)
-
-    if not company.user_has_access(request.user):
-        raise Http404("El usuario no tiene acceso a esta empresa.")
-
-    if company != document.doctype.company:
-        raise Http404(f"El documento {document} no pertenece a esta empresa.")
-
+def get_document_version(request, company: int, document: int) -> dict:
+    """
+    Obtiene (una sola vez por solicitud) la versión y la fecha de 
+    modificación del documento, para las cabeceras ETag y Last-Modified.
+    """
+    if not hasattr(request, "_document_version"):
+        request._document_version = None
+        # Sin acceso no se responden las cabeceras, y la vista dará el 404.
+        company = Company.objects.filter(pk=company).first()
+        if company and company.user_has_access(request.user):
+            request._document_version = Document.objects.filter(
+                doctype__company=company, pk=document).values("version", 
+                "update_date").first()
+    return request._document_version
+
+
+def document_etag(request, company: int, document: int) -> str:
+    version = get_document_version(request, company, document)
+    if version:
+        return f"{document}-{version['version']}"
+
+
+def document_last_modified(request, company: int, document: int):
+    version = get_document_version(request, company, document)
+    if version:
+        return version["update_date"]
+
+
+def get_document_detail_data(document) -> dict:
+    """
+    Obtiene el detalle del documento, sus movimientos, totales y notas para 
+    document_detail_jsonview. Solo realiza lecturas: el documento debe 
+    obtenerse con select_related (ver document_detail_jsonview).
+    """
     movement_qs = document.get_movements().annotate(
         amount=F("quantity") * F("price") - F("discount"), 
         total=F("amount") + F("tax"))
 
     doctype = document.doctype
-    tax_receipt = getattr(doctype, "tax_receipt", None)
+    tax_receipt = doctype.tax_receipt
+    payments_sum = document.get_payments_sum()
+
+    totals = movement_qs.order_by().aggregate(count=Count("id"), 
+        discount=Sum("discount"), tax=Sum("tax"), amount=Sum("amount"), 
+        total=Sum("total"))
 
-    out = {
+    return {
         "document": {
             "id": document.id,
             "warehouse": str(document.warehouse),
@@ -246,6 +303,7 @@ def document_detail_jsonview(request, company: int,
             "total": document.total,
             "create_user": str(document.create_user),
             "create_date": document.create_date,
+            "version": document.version,
             "doctype": str(document.doctype),
             "doctype_id": document.doctype.id,
             "doctype__code": doctype.code,
@@ -258,25 +316,42 @@ def document_detail_jsonview(request, company: int,
             "doctype__tax_receipt__name": getattr(tax_receipt, "name", None),
             "doctype__tax_receipt__is_active": getattr(
                 tax_receipt, "is_active", False),
-            "payments_sum": document.get_payments_sum(),
+            "payments_sum": payments_sum,
+            # Los pagos y el saldo se mantienen en el documento (ver 
+            # Document.update_payments).
             "balance": document.get_balance(),
         },
         "movements": list(movement_qs.values("id", "number", "item_id",
             "item__codename", "item__name", "name", "quantity", "price",
             "discount", "tax", "amount", "total")
         ),
-        "totals": {
-            "count": movement_qs.count(),
-            "discount": movement_qs.aggregate(s=Sum("discount"))["s"] or 0,
-            "tax": movement_qs.aggregate(s=Sum("tax"))["s"] or 0,
-            "amount": movement_qs.aggregate(s=Sum("amount"))["s"] or 0,
-            "total": movement_qs.aggregate(s=Sum("total"))["s"] or 0,
-        },
+        "totals": {k: v or 0 for k, v in totals.items()},
         "notes": list(document.documentnote_set.all().values("id", "content", 
             "create_user", "create_date", "username")),
     }
 
-    return JsonResponse({"data": out})
+
+@condition(etag_func=document_etag, last_modified_func=document_last_modified)
+def document_detail_jsonview(request, company: int, 
+    document: int) -> JsonResponse:
+    """
+    Retorna el detalle del documento junto a sus movimientos y notas. 
+
+    Responde con las cabeceras ETag y Last-Modified según la versión del 
+    documento, de modo que las consultas repetidas sin cambios obtienen un 
+    304 sin volver a construir el detalle.
+    """
+    company = get_object_or_404(Company, pk=company)
+
+    if not company.user_has_access(request.user):
+        raise Http404("El usuario no tiene acceso a esta empresa.")
+
+    document = get_object_or_404(Document.objects.select_related(
+        "warehouse", "transfer_warehouse", "person", "currency", 
+        "tax_receipt_number", "create_user", "doctype__tax_receipt"), 
+        doctype__company=company, pk=document)
+
+    return JsonResponse({"data": get_document_detail_data(document)})
 
 
 def document_note_create_jsonview(request, company, document) -> JsonResponse:
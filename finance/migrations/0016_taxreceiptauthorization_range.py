@@ -0,0 +1,38 @@
+# Generated by Django 3.1.14 on 2026-10-18 17:01
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('finance', '0015_auto_20210124_2044'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='taxreceiptauthorization',
+            name='first_sequence',
+            field=models.IntegerField(editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='taxreceiptauthorization',
+            name='last_sequence',
+            field=models.IntegerField(editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='taxreceiptauthorization',
+            name='lazy',
+            field=models.BooleanField(default=False, help_text='si se marca, solo se guarda el rango y cada comprobante se registra cuando se asigna a un documento.', verbose_name='asignar por rango'),
+        ),
+        migrations.AddField(
+            model_name='taxreceiptauthorization',
+            name='next_sequence',
+            field=models.IntegerField(editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='taxreceiptauthorization',
+            name='serie',
+            field=models.CharField(blank=True, editable=False, max_length=1),
+        ),
+    ]
@@ -0,0 +1,36 @@
+from django.db import migrations
+from django.db.models import Max
+
+
+def populate_range(apps, schema_editor):
+    """
+    Establece el rango y el cursor de las autorizaciones ya registradas. El
+    cursor queda después del último comprobante asignado a un documento.
+    """
+    TaxReceiptAuthorization = apps.get_model("finance", 
+        "TaxReceiptAuthorization")
+    TaxReceiptNumber = apps.get_model("finance", "TaxReceiptNumber")
+
+    for authorization in TaxReceiptAuthorization.objects.all():
+        first = int(authorization.first_receipt[3:])
+        last = int(authorization.last_receipt[3:])
+        used = TaxReceiptNumber.objects.filter(authorization=authorization, 
+            document__isnull=False).aggregate(s=Max("sequence"))["s"]
+        authorization.serie = authorization.first_receipt[0]
+        authorization.first_sequence = first
+        authorization.last_sequence = last
+        authorization.next_sequence = int(used) + 1 if used else first
+        authorization.save(update_fields=("serie", "first_sequence", 
+            "last_sequence", "next_sequence"))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('document', '0029_populate_document_paid_balance'),
+        ('finance', '0016_taxreceiptauthorization_range'),
+    ]
+
+    operations = [
+        migrations.RunPython(populate_range, migrations.RunPython.noop),
+    ]
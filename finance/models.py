@@ -1,6 +1,7 @@
 from decimal import Decimal, DecimalException
 
-from django.db import models, IntegrityError
+from django.db import models, IntegrityError, transaction, router
+from django.db.models import Sum, F, Q
 from django.utils import timezone
 from django.core.exceptions import ValidationError
 from django.core.validators import (MinValueValidator, MaxValueValidator, 
@@ -181,6 +182,41 @@ class TaxReceipt(ModelBase):
     def clean(self):
         self.name = self.strip(self.name).lower()
 
+    def get_available(self) -> int:
+        """
+        Obtiene la cantidad de comprobantes disponibles, sumando el cursor de 
+        cada autorización vigente (sin contar comprobantes).
+        """
+        qs = TaxReceiptAuthorization.get_open(self)
+        return qs.aggregate(s=Sum(F("last_sequence") - F("next_sequence") + 1)
+            )["s"] or 0
+
+    def get_days_to_expiry(self):
+        """
+        Obtiene los días que faltan para el vencimiento de la autorización 
+        que se está consumiendo, o None si no vence o no hay disponibles.
+        """
+        authorization = TaxReceiptAuthorization.get_open(self).first()
+        if authorization:
+            return authorization.get_days_to_expiry()
+
+    def get_notifications(self) -> list:
+        """
+        Obtiene los avisos para el usuario según min_available_to_notify y 
+        min_days_before_expiration_to_notify.
+        """
+        out = []
+        available = self.get_available()
+        if available <= self.min_available_to_notify:
+            out.append(_(f"Quedan {available:,} comprobantes disponibles de "
+                f"'{self}'."))
+        days = self.get_days_to_expiry()
+        if (days is not None) and (
+            days <= self.min_days_before_expiration_to_notify):
+            out.append(_(f"Los comprobantes de '{self}' vencen en {days} "
+                "días."))
+        return out
+
     @classmethod
     def validate_tax_receipt_number(cls, ncf: str, code: str=None) -> str:
         """Valida el formato del número de comprobante fiscal indicado."""
@@ -246,10 +282,8 @@ class TaxReceiptNumber(ModelBase):
     sequence = models.CharField(max_length=8,
     validators=[MinLengthValidator(8), MaxLengthValidator(8)])
 
-    # Es null debido a la forma en que trabaja Unolet para crear los ncf a partir
-    # de una AutorizacionNCF. La creación de los ncf se crean en la validación
-    # de la AutorizacionNCF, y luego en AutorizacionNCF.save() se establece la
-    # autorización a todos los ncf que se crearon para la misma.
+    # Los ncf se crean en TaxReceiptAuthorization.save(), ya asignados a la 
+    # autorización (ver TaxReceiptAuthorization.create_tax_receipts).
     authorization = models.ForeignKey("finance.TaxReceiptAuthorization", 
     on_delete=models.CASCADE, null=True)
 
@@ -285,10 +319,12 @@ class TaxReceiptAuthorization(ModelBase):
     # Establecemos un límite para el registro de los comprobantes fiscales.
     # debido a posibles limitaciones en el servidor, de modo que el límite 
     # de NCF en una autorización no puede exceder la cantidad máxima.
-    # Hemos medido con timeit el tiempo cuando se indica exactamente un rango
-    # de 50,000 comprobantes y el resultado arrojo 15 segundos aprox.
-    # Este parece ser un límite apropiado.
-    RECORD_LIMIT_FOR_AUTHORIZATION = 50000
+    # Los comprobantes se insertan por lotes (ver create_tax_receipts), así 
+    # un rango de 1,000,000 se registra en segundos.
+    RECORD_LIMIT_FOR_AUTHORIZATION = 1000000
+
+    # Cantidad de comprobantes por lote en create_tax_receipts.
+    BATCH_SIZE = 5000
 
     company = None # La empersa será tax_receipt.company}
     tags = None
@@ -313,6 +349,29 @@ class TaxReceiptAuthorization(ModelBase):
     last_receipt = models.CharField(_l("comprobante final"), 
     max_length=11, help_text=_l("número de comprobante final."))
 
+    lazy = models.BooleanField(_l("asignar por rango"), default=False,
+    help_text=_l("si se marca, solo se guarda el rango y cada comprobante se "
+    "registra cuando se asigna a un documento."))
+
+    # Rango y cursor de consumo. Se establecen al crear la autorización.
+    serie = models.CharField(max_length=1, editable=False, blank=True)
+
+    first_sequence = models.IntegerField(editable=False, null=True)
+
+    last_sequence = models.IntegerField(editable=False, null=True)
+
+    # Siguiente secuencia a asignar. Se modifica solo en allocate.
+    next_sequence = models.IntegerField(editable=False, null=True)
+
+    # Campos que definen el rango, que no se pueden modificar una vez creada 
+    # la autorización porque sus comprobantes ya se generaron o asignaron.
+    RANGE_FIELDS = ("tax_receipt_id", "first_receipt", "last_receipt", "lazy")
+    # Campos del rango y el cursor, que se establecen solo al crearla (o con 
+    # update en allocate), por lo que una instancia desactualizada no debe 
+    # sobrescribirlos al guardarse.
+    SEQUENCE_FIELDS = ("serie", "first_sequence", "last_sequence", 
+        "next_sequence")
+
     class Meta:
         verbose_name = _l("autorización de comprobantes fiscales")
         verbose_name_plural = _l("autorizaciones de comprobantes fiscales")
@@ -349,86 +408,130 @@ class TaxReceiptAuthorization(ModelBase):
         self.last_receipt = self.validate_tax_receipt_number(self.last_receipt)
 
         self.validate_tax_receipt_range()
-        self.create_tax_receipts()
+        self.validate_tax_receipt_duplicates()
 
     def validate_tax_receipt_number(self, number: str) -> str:
         return self.tax_receipt.validate_tax_receipt_number(number)
 
-    def validate_tax_receipt_range(self):
-        """
-        Valida que el rango de comprobantes esté correcto y no estén creados.
-        """
+    def get_tax_receipt_range(self) -> range:
+        """Obtiene el rango de secuencias (int) de los comprobantes."""
         try:
             first = int(self.first_receipt[3:])
             last = int(self.last_receipt[3:])
         except (ValueError) as e:
-            print(e)
             raise ValidationError(_("La secuencia debe ser numérica.")) from e
+        return range(first, last + 1)
 
-        if (first > last):
+    def validate_tax_receipt_range(self):
+        """Valida que el rango de comprobantes esté correcto."""
+        numbers_range = self.get_tax_receipt_range()
+
+        if (not numbers_range):
             raise ValidationError(_("El comprobante final debe ser mayor o "
                 "igual al comprobante inicial."))
+        if (self.first_receipt[0] != self.last_receipt[0]):
+            raise ValidationError(_("El comprobante inicial y el final deben "
+                "ser de la misma serie."))
         # Establecemos un límite para el registro de los comprobantes fiscales.
         # debido a posibles limitaciones en el servidor, de modo que el límite 
         # de NCF en una autorización no puede exceder la cantidad máxima.
-        if ((last - first + 1) > self.RECORD_LIMIT_FOR_AUTHORIZATION):
+        if (len(numbers_range) > self.RECORD_LIMIT_FOR_AUTHORIZATION):
             raise ValidationError(_("La cantidad de NCFs a registrar "
-            f"({last - first:,}) excede la cantidad máxima permitida para el "
-            "registro de NCFs en una sola autorización. La cantidad máxima es "
-            f"{self.RECORD_LIMIT_FOR_AUTHORIZATION:,}. Revise nuevamente el "
-            "documento que contiene la autorización que intenta registrar. Si "
-            "todo está correcto entonces comuníquese con Soporte Técnico para "
-            "más información."))
-        
-    def create_tax_receipts(self):
-        """Valida y crea los comprobantes del rango."""
-        serie = self.first_receipt[0]
-        try:
-            first = int(self.first_receipt[3:])
-            last = int(self.last_receipt[3:])
-        except (ValueError) as e:
-            print(e)
-            raise ValidationError(_("La secuencia debe ser numérica.")) from e
-        # Almacena los ids de los NCF que se van creando, 
-        # para eliminarlos luego en caso de error.
-        self._ids = []
-        numbers_range = range(first, last + 1)
-        for n in numbers_range:
-            ncf = TaxReceiptNumber()
-            ncf.serie = serie
-            ncf.sequence = f"{n:>08}"
-            ncf.tax_receipt = self.tax_receipt
-            # ncf.authorization = self # la establecemos en el save()
-
-            try:
-                ncf.clean()
-                ncf.save() # Guardamos para que Django valide UNIQUE.
-            except (BaseException) as e:
-                # En caso de algún error al crear un NCF, se eliminarán todos.
-                try:
-                    TaxReceiptNumber.objects.filter(id__in=self._ids).delete()
-                except (BaseException) as e2:
-                    e = f'{e}. {e2}'
-                del self._ids
-
-                raise ValidationError(_("Ha ocurrido un error intentando "
-                    f"generar las secuencias de los comprobantes fiscales. "
-                    f"'{e}'."))
-            else:
-                self._ids.append(ncf.id)
+            f"({len(numbers_range):,}) excede la cantidad máxima permitida "
+            "para el registro de NCFs en una sola autorización. La cantidad "
+            f"máxima es {self.RECORD_LIMIT_FOR_AUTHORIZATION:,}. Revise "
+            "nuevamente el documento que contiene la autorización que intenta "
+            "registrar. Si todo está correcto entonces comuníquese con Soporte "
+            "Técnico para más información."))
+
+    def validate_tax_receipt_duplicates(self):
+        """
+        Valida, en una sola consulta, que ningún comprobante del rango esté 
+        registrado. Los números tienen longitud fija, así que el rango se 
+        compara como texto.
+        """
+        serie, code = self.first_receipt[0], self.tax_receipt.code
+        numbers_range = self.get_tax_receipt_range()
+        duplicate = TaxReceiptNumber.objects.filter(
+            tax_receipt=self.tax_receipt, 
+            number__gte=f"{serie}{code}{numbers_range[0]:>08}",
+            number__lte=f"{serie}{code}{numbers_range[-1]:>08}",
+        ).exclude(authorization=self.pk).order_by("number").values_list(
+            "number", flat=True).first()
+        if duplicate:
+            raise ValidationError(_("Ya existen comprobantes registrados en "
+                f"este rango, a partir de '{duplicate}'."))
+
+        # Las autorizaciones por rango no registran sus comprobantes.
+        other = TaxReceiptAuthorization.objects.filter(
+            tax_receipt=self.tax_receipt, serie=serie, 
+            first_sequence__lte=numbers_range[-1], 
+            last_sequence__gte=numbers_range[0]).exclude(pk=self.pk).first()
+        if other:
+            raise ValidationError(_("El rango se superpone con el de la "
+                f"autorización {other}."))
+
+    def create_tax_receipts(self, using=None):
+        """
+        Crea los comprobantes del rango, ya asignados a esta autorización.
+
+        Los números se construyen directamente (el formato del rango ya fue 
+        validado en clean) y se insertan con bulk_create por lotes de 
+        BATCH_SIZE, en la base de datos de la autorización y dentro de la 
+        transacción de save. TaxReceiptNumber no tiene historial, por lo que
+        no hay registros históricos que crear.
+        """
+        serie, code = self.first_receipt[0], self.tax_receipt.code
+        using = using or self._state.db
+        receipts = []
+        for n in self.get_tax_receipt_range():
+            sequence = f"{n:>08}"
+            receipts.append(TaxReceiptNumber(
+                number=f"{serie}{code}{sequence}", serie=serie, 
+                sequence=sequence, tax_receipt_id=self.tax_receipt_id, 
+                authorization=self))
+        TaxReceiptNumber.objects.using(using).bulk_create(receipts, 
+            batch_size=self.BATCH_SIZE)
+
+    def validate_range_unchanged(self):
+        """Valida que el rango no se haya modificado desde su creación."""
+        stored = type(self).objects.filter(pk=self.pk).values(
+            *self.RANGE_FIELDS).first()
+        if stored and any(stored[name] != getattr(self, name) 
+            for name in self.RANGE_FIELDS):
+            raise ValidationError(_("El rango de comprobantes de una "
+                "autorización registrada no se puede modificar."))
 
     def save(self, *args, **kwargs):
-        if self._state.adding:
-            # Establecemos esta autorización a los comprobantes ya creados.
-            if getattr(self, "_ids", None):
-                out = super().save(*args, **kwargs)
-                qs = TaxReceiptNumber.objects.filter(id__in=self._ids)
-                qs.update(authorization=self)
-                del self._ids
-            else:
+        if self.pk:
+            self.validate_range_unchanged()
+            if not kwargs.get("update_fields"):
+                kwargs["update_fields"] = [f.name for f in 
+                    self._meta.concrete_fields if (not f.primary_key) and 
+                    (not f.name in self.SEQUENCE_FIELDS)]
+            return super().save(*args, **kwargs)
+
+        numbers_range = self.get_tax_receipt_range()
+        self.serie = self.first_receipt[0]
+        self.first_sequence = numbers_range[0]
+        self.last_sequence = numbers_range[-1]
+        self.next_sequence = numbers_range[0]
+
+        # La autorización y sus comprobantes se crean en una sola transacción;
+        # si algún comprobante falla no queda nada registrado.
+        using = kwargs.get("using") or router.db_for_write(type(self), 
+            instance=self)
+        try:
+            with transaction.atomic(using=using):
                 out = super().save(*args, **kwargs)
-        else:
-            out = super().save(*args, **kwargs)
+                if not self.lazy:
+                    self.create_tax_receipts(using=using)
+        except (IntegrityError) as e:
+            self.pk = None
+            self._state.adding = True
+            raise ValidationError(_("Ha ocurrido un error intentando "
+                f"generar las secuencias de los comprobantes fiscales. "
+                f"'{e}'.")) from e
         return out
 
     def is_used(self, tax_receipt_number: TaxReceiptNumber) -> bool:
@@ -446,6 +549,63 @@ class TaxReceiptAuthorization(ModelBase):
         except (TypeError):
             return self.expiration_date < timezone.now()
 
+    def get_remaining(self) -> int:
+        """Obtiene la cantidad de comprobantes sin asignar."""
+        return self.last_sequence - self.next_sequence + 1
+
+    def get_days_to_expiry(self):
+        """Obtiene los días que faltan para el vencimiento, o None."""
+        if self.expiration_date:
+            return (self.expiration_date - timezone.localdate()).days
+
+    @classmethod
+    def get_open(cls, tax_receipt) -> models.QuerySet:
+        """
+        Obtiene las autorizaciones del comprobante fiscal con comprobantes 
+        por asignar y sin vencer, en el orden en que se consumen.
+        """
+        return cls.objects.filter(Q(expiration_date__isnull=True) | 
+            Q(expiration_date__gte=timezone.localdate()), 
+            tax_receipt=tax_receipt, 
+            next_sequence__lte=F("last_sequence")).order_by(
+            "authorization_date", "first_sequence", "pk")
+
+    @classmethod
+    def allocate(cls, tax_receipt) -> TaxReceiptNumber:
+        """
+        Asigna el siguiente comprobante del tipo indicado. Toma la primera 
+        autorización disponible con un bloqueo de fila, avanza su cursor y 
+        obtiene el comprobante, que en las autorizaciones por rango se 
+        registra en este momento. Debe llamarse dentro de la transacción en 
+        que se asigna al documento (ver Document.allocate_tax_receipt_number).
+        """
+        with transaction.atomic():
+            authorization = cls.get_open(tax_receipt).select_for_update(
+                ).first()
+            if not authorization:
+                raise ValidationError(_("No hay comprobantes fiscales "
+                    f"disponibles para '{tax_receipt}'."))
+            sequence = authorization.next_sequence
+            cls.objects.filter(pk=authorization.pk).update(
+                next_sequence=sequence + 1)
+            authorization.next_sequence = sequence + 1
+
+            sequence = f"{sequence:>08}"
+            number = f"{authorization.serie}{tax_receipt.code}{sequence}"
+            if not authorization.lazy:
+                # Si el comprobante no fue registrado (p. ej. una generación 
+                # incompleta) se trata igual que un rango agotado, y el 
+                # cursor no avanza porque se revierte la transacción.
+                receipt = TaxReceiptNumber.objects.filter(
+                    tax_receipt=tax_receipt, number=number).first()
+                if not receipt:
+                    raise ValidationError(_("No hay comprobantes fiscales "
+                        f"disponibles para '{tax_receipt}'."))
+                return receipt
+            return TaxReceiptNumber.objects.create(number=number, 
+                serie=authorization.serie, sequence=sequence, 
+                tax_receipt=tax_receipt, authorization=authorization)
+
     def get_all_tax_receipt_number(self) -> models.QuerySet:
         """Obtiene un QuerySet con los objectos de esta autorización."""
         return TaxReceiptNumber.objects.filter(authorization=self)
@@ -536,7 +696,20 @@ class Transaction(ModelBase):
         # El monto lo obtenemos del monto introduccido por la tasa de la moneda.
         self.amount = self.entry_amount * self.currency_rate
 
-        return super().save(*args, **kwargs)
+        # Los pagos y el saldo del documento se actualizan en la misma 
+        # transacción. También forman parte de la versión del documento.
+        with transaction.atomic():
+            out = super().save(*args, **kwargs)
+            self.document.update_payments()
+            self.document.touch(self.document_id)
+        return out
+
+    def delete(self, *args, **kwargs):
+        with transaction.atomic():
+            out = super().delete(*args, **kwargs)
+            self.document.update_payments()
+            self.document.touch(self.document_id)
+        return out
 
     def get_number(self):
         return "P{:0>14}".format(self.id)
@@ -1,5 +1,8 @@
-import timeit
+import copy
+import math
 
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
 from django.utils import timezone
 from django.core.exceptions import ValidationError
 
@@ -90,13 +93,17 @@ class TaxReceiptAuthorizationModelTest(BaseTestCase):
         )
 
     def test_clean_method(self):
-        # En la validación de la autorización se crearán los comprobantes.
+        # La validación no crea los comprobantes, se crean al guardar.
         authorization = self.authorization_unsaved
         authorization.clean()
+        self.assertFalse(TaxReceiptNumber.objects.exists())
 
         # Según el rango indicado en setUp, deberían haberse creado 9 ncfs.
+        authorization.save()
         count = authorization.get_all_tax_receipt_number().count()
         self.assertEqual(count, 9)
+        self.assertEqual(authorization.get_all_tax_receipt_number().first(
+            ).number, "B0100000001")
 
         # Nínguno de los comprobantes ha sido utilizado.
         for receipt in authorization.get_all_tax_receipt_number():
@@ -105,16 +112,47 @@ class TaxReceiptAuthorizationModelTest(BaseTestCase):
         # La autorización no ha expirado.
         self.assertFalse(authorization.is_expired())
 
-        # Si llamamos a clean() nuevamente, se intentará crear los comprobantes
-        # otra vez porque aun la autorización no se ha guardado. Pero los 
-        # comprobantes ya fueron creados, entonces debería recibir un 
-        # ValidationError.
-        self.assertRaises(ValidationError, authorization.clean)
+        # Otra autorización con comprobantes del mismo rango debería recibir 
+        # un ValidationError, y no se crea nada.
+        other = copy.copy(authorization)
+        other.pk = None
+        other.first_receipt = "B0100000005"
+        other.last_receipt = "B0100000020"
+        self.assertRaises(ValidationError, other.clean)
+        self.assertRaises(ValidationError, other.save)
+        self.assertEqual(TaxReceiptNumber.objects.count(), 9)
+        self.assertEqual(TaxReceiptAuthorization.objects.count(), 1)
 
     def test_save_method(self):
         self.authorization_unsaved.clean()
         self.authorization_unsaved.save()
 
+    def test_save_registered_authorization(self):
+        """
+        Una autorización registrada no choca con sus propios comprobantes, 
+        su rango no se puede modificar y guardar una instancia 
+        desactualizada no retrocede el cursor.
+        """
+        authorization = self.authorization_unsaved
+        authorization.clean()
+        authorization.save()
+        authorization.validate_tax_receipt_duplicates()
+
+        stale = TaxReceiptAuthorization.objects.get(pk=authorization.pk)
+        TaxReceiptAuthorization.allocate(authorization.tax_receipt)
+        stale.expiration_date += timezone.timedelta(days=1)
+        stale.save()
+        stale.refresh_from_db()
+        self.assertEqual(stale.next_sequence, 2)
+        self.assertEqual(stale.expiration_date, 
+            authorization.expiration_date + timezone.timedelta(days=1))
+
+        stale.last_receipt = "B0100000020"
+        self.assertRaises(ValidationError, stale.save)
+        stale.refresh_from_db()
+        self.assertEqual(stale.last_receipt, "B0100000009")
+        self.assertEqual(stale.last_sequence, 9)
+
     def test_record_limit_for_authorization(self):
         """
         La variable RECORD_LIMIT_FOR_AUTHORIZATION en el modelo 
@@ -127,13 +165,74 @@ class TaxReceiptAuthorizationModelTest(BaseTestCase):
         self.assertRaises(ValidationError, self.authorization_unsaved.clean)
 
     def test_efficiency_creating_tax_receipt_numbers(self):
-        """Probamos el rendimiento al crear gran cantidad de comprobantes."""
-        # Ya hicimos la prueba con 50,000 y tardó unos 15 segundos.
-        # La prueba con 10,000 no debería pasar de 5 segundos.
+        """Los comprobantes de un rango grande se insertan por lotes."""
         authorization = self.authorization_unsaved
-        authorization.last_receipt = f"B0100010000"
-        duration = timeit.timeit(authorization.clean, number=1)
-        self.assertLess(duration, 5)
+        authorization.last_receipt = f"B0100050000"
+        authorization.clean()
+        # Una consulta por lote de BATCH_SIZE (o menos si la base de datos 
+        # limita la cantidad de parámetros por consulta).
+        fields = [f for f in TaxReceiptNumber._meta.concrete_fields 
+            if not f.primary_key]
+        batch_size = min(authorization.BATCH_SIZE, 
+            connection.ops.bulk_batch_size(fields, range(50000)))
+        batches = math.ceil(50000 / batch_size)
+        with CaptureQueriesContext(connection) as queries:
+            authorization.save()
+        inserts = [q for q in queries.captured_queries 
+            if q["sql"].startswith('INSERT INTO "finance_taxreceiptnumber"')]
+        self.assertEqual(len(inserts), batches)
+        self.assertEqual(authorization.get_all_tax_receipt_number().count(), 
+            50000)
+
+    def test_allocate_method(self):
+        """Los comprobantes se asignan en orden desde el cursor."""
+        authorization = self.authorization_unsaved
+        authorization.lazy = True
+        authorization.clean()
+        authorization.save()
+        # En el modo por rango no se registra ningún comprobante.
+        self.assertFalse(authorization.get_all_tax_receipt_number().exists())
+        tax_receipt = authorization.tax_receipt
+        self.assertEqual(tax_receipt.get_available(), 9)
+        self.assertEqual(tax_receipt.get_days_to_expiry(), 5)
+
+        ncf = TaxReceiptAuthorization.allocate(tax_receipt)
+        self.assertEqual(ncf.number, "B0100000001")
+        self.assertEqual(ncf.authorization, authorization)
+        ncf = TaxReceiptAuthorization.allocate(tax_receipt)
+        self.assertEqual(ncf.number, "B0100000002")
+        authorization.refresh_from_db()
+        self.assertEqual(authorization.get_remaining(), 7)
+        self.assertEqual(tax_receipt.get_available(), 7)
+        # Faltan 5 días para el vencimiento, igual al mínimo para avisar.
+        self.assertEqual(len(tax_receipt.get_notifications()), 1)
+
+        # Un rango que se superpone no se puede registrar.
+        other = copy.copy(authorization)
+        other.pk = None
+        other.first_receipt = "B0100000009"
+        other.last_receipt = "B0100000020"
+        self.assertRaises(ValidationError, other.clean)
+
+        # Al agotarse el rango no se puede asignar.
+        for i in range(7):
+            TaxReceiptAuthorization.allocate(tax_receipt)
+        self.assertEqual(tax_receipt.get_available(), 0)
+        self.assertEqual(len(tax_receipt.get_notifications()), 1)
+        self.assertRaises(ValidationError, TaxReceiptAuthorization.allocate,
+            tax_receipt)
+
+    def test_allocate_method_with_missing_number(self):
+        """Si falta un comprobante registrado no se asigna ni avanza."""
+        authorization = self.authorization_unsaved
+        authorization.clean()
+        authorization.save()
+        authorization.get_all_tax_receipt_number().filter(
+            number="B0100000001").delete()
+        self.assertRaises(ValidationError, TaxReceiptAuthorization.allocate,
+            authorization.tax_receipt)
+        authorization.refresh_from_db()
+        self.assertEqual(authorization.next_sequence, 1)
 
     def test_is_expired_method(self):
         """
@@ -1,6 +1,8 @@
 from django.shortcuts import render, get_object_or_404
 from django.http import JsonResponse
-from django.db.models import Sum, F, Value, When, Case
+from django.db.models import (Sum, F, Q, Value, DecimalField, 
+    FilteredRelation)
+from django.db.models.functions import Coalesce
 from django.utils.translation import gettext as _
 from django.utils.translation import gettext_lazy as _l
 
@@ -9,7 +11,7 @@ from dal import autocomplete
 from unoletutils.libs import text
 from unoletutils import views
 from document.models import Document, DocumentType
-from person.models import Person
+from person.models import Person, PersonBalance
 from finance.models import (Currency, Transaction)
 from finance.forms import TransactionForm
 
@@ -54,15 +56,19 @@ class AccountReceivablePersonBalanceListView(views.ListView):
     title = _l("Personas con balance pendiente de pago")
 
     def get_queryset(self):
-        qs = Person.objects.all()
-        # Solo los tipos de doc. que afectan la cuenta por cobrar.
-        types = DocumentType.TYPES_THAT_CAN_AFFECT_THE_ACCOUNT_RECEIVABLE
+        # Los balances se leen de PersonBalance, una fila por persona.
+        qs = Person.objects.annotate(receivable=FilteredRelation(
+            "personbalance", condition=Q(
+            personbalance__account=PersonBalance.RECEIVABLE)))
+        zero = Value(0, output_field=DecimalField())
         qs = qs.annotate(
-            total=Sum(Case(When(document__doctype__generic__in=types, 
-                then=F("document__total")))),
-            payments=Sum(Case(When(document__doctype__generic__in=types,
-                then=F("document__transaction__amount")))),
-            balance=F("total")-F("payments"),
+            total=Coalesce("receivable__total", zero),
+            payments=Coalesce("receivable__paid", zero),
+            balance=Coalesce("receivable__balance", zero),
+            days_0_30=Coalesce("receivable__days_0_30", zero),
+            days_31_60=Coalesce("receivable__days_31_60", zero),
+            days_61_90=Coalesce("receivable__days_61_90", zero),
+            days_over_90=Coalesce("receivable__days_over_90", zero),
             available=F("credit_limit")-F("balance")
         )
         self.totals = qs.aggregate(
@@ -71,6 +77,10 @@ class AccountReceivablePersonBalanceListView(views.ListView):
             Sum("total"),
             Sum("payments"),
             Sum("balance"),
+            Sum("days_0_30"),
+            Sum("days_31_60"),
+            Sum("days_61_90"),
+            Sum("days_over_90"),
         )
         return qs
 
@@ -92,9 +102,9 @@ class AccountReceivableDocumentListView(views.ListView):
 
     def get_queryset(self):
         qs = Document.accept_payments_objects.all() # Docs que aceptan pagos.
-        qs = qs.annotate(payments=Sum("transaction__amount"))
-        qs = qs.annotate(balance=F("total")-F("payments"))
-        self.totals = qs.aggregate(Sum("total"), Sum("payments"), Sum("balance"))
+        # Los pagos y el saldo están guardados en el documento.
+        qs = qs.annotate(payments=F("paid"))
+        self.totals = qs.aggregate(Sum("total"), Sum("paid"), Sum("balance"))
         return qs
 
 
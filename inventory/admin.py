@@ -1,5 +1,7 @@
 from django.contrib import admin
-from .models import (Item, ItemFamily, ItemGroup, Movement)
+from .models import (Item, ItemFamily, ItemGroup, Movement, StockBalance,
+    StockCheckpoint, CostLayer, CostLayerConsumption, ItemToken,
+    ItemCodeCounter)
 
 
 @admin.register(Item)
@@ -22,4 +24,31 @@ class MovementAdmin(admin.ModelAdmin):
     pass
 
 
+@admin.register(StockBalance)
+class StockBalanceAdmin(admin.ModelAdmin):
+    pass
+
+
+@admin.register(StockCheckpoint)
+class StockCheckpointAdmin(admin.ModelAdmin):
+    pass
+
+
+@admin.register(CostLayer)
+class CostLayerAdmin(admin.ModelAdmin):
+    pass
+
 
+@admin.register(CostLayerConsumption)
+class CostLayerConsumptionAdmin(admin.ModelAdmin):
+    pass
+
+
+@admin.register(ItemToken)
+class ItemTokenAdmin(admin.ModelAdmin):
+    pass
+
+
+@admin.register(ItemCodeCounter)
+class ItemCodeCounterAdmin(admin.ModelAdmin):
+    pass
@@ -0,0 +1,41 @@
+import datetime
+
+from django.core.management.base import BaseCommand, CommandError
+
+from company.models import Company
+from inventory.models import StockCheckpoint
+
+
+class Command(BaseCommand):
+    help = ("Crea los cortes de existencia que falten, al cierre de cada "
+        "período, para las empresas indicadas (o para todas). Debe "
+        "programarse periódicamente (por ejemplo, con una tarea cron diaria), "
+        "ya que los cortes no se crean al registrar movimientos.")
+
+    def add_arguments(self, parser):
+        parser.add_argument("--company", type=int, nargs="*", default=None,
+            help="ids de las empresas. Por defecto todas.")
+        parser.add_argument("--until", type=datetime.date.fromisoformat,
+            default=None, help="fecha límite (AAAA-MM-DD). Por defecto hoy.")
+        parser.add_argument("--rebuild", action="store_true",
+            help="elimina los cortes existentes antes de crearlos.")
+
+    def handle(self, *args, **options):
+        qs = Company.objects.all()
+        if options["company"]:
+            qs = qs.filter(pk__in=options["company"])
+            if not qs:
+                raise CommandError("No existen las empresas indicadas.")
+
+        for company in qs:
+            self.stdout.write(f"{company} ({company.pk})...")
+            if options["rebuild"]:
+                StockCheckpoint.invalidate(company)
+
+            def progress(date, count):
+                self.stdout.write(f"  {date}: {count:,} cortes")
+
+            dates = StockCheckpoint.build_until(company,
+                until=options["until"], progress=progress)
+            self.stdout.write(self.style.SUCCESS(
+                f"{company}: {len(dates)} períodos creados."))
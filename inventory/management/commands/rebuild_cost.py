@@ -0,0 +1,33 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from company.models import Company
+from inventory.models import Item
+
+
+class Command(BaseCommand):
+    help = ("Recalcula el costo promedio ponderado de los artículos de las "
+        "empresas indicadas (o de todas) reproduciendo sus movimientos.")
+
+    def add_arguments(self, parser):
+        parser.add_argument("--company", type=int, nargs="*", default=None,
+            help="ids de las empresas a recalcular. Por defecto todas.")
+
+    def handle(self, *args, **options):
+        qs = Company.objects.all()
+        if options["company"]:
+            qs = qs.filter(pk__in=options["company"])
+            if not qs:
+                raise CommandError("No existen las empresas indicadas.")
+
+        for company in qs:
+            self.stdout.write(f"{company} ({company.pk})...")
+            start = time.time()
+            items = Item.objects.filter(company=company, is_service=False)
+            count = 0
+            for item in items.iterator():
+                item.update_cost()
+                count += 1
+            self.stdout.write(self.style.SUCCESS(f"{company}: {count:,} "
+                f"artículos actualizados en {time.time() - start:.2f}s."))
@@ -0,0 +1,39 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from company.models import Company
+from inventory.models import CostLayer
+
+
+class Command(BaseCommand):
+    help = ("Reconstruye las capas de costo FIFO de las empresas indicadas (o "
+        "de todas las que valoran con FIFO) a partir de sus movimientos.")
+
+    def add_arguments(self, parser):
+        parser.add_argument("--company", type=int, nargs="*", default=None,
+            help="ids de las empresas a reconstruir. Por defecto todas las "
+            "empresas con valoración FIFO.")
+        parser.add_argument("--batch-size", type=int, default=1000,
+            help="cantidad de registros por lote.")
+
+    def handle(self, *args, **options):
+        qs = Company.objects.all()
+        if options["company"]:
+            qs = qs.filter(pk__in=options["company"])
+            if not qs:
+                raise CommandError("No existen las empresas indicadas.")
+        else:
+            qs = qs.filter(valuation=Company.FIFO)
+
+        for company in qs:
+            self.stdout.write(f"{company} ({company.pk})...")
+            start = time.time()
+
+            def progress(done, total):
+                self.stdout.write(f"  {done:,}/{total:,} artículos")
+
+            count = CostLayer.rebuild(company,
+                batch_size=options["batch_size"], progress=progress)
+            self.stdout.write(self.style.SUCCESS(f"{company}: {count:,} "
+                f"artículos procesados en {time.time() - start:.2f}s."))
@@ -0,0 +1,36 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from company.models import Company
+from inventory.models import ItemToken
+
+
+class Command(BaseCommand):
+    help = ("Reconstruye el índice de búsqueda de los artículos de las "
+        "empresas indicadas (o de todas).")
+
+    def add_arguments(self, parser):
+        parser.add_argument("--company", type=int, nargs="*", default=None,
+            help="ids de las empresas a reconstruir. Por defecto todas.")
+        parser.add_argument("--batch-size", type=int, default=1000,
+            help="cantidad de artículos por lote.")
+
+    def handle(self, *args, **options):
+        qs = Company.objects.all()
+        if options["company"]:
+            qs = qs.filter(pk__in=options["company"])
+            if not qs:
+                raise CommandError("No existen las empresas indicadas.")
+
+        for company in qs:
+            self.stdout.write(f"{company} ({company.pk})...")
+            start = time.time()
+
+            def progress(done, total):
+                self.stdout.write(f"  {done:,}/{total:,} artículos")
+
+            count = ItemToken.rebuild(company,
+                batch_size=options["batch_size"], progress=progress)
+            self.stdout.write(self.style.SUCCESS(f"{company}: {count:,} "
+                f"artículos indexados en {time.time() - start:.2f}s."))
@@ -0,0 +1,66 @@
+from django.db import migrations
+from django.db.models import Sum
+
+
+# Copia de DocumentType.TYPES_THAT_AFFECT_THE_INVENTORY_AS_INPUT/OUTPUT. Las
+# migraciones no deben importar los modelos actuales.
+INPUT_TYPES = ("inventory_input", "purchase", "invoice_return")
+OUTPUT_TYPES = ("inventory_output", "invoice")
+TRANSFER = "transfer"
+
+
+def populate_stockbalance(apps, schema_editor):
+    """Construye la existencia a partir de los movimientos ya registrados."""
+    Item = apps.get_model("inventory", "Item")
+    Movement = apps.get_model("inventory", "Movement")
+    StockBalance = apps.get_model("inventory", "StockBalance")
+
+    qs = Movement.objects.filter(item__isnull=False).order_by().values(
+        "item_id", "document__doctype__company_id", "document__doctype__generic",
+        "document__warehouse_id", "document__transfer_warehouse_id",
+    ).annotate(q=Sum("quantity"))
+
+    balances = {}
+    available = {}
+    for row in qs:
+        generic = row["document__doctype__generic"]
+        company_id = row["document__doctype__company_id"]
+        item_id = row["item_id"]
+        effects = []
+        if generic in INPUT_TYPES:
+            effects = [(row["document__warehouse_id"], row["q"], 0)]
+        elif generic in OUTPUT_TYPES:
+            effects = [(row["document__warehouse_id"], 0, row["q"])]
+        elif (generic == TRANSFER) and row["document__transfer_warehouse_id"]:
+            effects = [(row["document__warehouse_id"], 0, row["q"]),
+                (row["document__transfer_warehouse_id"], row["q"], 0)]
+
+        for warehouse_id, inputs, outputs in effects:
+            key = (company_id, item_id, warehouse_id)
+            balance = balances.setdefault(key, [0, 0])
+            balance[0] += inputs
+            balance[1] += outputs
+            available[item_id] = available.get(item_id, 0) + inputs - outputs
+
+    StockBalance.objects.bulk_create([
+        StockBalance(company_id=company_id, item_id=item_id,
+            warehouse_id=warehouse_id, inputs=inputs, outputs=outputs,
+            available=inputs - outputs)
+        for (company_id, item_id, warehouse_id), (inputs, outputs)
+        in balances.items()
+    ], batch_size=1000)
+
+    for item_id, value in available.items():
+        Item.objects.filter(pk=item_id).update(available=value)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('document', '0025_document_is_printed'),
+        ('inventory', '0015_stockbalance'),
+    ]
+
+    operations = [
+        migrations.RunPython(populate_stockbalance, migrations.RunPython.noop),
+    ]
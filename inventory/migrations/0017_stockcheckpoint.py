@@ -0,0 +1,40 @@
+# Generated by Django 3.1.14 on 2026-10-18 16:20
+
+from django.db import migrations, models
+import django.db.models.deletion
+import unoletutils.libs.text
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('company', '0003_company_logo'),
+        ('warehouse', '0003_auto_20210106_1432'),
+        ('inventory', '0016_populate_stockbalance'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='StockCheckpoint',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField(help_text='fecha de cierre del período (inclusive).', verbose_name='fecha')),
+                ('inputs', models.DecimalField(decimal_places=2, default=0, max_digits=22, verbose_name='entradas')),
+                ('outputs', models.DecimalField(decimal_places=2, default=0, max_digits=22, verbose_name='salidas')),
+                ('available', models.DecimalField(decimal_places=2, default=0, max_digits=22, verbose_name='disponible')),
+                ('company', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='company.company', verbose_name='Empresa')),
+                ('item', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='inventory.item', verbose_name='artículo')),
+                ('warehouse', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='warehouse.warehouse', verbose_name='almacén')),
+            ],
+            options={
+                'verbose_name': 'corte de existencia',
+                'verbose_name_plural': 'cortes de existencia',
+                'ordering': ['-date'],
+            },
+            bases=(models.Model, unoletutils.libs.text.Text),
+        ),
+        migrations.AddConstraint(
+            model_name='stockcheckpoint',
+            constraint=models.UniqueConstraint(fields=('company', 'date', 'item', 'warehouse'), name='unique_stockcheckpoint_date_item_warehouse'),
+        ),
+    ]
@@ -0,0 +1,62 @@
+# Generated by Django 3.1.14 on 2026-10-18 16:29
+
+from django.db import migrations, models
+import django.db.models.deletion
+import unoletutils.libs.text
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('company', '0004_company_valuation'),
+        ('inventory', '0018_item_cost'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CostLayer',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField(verbose_name='fecha')),
+                ('quantity', models.DecimalField(decimal_places=2, default=0, max_digits=22, verbose_name='cantidad')),
+                ('remaining', models.DecimalField(decimal_places=2, default=0, max_digits=22, verbose_name='cantidad restante')),
+                ('cost', models.DecimalField(decimal_places=4, default=0, max_digits=22, verbose_name='costo unitario')),
+                ('company', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='company.company', verbose_name='Empresa')),
+                ('item', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='inventory.item', verbose_name='artículo')),
+                ('movement', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, to='inventory.movement', verbose_name='movimiento de entrada')),
+            ],
+            options={
+                'verbose_name': 'capa de costo',
+                'verbose_name_plural': 'capas de costo',
+                'ordering': ['id'],
+            },
+            bases=(models.Model, unoletutils.libs.text.Text),
+        ),
+        migrations.CreateModel(
+            name='CostLayerConsumption',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField(verbose_name='fecha')),
+                ('quantity', models.DecimalField(decimal_places=2, default=0, max_digits=22, verbose_name='cantidad')),
+                ('cost', models.DecimalField(decimal_places=4, default=0, max_digits=22, verbose_name='costo unitario')),
+                ('company', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='company.company', verbose_name='Empresa')),
+                ('item', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='inventory.item', verbose_name='artículo')),
+                ('layer', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, to='inventory.costlayer', verbose_name='capa de costo')),
+                ('movement', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='inventory.movement', verbose_name='movimiento de salida')),
+            ],
+            options={
+                'verbose_name': 'consumo de capa de costo',
+                'verbose_name_plural': 'consumos de capas de costo',
+                'ordering': ['id'],
+            },
+            bases=(models.Model, unoletutils.libs.text.Text),
+        ),
+        migrations.AddIndex(
+            model_name='costlayerconsumption',
+            index=models.Index(fields=['item', 'date'], name='costlayerconsumption_date_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='costlayer',
+            index=models.Index(condition=models.Q(remaining__gt=0), fields=['item', 'id'], name='costlayer_open_idx'),
+        ),
+    ]
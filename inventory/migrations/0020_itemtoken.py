@@ -0,0 +1,35 @@
+# Generated by Django 3.1.14 on 2026-10-18 16:33
+
+from django.db import migrations, models
+import django.db.models.deletion
+import unoletutils.libs.text
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('company', '0004_company_valuation'),
+        ('inventory', '0019_costlayer'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ItemToken',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('token', models.CharField(max_length=30, verbose_name='palabra')),
+                ('weight', models.PositiveSmallIntegerField(default=1, verbose_name='peso')),
+                ('company', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='company.company', verbose_name='Empresa')),
+                ('item', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='inventory.item', verbose_name='artículo')),
+            ],
+            options={
+                'verbose_name': 'palabra de búsqueda',
+                'verbose_name_plural': 'palabras de búsqueda',
+            },
+            bases=(models.Model, unoletutils.libs.text.Text),
+        ),
+        migrations.AddIndex(
+            model_name='itemtoken',
+            index=models.Index(fields=['company', 'token'], name='itemtoken_token_idx'),
+        ),
+    ]
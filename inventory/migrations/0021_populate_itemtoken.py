@@ -0,0 +1,50 @@
+import re
+
+from django.db import migrations
+
+from unoletutils.libs.text import Text
+
+
+# Copia de ItemToken.FIELD_WEIGHTS. Las migraciones no deben importar los 
+# modelos actuales.
+FIELD_WEIGHTS = (("code", 4), ("codename", 4), ("name", 3), ("group", 1), 
+    ("family", 1), ("description", 1))
+
+
+def tokenize(value):
+    text = Text.normalize(str(value or ""), lower=True)
+    words = re.split(r"[^0-9a-zñ]+", text)
+    return list(dict.fromkeys(w[:30] for w in words if w))
+
+
+def populate_itemtoken(apps, schema_editor):
+    """Construye el índice de búsqueda de los artículos ya registrados."""
+    Item = apps.get_model("inventory", "Item")
+    ItemToken = apps.get_model("inventory", "ItemToken")
+
+    objs = []
+    qs = Item.objects.select_related("group", "family")
+    for item in qs.iterator():
+        tokens = {}
+        for field, weight in FIELD_WEIGHTS:
+            value = getattr(item, field)
+            value = getattr(value, "name", value)
+            for token in tokenize(value):
+                tokens[token] = max(weight, tokens.get(token, 0))
+        objs += [ItemToken(company_id=item.company_id, item_id=item.pk, 
+            token=token, weight=weight) for token, weight in tokens.items()]
+        if len(objs) >= 1000:
+            ItemToken.objects.bulk_create(objs)
+            objs = []
+    ItemToken.objects.bulk_create(objs)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('inventory', '0020_itemtoken'),
+    ]
+
+    operations = [
+        migrations.RunPython(populate_itemtoken, migrations.RunPython.noop),
+    ]
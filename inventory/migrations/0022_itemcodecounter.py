@@ -0,0 +1,33 @@
+# Generated by Django 3.1.14 on 2026-10-18 16:35
+
+from django.db import migrations, models
+import django.db.models.deletion
+import unoletutils.libs.text
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('company', '0004_company_valuation'),
+        ('inventory', '0021_populate_itemtoken'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ItemCodeCounter',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('last', models.PositiveIntegerField(default=0, verbose_name='último código')),
+                ('company', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='company.company', verbose_name='Empresa')),
+            ],
+            options={
+                'verbose_name': 'contador de códigos de artículos',
+                'verbose_name_plural': 'contadores de códigos de artículos',
+            },
+            bases=(models.Model, unoletutils.libs.text.Text),
+        ),
+        migrations.AddConstraint(
+            model_name='itemcodecounter',
+            constraint=models.UniqueConstraint(fields=('company',), name='unique_itemcodecounter_company'),
+        ),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 3.1.14 on 2026-10-18 18:23
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('inventory', '0022_itemcodecounter'),
+    ]
+
+    operations = [
+        migrations.RemoveField(
+            model_name='item',
+            name='tags',
+        ),
+    ]
@@ -1,4 +1,6 @@
-from django.db import models
+from decimal import Decimal
+
+from django.db import models, transaction, IntegrityError
 from django.db.models import Sum, Avg, F
 from django.core.exceptions import ValidationError
 from django.core.validators import (MinValueValidator, MaxValueValidator)
@@ -38,7 +40,10 @@ class ItemGroup(ModelBase):
 
     def save(self, *args, **kwargs):
         self.name = " ".join(self.name.split()).upper()
-        return super().save(*args, **kwargs)
+        out = super().save(*args, **kwargs)
+        # El nombre forma parte del índice de búsqueda de sus artículos.
+        ItemToken.update_items(self.item_set.all())
+        return out
 
 
 class ItemFamily(ModelBase):
@@ -63,7 +68,10 @@ class ItemFamily(ModelBase):
 
     def save(self, *args, **kwargs):
         self.name = " ".join(self.name.split()).upper()
-        return super().save(*args, **kwargs)
+        out = super().save(*args, **kwargs)
+        # El nombre forma parte del índice de búsqueda de sus artículos.
+        ItemToken.update_items(self.item_set.all())
+        return out
 
 
 class ItemActiveManager(models.Manager):
@@ -79,6 +87,9 @@ class Item(ModelBase):
     """
     ICON = "/static/img/box.svg"
 
+    # La búsqueda de artículos usa el índice de palabras (ver ItemToken).
+    tags = None
+
     # Código único del artículo para cada empresa.
     code = models.CharField(_l("código"), max_length=8, editable=False)
     
@@ -115,6 +126,10 @@ class Item(ModelBase):
 
     available_json = models.JSONField(_l("disponible"), blank=True, default=dict)
 
+    cost = models.DecimalField(_l("costo promedio"), max_digits=22, 
+    decimal_places=4, default=0, blank=True, editable=False,
+    help_text=_l("costo promedio ponderado en moneda local."))
+
     is_active = models.BooleanField(_l("activo"), default=True)
 
     is_service = models.BooleanField(_l("es un artículo de servicio"), 
@@ -124,6 +139,9 @@ class Item(ModelBase):
 
     active_objects = ItemActiveManager()
 
+    # Campos mantenidos por StockBalance y por el costo promedio.
+    STOCK_FIELDS = ("available", "cost")
+
     class Meta:
         verbose_name = _l("artículo")
         verbose_name_plural = _l("artículos")
@@ -138,8 +156,27 @@ class Item(ModelBase):
 
     @classmethod
     def get_next_code(cls, company) -> str:
-        """Obtiene el siguiente código disponible para la compañia indicada."""
-        return str(Item.objects.filter(company=company).count() + 1)
+        """
+        Obtiene el siguiente código disponible para la compañia indicada. El
+        código se reserva en el contador de la empresa (ver ItemCodeCounter),
+        por lo que no se repite aunque se eliminen artículos o se creen 
+        varios al mismo tiempo.
+        """
+        return str(ItemCodeCounter.reserve(company))
+
+    @classmethod
+    def assign_codes(cls, items: list) -> list:
+        """
+        Asigna los códigos a los artículos nuevos indicados, de la misma 
+        empresa, reservando un solo bloque de códigos. Útil antes de crear 
+        muchos artículos con bulk_create.
+        """
+        items = [item for item in items if not item.code]
+        if items:
+            first = ItemCodeCounter.reserve(items[0].company_id, len(items))
+            for number, item in enumerate(items, first):
+                item.code = str(number)
+        return items
     
     def clean(self):
         self.codename = " ".join(self.codename.split()).upper()
@@ -153,97 +190,328 @@ class Item(ModelBase):
             if self.family.company != self.company:
                 self.family = None
 
-    def update_tags(self):
-        """Actualiza el valor del campo 'tags'."""
-        self.tags = self.get_tags(self.code, self.codename, self.name, 
-            self.group or "", self.family or "", combinate=True)
-        self.tags += self.get_tag(self.description, combinate=True)
-        self.tags = self.tags[:700]
-    
     def save(self, *args, **kwargs):
-        if not self.pk:
+        if (not self.pk) and (not self.code):
             self.code = self.get_next_code(self.company)
         self.codename = " ".join(self.codename.split()).upper()
-        self.update_tags()
-        return super().save(*args, **kwargs)
+
+        # Los campos de existencia se actualizan con expresiones F() desde 
+        # StockBalance, por lo que una instancia desactualizada no debe 
+        # sobrescribirlos al guardarse.
+        if self.pk and (not kwargs.get("update_fields")):
+            kwargs["update_fields"] = [f.name for f in self._meta.concrete_fields
+                if (not f.primary_key) and (not f.name in self.STOCK_FIELDS)]
+        out = super().save(*args, **kwargs)
+        ItemToken.update_items([self])
+        return out
 
     def get_global_available(self, warehouse=None) -> float:
         """
         Obtiene el disponible global o el global para el almacén indicado.
         Se retorna un type float porque los Decimal no son JSON seriazables.
+
+        El disponible global se lee del campo 'available', mantenido por 
+        StockBalance, de modo que no se realiza ninguna consulta.
+        """
+        if self.is_service:
+            return 0
+        if warehouse:
+            return self.get_available(warehouse)
+        return float(self.available or 0)
+
+    def get_available(self, warehouse=None, as_of=None) -> float:
         """
-        warehouse_id = getattr(warehouse, "id", warehouse) or None 
-        dic = self.available_json or self.get_available(update=True)
+        Obtiene la cantidad disponible de este artículo, global o para el 
+        almacén indicado.
+
+        El valor se lee de StockBalance en una sola consulta, en lugar de 
+        recorrer los movimientos del artículo.
+
+        Si se indica una fecha 'as_of', se obtendrá el disponible a esa fecha 
+        (inclusive) a partir de los cortes de StockCheckpoint.
+        """
+        # Los artículos de servicio no afectan el inventario.
+        if self.is_service:
+            return 0
+
+        warehouse_id = getattr(warehouse, "id", warehouse) or None
+        if as_of:
+            stock = StockCheckpoint.get_stock(self.company_id, as_of, 
+                item=self.pk, warehouse=warehouse_id)
+            return float(sum(stock.values()))
         if warehouse_id:
-            return dic["warehouse"][warehouse_id]["available"]
-        return dic["available"]
+            qs = self.stockbalance_set.filter(warehouse=warehouse_id)
+        else:
+            qs = Item.objects.filter(pk=self.pk)
+        return float(qs.values_list("available", flat=True).first() or 0)
 
-    def get_available(self, update: bool=True) -> dict:
+    def get_available_detail(self, update: bool=False) -> dict:
         """
         Obtiene la cantidad disponible de este artículo en un diccionario.
         
         El resultado incluye las entradas, salidas y disponile, al igual que 
-        lo mismo para cada almacén.
+        lo mismo para cada almacén. Las entradas y salidas de cada almacén 
+        incluyen las transferencias.
 
         Si update == True se actualizará el campo 'available_json'.
         """
         # Los artículos de servicio no afectan el inventario.
-        if self.is_service:
-            dic = {"inputs": 0, "outputs": 0, "available": 0, "warehouse": dict()}
-            self.available_json = dic
-            self.save_without_historical_record()
-            return dic
-
-        from document.models import Document, DocumentType
-        from warehouse.models import Warehouse
-        from django.db.models import Case, F, Sum, When, Value
-        generic_input = list(DocumentType.TYPES_THAT_AFFECT_THE_INVENTORY_AS_INPUT)
-        generic_output = list(DocumentType.TYPES_THAT_AFFECT_THE_INVENTORY_AS_OUTPUT)
-
-        available = 0
-        qs = self.movement_set.all()
-        dic = dict()
-        dic["inputs"] = qs.filter(
-            document__doctype__generic__in=generic_input).aggregate(
-                s=Sum("quantity", output_field=models.FloatField()))["s"] or 0
-        dic["outputs"] = qs.filter(
-            document__doctype__generic__in=generic_output).aggregate(
-                s=Sum("quantity", output_field=models.FloatField()))["s"] or 0
-        
-        dic["available"] = dic["inputs"] - dic["outputs"]
-        dic["warehouse"] = dict()
-
-        # Disponible para cada almacén activo.
-        for warehouse in Warehouse.active_objects.all():
-            inputs = qs.filter(
-                document__doctype__generic__in=generic_input + [DocumentType.TRANSFER],
-                document__warehouse=warehouse).aggregate(
-                    s=Sum("quantity", output_field=models.FloatField()))["s"] or 0
-            outputs = qs.filter(
-                document__doctype__generic__in=generic_output + [DocumentType.TRANSFER],
-                document__transfer_warehouse=warehouse).aggregate(
-                    s=Sum("quantity", output_field=models.FloatField()))["s"] or 0            
-
-            available = inputs - outputs
-            dic["warehouse"][warehouse.id] = {
-                "name": str(warehouse),
-                "inputs": inputs,
-                "outputs": outputs,
-                "available": available
-            }
+        rows = []
+        if not self.is_service:
+            rows = self.stockbalance_set.values(*StockBalance.DICT_FIELDS)
+        dic = StockBalance.get_available_dict(rows)
 
         if bool(update):
             self.available_json = dic
-            self.save_without_historical_record()
+            Item.objects.filter(pk=self.pk).update(available_json=dic)
 
         return dic
 
-    def get_average_cost(self):
-        """Obtiene el costo promedio de este artículo."""
-        from document.models import DocumentType
-        generic_types = DocumentType.TYPES_THAT_CAN_AFFECT_THE_COST
-        qs = self.movement_set.filter(document__doctype__generic__in=generic_types)
-        return qs.aggregate(a=Avg("total"))["a"] or 0
+    def get_average_cost(self) -> Decimal:
+        """
+        Obtiene el costo promedio ponderado de este artículo. El valor se 
+        mantiene al guardar los movimientos (ver Item.update_cost).
+        """
+        return self.cost
+
+    def update_cost(self, from_date=None) -> Decimal:
+        """
+        Recalcula el costo promedio ponderado de este artículo reproduciendo 
+        en orden sus movimientos que afectan el costo.
+
+        Si se indica 'from_date', se parte del estado guardado en el último 
+        movimiento anterior a esa fecha, y solo se reproducen los movimientos 
+        a partir de ella. Útil cuando llegan documentos con fecha pasada.
+        """
+        qs = Movement.get_cost_queryset(self)
+        quantity, cost = 0, 0
+
+        if from_date:
+            last = qs.filter(document__date__lt=from_date).reverse().values(
+                "cost_quantity", "cost").first()
+            if last:
+                quantity, cost = last["cost_quantity"], last["cost"]
+            qs = qs.filter(document__date__gte=from_date)
+
+        movements = list(qs.select_related("document__doctype"))
+        for movement in movements:
+            quantity, cost = movement.calculate_cost(quantity, cost)
+
+        with transaction.atomic():
+            Movement.objects.bulk_update(movements, ["cost", "cost_quantity"], 
+                batch_size=1000)
+            Item.objects.filter(pk=self.pk).update(cost=cost)
+        self.cost = cost
+        return cost
+
+
+class ItemCodeCounter(ModelBase):
+    """
+    Contador del último código de artículo asignado en cada empresa.
+
+    Los códigos se reservan bloqueando la fila de la empresa con 
+    select_for_update, así dos procesos nunca obtienen el mismo código y 
+    reservar uno o un bloque completo cuesta las mismas consultas.
+    """
+    tags = None
+
+    last = models.PositiveIntegerField(_l("último código"), default=0)
+
+    class Meta:
+        verbose_name = _l("contador de códigos de artículos")
+        verbose_name_plural = _l("contadores de códigos de artículos")
+        constraints = [
+            models.UniqueConstraint(fields=("company",), 
+                name="unique_itemcodecounter_company")
+        ]
+
+    def __str__(self):
+        return f"{self.company} = {self.last}"
+
+    @classmethod
+    def reserve(cls, company, count: int=1) -> int:
+        """
+        Reserva 'count' códigos consecutivos para la empresa indicada.
+
+        Returns:
+            int: el primer código reservado.
+        """
+        company_id = getattr(company, "pk", company)
+        with transaction.atomic():
+            counter = cls.objects.select_for_update().filter(
+                company=company_id).first()
+            if counter is None:
+                counter = cls.create_counter(company_id)
+            first = counter.last + 1
+            counter.last += count
+            counter.save(update_fields=["last"])
+        return first
+
+    @classmethod
+    def create_counter(cls, company_id: int):
+        """
+        Crea (y bloquea) el contador de la empresa a partir del mayor código
+        numérico de sus artículos. Si otro proceso lo crea al mismo tiempo, 
+        la restricción unique lo impedirá y se obtiene el existente.
+        """
+        from django.db.models.functions import Cast
+        codes = Item.objects.filter(company=company_id, 
+            code__regex=r"^[0-9]+$").annotate(
+            number=Cast("code", models.IntegerField()))
+        last = codes.aggregate(m=models.Max("number"))["m"] or 0
+        try:
+            with transaction.atomic():
+                return cls.objects.create(company_id=company_id, last=last)
+        except (IntegrityError):
+            return cls.objects.select_for_update().get(company=company_id)
+
+
+class ItemToken(ModelBase):
+    """
+    Índice invertido de búsqueda de artículos.
+
+    Cada artículo se divide en palabras normalizadas (sin tildes y en 
+    minúsculas) de su código, referencia, nombre, grupo, familia y 
+    descripción, y se guarda una fila por palabra con un peso según el campo.
+    La búsqueda compara el prefijo de cada palabra buscada contra el índice 
+    de 'token', por lo que no depende del tamaño del catálogo (ver search).
+    """
+    tags = None
+
+    item = models.ForeignKey(Item, on_delete=models.CASCADE, 
+    verbose_name=_l("artículo"))
+
+    token = models.CharField(_l("palabra"), max_length=30)
+
+    weight = models.PositiveSmallIntegerField(_l("peso"), default=1)
+
+    # Peso de cada campo del artículo en el orden de los resultados.
+    FIELD_WEIGHTS = (("code", 4), ("codename", 4), ("name", 3), 
+        ("group", 1), ("family", 1), ("description", 1))
+
+    MAX_SEARCH_WORDS = 5
+
+    class Meta:
+        verbose_name = _l("palabra de búsqueda")
+        verbose_name_plural = _l("palabras de búsqueda")
+        indexes = [
+            models.Index(fields=["company", "token"], name="itemtoken_token_idx"),
+        ]
+
+    def __str__(self):
+        return self.token
+
+    @classmethod
+    def tokenize(cls, value) -> list:
+        """Divide el texto en palabras normalizadas, sin repetir."""
+        import re
+        text = cls.normalize(str(value or ""), lower=True)
+        words = re.split(r"[^0-9a-zñ]+", text)
+        return list(dict.fromkeys(w[:30] for w in words if w))
+
+    @classmethod
+    def get_tokens(cls, item) -> dict:
+        """Obtiene las palabras del artículo con su mayor peso {token: peso}."""
+        tokens = dict()
+        for field, weight in cls.FIELD_WEIGHTS:
+            for token in cls.tokenize(getattr(item, field)):
+                tokens[token] = max(weight, tokens.get(token, 0))
+        return tokens
+
+    @classmethod
+    def update_items(cls, items, batch_size: int=1000):
+        """
+        Reemplaza las palabras de los artículos indicados (iterable de 
+        instancias de Item) con una eliminación y un bulk_create.
+        """
+        items = list(items.select_related("group", "family") 
+            if isinstance(items, models.QuerySet) else items)
+        if not items:
+            return
+        with transaction.atomic():
+            cls.objects.filter(item__in=[item.pk for item in items]).delete()
+            cls.objects.bulk_create([
+                cls(company_id=item.company_id, item_id=item.pk, token=token, 
+                    weight=weight)
+                for item in items 
+                for token, weight in cls.get_tokens(item).items()
+            ], batch_size=batch_size)
+
+    @classmethod
+    def rebuild(cls, company, batch_size: int=1000, progress=None) -> int:
+        """
+        Reconstruye el índice de todos los artículos de la empresa indicada.
+
+        Parameters:
+            progress (callable): si se indica, se invocará como 
+            progress(done, total) después de cada lote.
+
+        Returns:
+            int: cantidad de artículos indexados.
+        """
+        company_id = getattr(company, "pk", company)
+        qs = Item.objects.filter(company=company_id).select_related("group", 
+            "family").order_by("pk")
+        total = qs.count()
+        done = 0
+        with transaction.atomic():
+            cls.objects.filter(company=company_id).delete()
+            batch = []
+            for item in qs.iterator(chunk_size=batch_size):
+                batch.append(item)
+                if len(batch) >= batch_size:
+                    cls.update_items(batch, batch_size)
+                    done += len(batch)
+                    batch = []
+                    if progress:
+                        progress(done, total)
+            cls.update_items(batch, batch_size)
+            done += len(batch)
+        if progress:
+            progress(done, total)
+        return done
+
+    @classmethod
+    def search(cls, company, query: str, limit: int=20, 
+        is_active: bool=None) -> list:
+        """
+        Busca artículos de la empresa cuyas palabras comiencen por cada una 
+        de las palabras de 'query'.
+
+        Los resultados se ordenan por puntuación: para cada palabra buscada 
+        se toma el mayor peso entre las palabras del artículo que coinciden, 
+        doble si la coincidencia es exacta.
+
+        Parameters:
+            is_active (bool): si se indica, solo se buscarán los artículos 
+            activos (True) o inactivos (False).
+
+        Returns:
+            list: ids de los artículos, del más al menos relevante.
+        """
+        words = cls.tokenize(query)[:cls.MAX_SEARCH_WORDS]
+        if not words:
+            return []
+
+        qs = cls.objects.filter(company=getattr(company, "pk", company))
+        if is_active is not None:
+            qs = qs.filter(item__is_active=is_active)
+        condition = models.Q()
+        annotations = dict()
+        for index, word in enumerate(words):
+            # Un rango en lugar de LIKE para que se use el índice en 
+            # cualquier base de datos.
+            condition |= models.Q(token__gte=word, token__lt=word + "\uffff")
+            annotations[f"w{index}"] = models.Max(models.Case(
+                models.When(token=word, then=F("weight") * 2), 
+                models.When(token__startswith=word, then=F("weight")), 
+                default=0, output_field=models.IntegerField()))
+
+        qs = qs.filter(condition).order_by().values("item_id").annotate(
+            **annotations).filter(**{f"{name}__gt": 0 for name in annotations})
+        score = sum((F(name) for name in annotations), models.Value(0))
+        qs = qs.annotate(score=score).order_by("-score", "item_id")
+        return list(qs.values_list("item_id", flat=True)[:limit])
 
 
 class InputMovementManager(models.Manager):
@@ -332,6 +600,16 @@ class Movement(ModelBase):
     "monto (precio) especificado, entonces se extraerá el impuesto del monto "
     "indicado (si aplica)."))
 
+    # Estado del costo promedio del artículo luego de este movimiento. Solo se
+    # establece en los movimientos que afectan el costo (ver affects_cost).
+
+    cost = models.DecimalField(_l("costo unitario"), max_digits=22, 
+    decimal_places=4, default=0, editable=False,
+    help_text=_l("costo promedio del artículo en este movimiento."))
+
+    cost_quantity = models.DecimalField(_l("existencia para el costo"), 
+    max_digits=22, decimal_places=2, default=0, editable=False)
+
     objects = MovementManager()
 
     # Manejador para movimientos en documentos que afectan el inv. como entrada.
@@ -343,6 +621,21 @@ class Movement(ModelBase):
     # Manejador para movimientos en documentos de tipo transferencia.
     transfer_objects = TransferMovementManager()
 
+    # Campos (relativos al movimiento) que determinan cómo este afecta la 
+    # existencia. Ver StockBalance.apply.
+    STOCK_VALUES_FIELDS = ("item_id", "item__is_service", "quantity", 
+        "document__doctype__company_id", "document__doctype__generic", 
+        "document__warehouse_id", "document__transfer_warehouse_id", 
+        "document__date")
+
+    # Campos (relativos al movimiento) que determinan cómo este afecta el 
+    # costo promedio del artículo.
+    COST_VALUES_FIELDS = ("item_id", "document__date", 
+        "document__doctype__generic", "document__doctype__affect_cost")
+
+    # Orden en que se reproducen los movimientos para el costo promedio.
+    COST_ORDERING = ("document__date", "document_id", "number", "id")
+
     class Meta:
         verbose_name = _l("movimiento")
         verbose_name_plural = _l("movimientos")
@@ -391,14 +684,314 @@ class Movement(ModelBase):
             raise ValidationError(
                 _("La empresa del documento y el artículo no es la misma."))
         
-        out = super().save(*args, **kwargs)
-
-        # Actualizamos los campos de consulta en el documento relacionado.
+        with transaction.atomic():
+            previous = self.get_values_in_db() if self.pk else None
+
+            # Si el movimiento es nuevo y es el último en afectar el costo, 
+            # el costo se calcula aquí sin reproducir los anteriores.
+            cost_updated = self.apply_cost(previous)
+            append_layer = (not previous) and CostLayer.is_last(self)
+
+            # Revertimos en la existencia los valores anteriores del movimiento
+            # y aplicamos los nuevos.
+            StockBalance.apply(previous, sign=-1)
+            out = super().save(*args, **kwargs)
+            StockBalance.apply(self.get_stock_values(), sign=1)
+
+            if not cost_updated:
+                self.update_item_cost(previous)
+            if append_layer:
+                CostLayer.apply(self)
+            else:
+                self.update_item_layers(previous)
+            self.document.touch(self.document_id)
+
+        # Actualizamos los campos de consulta en el documento relacionado, o 
+        # lo marcamos si se está dentro de Document.deferred_totals.
         if not not_calculate_document:
-            self.document.calculate()
+            self.document.schedule_calculate()
+
+        return out
 
+    def delete(self, *args, **kwargs):
+        with transaction.atomic():
+            values = self.get_values_in_db()
+            self.update_item_layers(values, deleted=True)
+            out = super().delete(*args, **kwargs)
+            StockBalance.apply(values, sign=-1)
+            self.update_item_cost(values, deleted=True)
+            self.document.touch(self.document_id)
+            self.document.schedule_calculate()
         return out
 
+    @classmethod
+    def bulk_import(cls, document, rows: list) -> list:
+        """
+        Crea en una sola transacción los movimientos indicados en el documento.
+
+        A diferencia de guardar cada movimiento con save, los artículos y sus 
+        impuestos se obtienen en una sola consulta, el número y el impuesto 
+        de cada línea se calculan en memoria, los movimientos se crean con 
+        bulk_create y la existencia, el costo y el documento se actualizan una
+        sola vez.
+
+        Parameters:
+            rows (list): diccionarios con las claves 'item' (id) o 'codename',
+            'quantity', 'price' y opcionalmente 'discount', 'name' y 
+            'tax_already_included'.
+
+        Raises:
+            ValidationError: con los errores de cada línea, en la forma 
+            {"línea N": [errores]}. No se crea ningún movimiento.
+
+        Returns:
+            list: los movimientos creados.
+        """
+        company = document.doctype.company
+        ids = {row.get("item") for row in rows if row.get("item")}
+        codenames = {str(row["codename"]).upper() for row in rows 
+            if row.get("codename")}
+        items = Item.objects.filter(company=company).filter(
+            models.Q(pk__in=[i for i in ids if str(i).isdigit()]) | 
+            models.Q(codename__in=codenames)).select_related("tax")
+        by_pk = {str(item.pk): item for item in items}
+        by_codename = {item.codename: item for item in items}
+
+        movements, errors = [], dict()
+        number = cls(document=document)._get_next_number()
+        for index, row in enumerate(rows, 1):
+            if row.get("item"):
+                item = by_pk.get(str(row["item"]))
+            else:
+                item = by_codename.get(str(row.get("codename", "")).upper())
+            if not item:
+                errors[_("línea %s") % index] = [_("El artículo no existe.")]
+                continue
+
+            movement = cls(document=document, item=item, number=number, 
+                name=row.get("name") or item.name, 
+                quantity=row.get("quantity"), price=row.get("price"), 
+                discount=row.get("discount") or 0, 
+                tax_already_included=str(row.get("tax_already_included", 
+                "")).lower() in ("1", "true", "si", "sí", "yes"))
+            try:
+                movement.clean_fields(exclude=("document", "item"))
+            except (ValidationError) as e:
+                errors[_("línea %s") % index] = [f"{field}: {' '.join(msgs)}" 
+                    for field, msgs in e.message_dict.items()]
+                continue
+            movement.calculate_tax()
+            movements.append(movement)
+            number += 1
+
+        if errors:
+            raise ValidationError(errors)
+
+        # Los totales del documento se calculan una sola vez al salir, aunque 
+        # la importación esté dentro de otro bloque deferred_totals.
+        with document.deferred_totals():
+            cls.objects.bulk_create(movements, batch_size=1000)
+
+            # Existencia: una actualización por artículo.
+            values = document.get_stock_values()
+            quantities = dict()
+            services = set()
+            for movement in movements:
+                quantities[movement.item_id] = (quantities.get(
+                    movement.item_id, 0) + movement.quantity)
+                if movement.item.is_service:
+                    services.add(movement.item_id)
+            for item_id, quantity in quantities.items():
+                StockBalance.apply(dict(values, item_id=item_id, 
+                    item__is_service=item_id in services, quantity=quantity),
+                    sign=1)
+
+            # Costo promedio y capas FIFO: se reprocesa cada artículo desde la
+            # fecha del documento.
+            date = values["document__date"]
+            if movements and movements[0].affects_cost():
+                for item in Item.objects.filter(pk__in=quantities.keys()):
+                    item.update_cost(date)
+            if (CostLayer.is_enabled(company) and 
+                (document.doctype.generic in CostLayer.get_types())):
+                for item_id in quantities:
+                    CostLayer.replay(item_id, date)
+
+            document.touch(document.pk)
+            document.schedule_calculate()
+        return movements
+
+    def get_stock_values(self) -> dict:
+        """
+        Obtiene los valores de este movimiento que afectan la existencia, con 
+        las mismas claves de STOCK_VALUES_FIELDS.
+        """
+        return dict(self.document.get_stock_values(), item_id=self.item_id, 
+            item__is_service=self.item.is_service if self.item_id else None,
+            quantity=self.quantity)
+
+    def get_values_in_db(self) -> dict:
+        """
+        Obtiene los valores guardados de este movimiento que afectan la 
+        existencia y el costo, con las claves de STOCK_VALUES_FIELDS y 
+        COST_VALUES_FIELDS.
+        """
+        fields = dict.fromkeys(self.STOCK_VALUES_FIELDS + self.COST_VALUES_FIELDS)
+        return Movement.objects.filter(pk=self.pk).values(*fields).first()
+
+    @classmethod
+    def get_cost_queryset(cls, item) -> models.QuerySet:
+        """
+        Obtiene los movimientos del artículo que afectan el costo, en el orden
+        en que se reproducen.
+        """
+        from document.models import DocumentType
+        return cls.objects.filter(item=item, document__doctype__affect_cost=True,
+            document__doctype__generic__in=
+            DocumentType.TYPES_THAT_CAN_AFFECT_THE_COST).order_by(
+            *cls.COST_ORDERING)
+
+    @staticmethod
+    def values_affect_cost(values: dict) -> bool:
+        """Comprueba si los valores (COST_VALUES_FIELDS) afectan el costo."""
+        from document.models import DocumentType
+        return bool(values and values["item_id"] 
+            and values["document__doctype__affect_cost"] 
+            and (values["document__doctype__generic"] in 
+            DocumentType.TYPES_THAT_CAN_AFFECT_THE_COST))
+
+    def affects_cost(self) -> bool:
+        """Comprueba si este movimiento afecta el costo del artículo."""
+        doctype = self.document.doctype
+        return self.values_affect_cost({"item_id": self.item_id, 
+            "document__doctype__affect_cost": doctype.affect_cost, 
+            "document__doctype__generic": doctype.generic})
+
+    def calculate_cost(self, quantity, cost) -> tuple:
+        """
+        Aplica este movimiento al costo promedio ponderado, partiendo de la 
+        existencia y el costo indicados, y establece los campos 'cost' y 
+        'cost_quantity'. Los montos se convierten a moneda local con la tasa 
+        del documento.
+
+        Returns:
+            tuple: (cost_quantity, cost) luego de este movimiento.
+        """
+        from document.models import DocumentType
+        generic = self.document.doctype.generic
+        quantity = Decimal(quantity)
+        cost = Decimal(cost)
+
+        if generic in (DocumentType.PURCHASE, DocumentType.INVENTORY_INPUT):
+            new_quantity = quantity + self.quantity
+            if self.quantity:
+                unit_cost = (self.get_local_amount_with_discount() / 
+                    self.quantity)
+                # Con existencia negativa o nula, el costo es el de la entrada.
+                if (quantity <= 0) or (new_quantity <= 0):
+                    cost = unit_cost
+                else:
+                    cost = ((quantity * cost) + (self.quantity * unit_cost)) / (
+                        new_quantity)
+            quantity = new_quantity
+        elif generic in DocumentType.TYPES_THAT_AFFECT_THE_INVENTORY_AS_INPUT:
+            # Las devoluciones entran al costo promedio actual.
+            quantity += self.quantity
+        else:
+            quantity -= self.quantity
+
+        self.cost = Decimal(cost).quantize(Decimal("0.0001"))
+        self.cost_quantity = quantity
+        return self.cost_quantity, self.cost
+
+    def apply_cost(self, previous: dict=None) -> bool:
+        """
+        Calcula el costo de este movimiento nuevo de forma incremental, a 
+        partir del último movimiento del artículo, si este es posterior a 
+        todos los demás. Se invoca antes de guardar el movimiento.
+
+        Returns:
+            bool: True si se calculó el costo y no hace falta reproducir los 
+            movimientos del artículo.
+        """
+        if previous or (not self.affects_cost()):
+            return False
+
+        document = self.document
+        last = Movement.get_cost_queryset(self.item_id).reverse().values(
+            "document__date", "document_id", "number", "cost_quantity", 
+            "cost").first()
+
+        if last:
+            date = document._meta.get_field("date").to_python(document.date)
+            if ((last["document__date"], last["document_id"], last["number"]) 
+                > (date, document.pk, self.number)):
+                return False
+            self.calculate_cost(last["cost_quantity"], last["cost"])
+        else:
+            self.calculate_cost(0, 0)
+
+        Item.objects.filter(pk=self.item_id).update(cost=self.cost)
+        return True
+
+    def update_item_cost(self, previous: dict=None, deleted: bool=False):
+        """
+        Recalcula el costo promedio de los artículos afectados por el cambio 
+        de este movimiento, desde la fecha más antigua entre sus valores 
+        anteriores (previous) y los actuales.
+        """
+        dates = dict()
+        if self.values_affect_cost(previous):
+            dates[previous["item_id"]] = previous["document__date"]
+        if (not deleted) and self.affects_cost():
+            date = self.document._meta.get_field("date").to_python(
+                self.document.date)
+            dates[self.item_id] = min(date, dates.get(self.item_id, date))
+
+        for item in Item.objects.filter(pk__in=dates.keys()):
+            item.update_cost(dates[item.pk])
+
+    def update_item_layers(self, previous: dict=None, deleted: bool=False):
+        """
+        Reprocesa las capas de costo FIFO de los artículos afectados por el 
+        cambio de este movimiento, desde la fecha más antigua entre sus 
+        valores anteriores (previous) y los actuales. Si el movimiento está 
+        por eliminarse (deleted), se omite al reprocesar.
+        """
+        if not CostLayer.is_enabled(self.document.doctype.company):
+            return
+        types = CostLayer.get_types()
+        dates = dict()
+        if (previous and previous["item_id"] and 
+            (previous["document__doctype__generic"] in types)):
+            dates[previous["item_id"]] = previous["document__date"]
+        if ((not deleted) and self.item_id and 
+            (self.document.doctype.generic in types)):
+            date = self.document._meta.get_field("date").to_python(
+                self.document.date)
+            dates[self.item_id] = min(date, dates.get(self.item_id, date))
+
+        exclude = {"pk": self.pk} if deleted else None
+        for item_id, date in dates.items():
+            CostLayer.replay(item_id, date, exclude=exclude)
+
+    def get_fifo_cost_total(self) -> Decimal:
+        """Obtiene el costo FIFO de este movimiento de salida."""
+        return self.costlayerconsumption_set.aggregate(v=Sum(
+            F("quantity") * F("cost"), output_field=models.DecimalField()))[
+            "v"] or 0
+
+    def get_cost_total(self) -> Decimal:
+        """Obtiene el costo de este movimiento (costo unitario x cantidad)."""
+        return self.cost * self.quantity
+
+    def get_margin(self) -> Decimal:
+        """
+        Obtiene el margen de este movimiento en moneda local (importe con 
+        descuento - costo).
+        """
+        return self.get_local_amount_with_discount() - self.get_cost_total()
+
     def get_img(self):
         if self.document.is_inventory_input():
             return "/static/img/cart-plus.svg"
@@ -461,3 +1054,927 @@ class Movement(ModelBase):
         return self.item.get_available(warehouse=warehouse)
 
 
+
+
+class StockBalance(ModelBase):
+    """
+    Existencia de un artículo en un almacén.
+
+    Es un libro de existencias que se mantiene de forma incremental cada vez 
+    que se guarda o elimina un movimiento, o se cambia el almacén o tipo de un 
+    documento. Así el disponible de un artículo se obtiene leyendo una fila,
+    en lugar de recorrer todos sus movimientos.
+
+    Según el tipo genérico del documento, un movimiento afecta la existencia:
+        - Entradas: suma en el almacén del documento.
+        - Salidas: resta en el almacén del documento.
+        - Transferencias: resta en el almacén del documento y suma en el 
+        almacén a transferir.
+    """
+    tags = None
+
+    item = models.ForeignKey(Item, on_delete=models.CASCADE, 
+    verbose_name=_l("artículo"))
+
+    warehouse = models.ForeignKey("warehouse.Warehouse", 
+    on_delete=models.CASCADE, verbose_name=_l("almacén"))
+
+    inputs = models.DecimalField(_l("entradas"), max_digits=22, 
+    decimal_places=2, default=0)
+
+    outputs = models.DecimalField(_l("salidas"), max_digits=22, 
+    decimal_places=2, default=0)
+
+    available = models.DecimalField(_l("disponible"), max_digits=22, 
+    decimal_places=2, default=0)
+
+    class Meta:
+        verbose_name = _l("existencia")
+        verbose_name_plural = _l("existencias")
+        constraints = [
+            models.UniqueConstraint(fields=("company", "item", "warehouse"), 
+                name="unique_stockbalance_item_warehouse")
+        ]
+
+    # Campos necesarios para construir el diccionario de disponibilidad.
+    DICT_FIELDS = ("warehouse_id", "warehouse__name", "inputs", "outputs", 
+        "available")
+
+    def __str__(self):
+        return f"{self.item} ({self.warehouse}) = {self.available}"
+
+    @staticmethod
+    def get_available_dict(rows) -> dict:
+        """
+        Construye el diccionario de disponibilidad de un artículo (el que se 
+        guarda en Item.available_json) a partir de sus existencias, cada una 
+        con las claves de DICT_FIELDS.
+        """
+        dic = {"inputs": 0, "outputs": 0, "available": 0, "warehouse": dict()}
+        for row in rows:
+            dic["warehouse"][row["warehouse_id"]] = {
+                "name": row["warehouse__name"],
+                "inputs": float(row["inputs"]),
+                "outputs": float(row["outputs"]),
+                "available": float(row["available"]),
+            }
+            dic["inputs"] += float(row["inputs"])
+            dic["outputs"] += float(row["outputs"])
+            dic["available"] += float(row["available"])
+        return dic
+
+    @staticmethod
+    def get_input_types() -> tuple:
+        from document.models import DocumentType
+        return DocumentType.TYPES_THAT_AFFECT_THE_INVENTORY_AS_INPUT
+
+    @staticmethod
+    def get_output_types() -> tuple:
+        from document.models import DocumentType
+        return DocumentType.TYPES_THAT_AFFECT_THE_INVENTORY_AS_OUTPUT
+
+    @classmethod
+    def get_effects(cls, generic: str, warehouse_id: int, 
+        transfer_warehouse_id: int, quantity) -> list:
+        """
+        Obtiene cómo afecta la cantidad indicada a cada almacén, según el tipo
+        genérico del documento, en una lista [(warehouse_id, inputs, outputs)].
+        """
+        from document.models import DocumentType
+
+        if generic in cls.get_input_types():
+            return [(warehouse_id, quantity, 0)]
+        if generic in cls.get_output_types():
+            return [(warehouse_id, 0, quantity)]
+        if (generic == DocumentType.TRANSFER) and transfer_warehouse_id:
+            return [(warehouse_id, 0, quantity), 
+                (transfer_warehouse_id, quantity, 0)]
+        return []
+
+    @classmethod
+    def apply(cls, values: dict, sign: int=1):
+        """
+        Aplica (sign=1) o revierte (sign=-1) en la existencia los valores de 
+        un movimiento, tal y como los devuelve Movement.get_stock_values.
+
+        Los artículos de servicio no afectan el inventario: no tienen 
+        existencia por almacén y su disponible es siempre cero.
+        """
+        if (not values) or (not values["item_id"]) or (not values["quantity"]):
+            return
+
+        is_service = values.get("item__is_service")
+        if is_service is None:
+            is_service = Item.objects.filter(pk=values["item_id"], 
+                is_service=True).exists()
+        if is_service:
+            return
+
+        effects = cls.get_effects(values["document__doctype__generic"], 
+            values["document__warehouse_id"], 
+            values["document__transfer_warehouse_id"], 
+            values["quantity"] * sign)
+
+        if not effects:
+            return
+
+        with transaction.atomic():
+            available = 0
+            for warehouse_id, inputs, outputs in effects:
+                cls.add(values["document__doctype__company_id"], 
+                    values["item_id"], warehouse_id, inputs, outputs)
+                available += inputs - outputs
+            # Las transferencias no afectan el disponible global.
+            if available:
+                Item.objects.filter(pk=values["item_id"]).update(
+                    available=F("available") + available)
+            # Los cortes a partir de la fecha del documento reciben el mismo 
+            # cambio, solo para este artículo y sus almacenes.
+            for warehouse_id, inputs, outputs in effects:
+                StockCheckpoint.add(values["document__doctype__company_id"], 
+                    values["item_id"], warehouse_id, 
+                    values["document__date"], inputs, outputs)
+
+    @classmethod
+    def add(cls, company_id: int, item_id: int, warehouse_id: int, 
+        inputs=0, outputs=0):
+        """Suma las entradas y salidas indicadas a la existencia."""
+        qs = cls.objects.filter(company=company_id, item=item_id, 
+            warehouse=warehouse_id)
+        changes = {"inputs": F("inputs") + inputs, 
+            "outputs": F("outputs") + outputs, 
+            "available": F("available") + inputs - outputs}
+
+        with transaction.atomic():
+            if qs.update(**changes):
+                return
+            # La existencia aún no existe. Si otro proceso la crea al mismo 
+            # tiempo, la restricción unique lo impedirá y la actualizamos.
+            try:
+                with transaction.atomic():
+                    cls.objects.create(company_id=company_id, item_id=item_id,
+                        warehouse_id=warehouse_id, inputs=inputs, 
+                        outputs=outputs, available=inputs - outputs)
+            except (IntegrityError):
+                qs.update(**changes)
+
+    @classmethod
+    def apply_document(cls, document, values: dict=None, sign: int=1):
+        """
+        Aplica (sign=1) o revierte (sign=-1) en la existencia todos los 
+        movimientos del documento indicado, agrupados por artículo.
+
+        Parameters:
+            values (dict): valores del documento, con las claves de 
+            Movement.STOCK_VALUES_FIELDS (sin 'item_id' ni 'quantity'). Si no se
+            indica se usarán los de la instancia del documento.
+        """
+        if values is None:
+            values = document.get_stock_values()
+
+        qs = Movement.objects.filter(document=document.pk, item__isnull=False)
+        qs = qs.order_by().values("item_id", "item__is_service").annotate(
+            q=Sum("quantity"))
+
+        with transaction.atomic():
+            for row in qs:
+                cls.apply(dict(values, item_id=row["item_id"], 
+                    item__is_service=row["item__is_service"], 
+                    quantity=row["q"]), sign=sign)
+
+    @classmethod
+    def get_balances(cls, queryset, balances: dict=None) -> dict:
+        """
+        Obtiene las entradas y salidas por artículo y almacén de los 
+        movimientos del queryset, en una sola consulta agrupada.
+
+        Parameters:
+            queryset (QuerySet): movimientos a considerar.
+
+            balances (dict): si se indica, los resultados se acumularán sobre 
+            este diccionario.
+
+        Returns:
+            dict: {(item_id, warehouse_id): [inputs, outputs]}
+        """
+        balances = dict() if balances is None else balances
+        # Los artículos de servicio no afectan el inventario.
+        qs = queryset.filter(item__isnull=False, item__is_service=False)
+        qs = qs.order_by().values("item_id", 
+            "document__doctype__generic", "document__warehouse_id", 
+            "document__transfer_warehouse_id").annotate(q=Sum("quantity"))
+
+        for row in qs.iterator():
+            effects = cls.get_effects(row["document__doctype__generic"], 
+                row["document__warehouse_id"], 
+                row["document__transfer_warehouse_id"], row["q"])
+            for warehouse_id, inputs, outputs in effects:
+                balance = balances.setdefault(
+                    (row["item_id"], warehouse_id), [0, 0])
+                balance[0] += inputs
+                balance[1] += outputs
+        return balances
+
+    @classmethod
+    def rebuild(cls, company, batch_size: int=1000, progress=None) -> int:
+        """
+        Reconstruye la existencia y los campos 'available' y 'available_json'
+        de todos los artículos de la empresa indicada.
+
+        Los movimientos se leen en una sola consulta agrupada por artículo, 
+        almacén, almacén a transferir y tipo genérico del documento, y los 
+        resultados se escriben con bulk_create y bulk_update por lotes.
+
+        Parameters:
+            company (company.models.Company or int): empresa.
+
+            batch_size (int): cantidad de registros por lote.
+
+            progress (callable): si se indica, se invocará como 
+            progress(done, total) después de actualizar cada lote de artículos.
+
+        Returns:
+            int: cantidad de artículos actualizados.
+        """
+        from warehouse.models import Warehouse
+
+        company_id = getattr(company, "pk", company)
+
+        qs = Movement.objects.filter(document__doctype__company=company_id)
+
+        # {item_id: {warehouse_id: [inputs, outputs]}}
+        balances = dict()
+        for (item_id, warehouse_id), balance in cls.get_balances(qs).items():
+            balances.setdefault(item_id, dict())[warehouse_id] = balance
+
+        warehouse_names = dict(Warehouse.objects.filter(
+            company=company_id).values_list("id", "name"))
+
+        items = list(Item.objects.filter(company=company_id).order_by(
+            "pk").values_list("pk", "is_service"))
+        total = len(items)
+        done = 0
+
+        with transaction.atomic():
+            cls.objects.filter(company=company_id).delete()
+
+            for start in range(0, total, batch_size):
+                stock_list = []
+                item_list = []
+                for item_id, is_service in items[start:start + batch_size]:
+                    rows = []
+                    # Los artículos de servicio no afectan el inventario.
+                    item_balances = dict() if is_service else balances.get(
+                        item_id, dict())
+                    for warehouse_id, (inputs, outputs) in (
+                        item_balances.items()):
+                        stock_list.append(cls(company_id=company_id, 
+                            item_id=item_id, warehouse_id=warehouse_id, 
+                            inputs=inputs, outputs=outputs, 
+                            available=inputs - outputs))
+                        rows.append({"warehouse_id": warehouse_id, 
+                            "warehouse__name": warehouse_names.get(
+                                warehouse_id, ""),
+                            "inputs": inputs, "outputs": outputs, 
+                            "available": inputs - outputs})
+                    dic = cls.get_available_dict(rows)
+                    item_list.append(Item(pk=item_id, 
+                        available=dic["available"], available_json=dic))
+
+                cls.objects.bulk_create(stock_list, batch_size=batch_size)
+                Item.objects.bulk_update(item_list, 
+                    ["available", "available_json"], batch_size=batch_size)
+
+                done += len(item_list)
+                if progress:
+                    progress(done, total)
+        return done
+
+
+class StockCheckpoint(ModelBase):
+    """
+    Corte de existencia de un artículo en un almacén al cierre de un período.
+
+    Permite obtener la existencia a una fecha partiendo del corte más cercano 
+    y sumando solo los movimientos posteriores, en lugar de recorrer toda la 
+    historia de la empresa. Los cortes se generan con 'build_until' (ver el 
+    comando 'build_stock_checkpoints', que debe programarse al cierre de cada 
+    período, por ejemplo con una tarea cron diaria). Cuando se registra o 
+    modifica un movimiento con fecha igual o anterior a un corte, el cambio 
+    se suma solo a los cortes de ese artículo y almacén a partir de esa 
+    fecha (ver 'add'); los cortes anteriores y los de los demás artículos no 
+    se modifican.
+
+    La duración del período en meses se configura con la variable 
+    STOCK_CHECKPOINT_PERIOD_MONTHS del 'settings' (por defecto 1), y debe ser 
+    un divisor de 12.
+    """
+    tags = None
+
+    item = models.ForeignKey(Item, on_delete=models.CASCADE, 
+    verbose_name=_l("artículo"))
+
+    warehouse = models.ForeignKey("warehouse.Warehouse", 
+    on_delete=models.CASCADE, verbose_name=_l("almacén"))
+
+    date = models.DateField(_l("fecha"), 
+    help_text=_l("fecha de cierre del período (inclusive)."))
+
+    inputs = models.DecimalField(_l("entradas"), max_digits=22, 
+    decimal_places=2, default=0)
+
+    outputs = models.DecimalField(_l("salidas"), max_digits=22, 
+    decimal_places=2, default=0)
+
+    available = models.DecimalField(_l("disponible"), max_digits=22, 
+    decimal_places=2, default=0)
+
+    class Meta:
+        verbose_name = _l("corte de existencia")
+        verbose_name_plural = _l("cortes de existencia")
+        ordering = ["-date"]
+        constraints = [
+            models.UniqueConstraint(
+                fields=("company", "date", "item", "warehouse"), 
+                name="unique_stockcheckpoint_date_item_warehouse")
+        ]
+
+    def __str__(self):
+        return f"{self.date} {self.item} ({self.warehouse}) = {self.available}"
+
+    @staticmethod
+    def get_period_months() -> int:
+        from django.conf import settings
+        months = int(getattr(settings, "STOCK_CHECKPOINT_PERIOD_MONTHS", 1))
+        if (months < 1) or (12 % months):
+            raise ValueError("STOCK_CHECKPOINT_PERIOD_MONTHS debe ser un "
+                f"divisor de 12. Se indicó {months}.")
+        return months
+
+    @classmethod
+    def get_period_end(cls, date):
+        """Obtiene la fecha de cierre del período al que pertenece la fecha."""
+        import calendar
+        months = cls.get_period_months()
+        month = ((date.month - 1) // months + 1) * months
+        return date.replace(month=month, 
+            day=calendar.monthrange(date.year, month)[1])
+
+    @classmethod
+    def get_last_date(cls, company, until=None):
+        """Obtiene la fecha del último corte, hasta la fecha indicada."""
+        qs = cls.objects.filter(company=getattr(company, "pk", company))
+        if until:
+            qs = qs.filter(date__lte=until)
+        return qs.aggregate(d=models.Max("date"))["d"]
+
+    @classmethod
+    def invalidate(cls, company, date=None):
+        """Elimina los cortes de la empresa a partir de la fecha indicada."""
+        qs = cls.objects.filter(company=getattr(company, "pk", company))
+        if date:
+            qs = qs.filter(date__gte=date)
+        qs.delete()
+
+    @classmethod
+    def add(cls, company_id: int, item_id: int, warehouse_id: int, date, 
+        inputs=0, outputs=0):
+        """
+        Suma las entradas y salidas indicadas a los cortes del artículo y 
+        almacén con fecha igual o posterior a la indicada.
+
+        Si en alguna de esas fechas aún no hay corte para el artículo y 
+        almacén (por ejemplo, es su primer movimiento), se crea, para que el 
+        corte siga reflejando toda la existencia de la empresa a esa fecha.
+        """
+        dates = set(cls.objects.filter(company=company_id, 
+            date__gte=date).order_by().values_list("date", flat=True).distinct())
+        if not dates:
+            return
+
+        qs = cls.objects.filter(company=company_id, item=item_id, 
+            warehouse=warehouse_id, date__gte=date)
+        changes = {"inputs": F("inputs") + inputs, 
+            "outputs": F("outputs") + outputs, 
+            "available": F("available") + inputs - outputs}
+
+        with transaction.atomic():
+            missing = dates - set(qs.values_list("date", flat=True))
+            qs.exclude(date__in=missing).update(**changes)
+            for missing_date in sorted(missing):
+                # Si otro proceso crea el corte al mismo tiempo, la 
+                # restricción unique lo impedirá y lo actualizamos.
+                try:
+                    with transaction.atomic():
+                        cls.objects.create(company_id=company_id, 
+                            item_id=item_id, warehouse_id=warehouse_id, 
+                            date=missing_date, inputs=inputs, 
+                            outputs=outputs, available=inputs - outputs)
+                except (IntegrityError):
+                    qs.filter(date=missing_date).update(**changes)
+
+    @classmethod
+    def get_balances(cls, company, as_of, item=None, warehouse=None) -> dict:
+        """
+        Obtiene las entradas y salidas por artículo y almacén a la fecha 
+        indicada (inclusive), partiendo del corte más cercano.
+
+        Returns:
+            dict: {(item_id, warehouse_id): [inputs, outputs]}
+        """
+        company_id = getattr(company, "pk", company)
+        item_id = getattr(item, "pk", item)
+        warehouse_id = getattr(warehouse, "pk", warehouse)
+
+        checkpoints = cls.objects.filter(company=company_id)
+        movements = Movement.objects.filter(
+            document__doctype__company=company_id, document__date__lte=as_of)
+        if item_id:
+            checkpoints = checkpoints.filter(item=item_id)
+            movements = movements.filter(item=item_id)
+        if warehouse_id:
+            checkpoints = checkpoints.filter(warehouse=warehouse_id)
+
+        balances = dict()
+        date = cls.get_last_date(company_id, until=as_of)
+        if date:
+            rows = checkpoints.filter(date=date).values_list(
+                "item_id", "warehouse_id", "inputs", "outputs")
+            for row_item_id, row_warehouse_id, inputs, outputs in rows:
+                balances[(row_item_id, row_warehouse_id)] = [inputs, outputs]
+            movements = movements.filter(document__date__gt=date)
+
+        # Las transferencias afectan tanto el almacén del documento como el 
+        # almacén a transferir, por lo que el filtro por almacén se aplica 
+        # luego de agrupar.
+        if warehouse_id:
+            movements = movements.filter(
+                models.Q(document__warehouse=warehouse_id) | 
+                models.Q(document__transfer_warehouse=warehouse_id))
+        balances = StockBalance.get_balances(movements, balances)
+
+        if warehouse_id:
+            balances = {key: value for key, value in balances.items() 
+                if key[1] == warehouse_id}
+        return balances
+
+    @classmethod
+    def get_stock(cls, company, as_of, item=None, warehouse=None) -> dict:
+        """
+        Obtiene la existencia por artículo y almacén a la fecha indicada.
+
+        Returns:
+            dict: {(item_id, warehouse_id): available}
+        """
+        balances = cls.get_balances(company, as_of, item, warehouse)
+        return {key: inputs - outputs 
+            for key, (inputs, outputs) in balances.items()}
+
+    @classmethod
+    def build(cls, company, date) -> int:
+        """
+        Crea los cortes de la empresa para la fecha indicada, a partir del 
+        corte anterior y los movimientos posteriores a este.
+
+        Returns:
+            int: cantidad de cortes creados.
+        """
+        company_id = getattr(company, "pk", company)
+        balances = cls.get_balances(company_id, date)
+
+        with transaction.atomic():
+            cls.objects.filter(company=company_id, date=date).delete()
+            objs = cls.objects.bulk_create([
+                cls(company_id=company_id, item_id=item_id, 
+                    warehouse_id=warehouse_id, date=date, inputs=inputs, 
+                    outputs=outputs, available=inputs - outputs)
+                for (item_id, warehouse_id), (inputs, outputs) 
+                in balances.items()
+            ], batch_size=1000)
+        return len(objs)
+
+    @classmethod
+    def build_until(cls, company, until=None, progress=None) -> list:
+        """
+        Crea los cortes de la empresa que falten para cada cierre de período 
+        hasta la fecha indicada (por defecto hasta el último período cerrado).
+        Cada corte parte del anterior, por lo que cada paso solo procesa los 
+        movimientos de un período.
+
+        Parameters:
+            progress (callable): si se indica, se invocará como 
+            progress(date, count) después de crear cada corte.
+
+        Returns:
+            list: fechas de los cortes creados.
+        """
+        import datetime
+        from django.utils import timezone
+
+        company_id = getattr(company, "pk", company)
+        until = until or timezone.now().date()
+
+        date = cls.get_last_date(company_id, until=until)
+        if date:
+            start = date + datetime.timedelta(days=1)
+        else:
+            start = Movement.objects.filter(
+                document__doctype__company=company_id).aggregate(
+                    d=models.Min("document__date"))["d"]
+            if not start:
+                return []
+
+        dates = []
+        date = cls.get_period_end(start)
+        while date <= until:
+            count = cls.build(company_id, date)
+            dates.append(date)
+            if progress:
+                progress(date, count)
+            date = cls.get_period_end(date + datetime.timedelta(days=1))
+        return dates
+
+
+class CostLayer(ModelBase):
+    """
+    Capa de costo FIFO (primero en entrar, primero en salir) de un artículo.
+
+    Solo se mantienen para las empresas con valoración FIFO (ver 
+    Company.valuation). Cada movimiento de entrada crea una capa con su 
+    cantidad y costo unitario en moneda local, y cada movimiento de salida 
+    consume las capas abiertas (con cantidad restante) en el orden en que se
+    crearon, registrando cada consumo en CostLayerConsumption.
+
+    Las capas se crean siempre en el orden de los movimientos (ver 
+    Movement.COST_ORDERING), por lo que el id de la capa determina el orden 
+    de consumo. El índice parcial sobre las capas abiertas permite obtener la 
+    siguiente capa a consumir sin recorrer las ya agotadas.
+    """
+    tags = None
+
+    item = models.ForeignKey(Item, on_delete=models.CASCADE, 
+    verbose_name=_l("artículo"))
+
+    movement = models.OneToOneField(Movement, on_delete=models.CASCADE, 
+    verbose_name=_l("movimiento de entrada"))
+
+    date = models.DateField(_l("fecha"))
+
+    quantity = models.DecimalField(_l("cantidad"), max_digits=22, 
+    decimal_places=2, default=0)
+
+    remaining = models.DecimalField(_l("cantidad restante"), max_digits=22, 
+    decimal_places=2, default=0)
+
+    cost = models.DecimalField(_l("costo unitario"), max_digits=22, 
+    decimal_places=4, default=0)
+
+    class Meta:
+        verbose_name = _l("capa de costo")
+        verbose_name_plural = _l("capas de costo")
+        ordering = ["id"]
+        indexes = [
+            models.Index(fields=["item", "id"], name="costlayer_open_idx", 
+                condition=models.Q(remaining__gt=0)),
+        ]
+
+    def __str__(self):
+        return f"{self.date} {self.item} {self.remaining}/{self.quantity}"
+
+    @staticmethod
+    def is_enabled(company) -> bool:
+        """Comprueba si la empresa valora su inventario con FIFO."""
+        return company.valuation == company.FIFO
+
+    @staticmethod
+    def get_types() -> tuple:
+        return StockBalance.get_input_types() + StockBalance.get_output_types()
+
+    @classmethod
+    def get_movements(cls, item) -> models.QuerySet:
+        """
+        Obtiene los movimientos del artículo que crean o consumen capas, en el
+        orden en que se procesan.
+        """
+        return Movement.objects.filter(item=item, 
+            document__doctype__generic__in=cls.get_types()).order_by(
+            *Movement.COST_ORDERING)
+
+    @classmethod
+    def get_open_layers(cls, item) -> models.QuerySet:
+        """Obtiene las capas con cantidad restante del artículo, en orden."""
+        return cls.objects.filter(item=item, remaining__gt=0).order_by("id")
+
+    @staticmethod
+    def get_last_cost(item) -> Decimal:
+        """Obtiene el costo unitario del último consumo del artículo."""
+        return CostLayerConsumption.objects.filter(item=item).order_by(
+            "-date", "-id").values_list("cost", flat=True).first() or 0
+
+    @classmethod
+    def push(cls, movement, last_cost=0):
+        """
+        Crea (sin guardar) la capa del movimiento de entrada indicado.
+
+        Las devoluciones de ventas entran al costo del último consumo del 
+        artículo (last_cost), el resto de las entradas a su importe con 
+        descuento en moneda local entre la cantidad.
+        """
+        from document.models import DocumentType
+
+        cost = last_cost
+        if movement.document.doctype.generic != DocumentType.INVOICE_RETURN:
+            if movement.quantity:
+                cost = (movement.get_local_amount_with_discount() / 
+                    movement.quantity)
+        document = movement.document
+        return cls(company_id=document.doctype.company_id, 
+            item_id=movement.item_id, movement=movement, 
+            date=document._meta.get_field("date").to_python(document.date), 
+            quantity=movement.quantity, remaining=movement.quantity, 
+            cost=Decimal(cost).quantize(Decimal("0.0001")))
+
+    @classmethod
+    def consume(cls, movement, layers, last_cost=0) -> tuple:
+        """
+        Consume en orden de las capas abiertas indicadas la cantidad del 
+        movimiento de salida. La cantidad que no se cubre con las capas (por 
+        existencia negativa) se registra sin capa al costo 'last_cost'.
+
+        Parameters:
+            layers (iterable): capas abiertas en orden de consumo. Se 
+            modifica su cantidad restante, pero no se guardan.
+
+        Returns:
+            tuple: (capas modificadas, consumos sin guardar)
+        """
+        document = movement.document
+        values = {"company_id": document.doctype.company_id, 
+            "item_id": movement.item_id, "movement": movement, 
+            "date": document._meta.get_field("date").to_python(document.date)}
+        left = movement.quantity
+        touched, consumptions = [], []
+
+        for layer in layers:
+            if left <= 0:
+                break
+            if layer.remaining <= 0:
+                continue
+            quantity = min(layer.remaining, left)
+            layer.remaining -= quantity
+            left -= quantity
+            last_cost = layer.cost
+            touched.append(layer)
+            consumptions.append(CostLayerConsumption(layer=layer, 
+                quantity=quantity, cost=layer.cost, **values))
+
+        if left > 0:
+            consumptions.append(CostLayerConsumption(layer=None, 
+                quantity=left, cost=last_cost, **values))
+        return touched, consumptions
+
+    @classmethod
+    def is_last(cls, movement) -> bool:
+        """
+        Comprueba si el movimiento nuevo (aún sin guardar) crea o consume 
+        capas y es posterior a todos los demás movimientos de su artículo, 
+        en cuyo caso se puede aplicar con 'apply' sin reprocesar.
+        """
+        doctype = movement.document.doctype
+        if ((not movement.item_id) or (not cls.is_enabled(doctype.company)) 
+            or (doctype.generic not in cls.get_types())):
+            return False
+
+        last = cls.get_movements(movement.item_id).reverse().values_list(
+            "document__date", "document_id", "number").first()
+        if not last:
+            return True
+        document = movement.document
+        date = document._meta.get_field("date").to_python(document.date)
+        return last <= (date, document.pk, movement.number)
+
+    @classmethod
+    def apply(cls, movement):
+        """
+        Aplica a las capas el movimiento indicado (ya guardado), que debe ser
+        el último de su artículo (ver is_last).
+        """
+        with transaction.atomic():
+            if movement.document.doctype.generic in StockBalance.get_input_types():
+                layer = cls.push(movement, cls.get_last_cost(movement.item_id))
+                layer.save()
+                return
+            layers = cls.get_open_layers(movement.item_id).select_for_update()
+            touched, consumptions = cls.consume(movement, 
+                layers.iterator(chunk_size=20), 
+                cls.get_last_cost(movement.item_id))
+            cls.objects.bulk_update(touched, ["remaining"])
+            CostLayerConsumption.objects.bulk_create(consumptions)
+
+    @classmethod
+    def revert(cls, item, date=None):
+        """
+        Deshace las capas y consumos del artículo a partir de la fecha 
+        indicada (o todos): devuelve a las capas anteriores la cantidad 
+        consumida desde esa fecha y elimina las capas y consumos posteriores.
+        """
+        consumptions = CostLayerConsumption.objects.filter(item=item)
+        layers = cls.objects.filter(item=item)
+
+        with transaction.atomic():
+            if date:
+                consumptions = consumptions.filter(date__gte=date)
+                layers = layers.filter(date__gte=date)
+                rows = consumptions.filter(layer__date__lt=date).order_by(
+                    ).values("layer_id").annotate(q=Sum("quantity"))
+                for row in rows:
+                    cls.objects.filter(pk=row["layer_id"]).update(
+                        remaining=F("remaining") + row["q"])
+            consumptions.delete()
+            layers.delete()
+
+    @classmethod
+    def replay(cls, item, date=None, exclude: dict=None):
+        """
+        Reprocesa las capas del artículo a partir de la fecha indicada (o 
+        toda su historia). Útil cuando se registran, modifican o eliminan 
+        movimientos con fecha anterior al último.
+
+        Parameters:
+            exclude (dict): filtros de los movimientos a omitir, por ejemplo
+            los que están por eliminarse.
+        """
+        item_id = getattr(item, "pk", item)
+        movements = cls.get_movements(item_id).select_related(
+            "document__doctype")
+        if date:
+            movements = movements.filter(document__date__gte=date)
+        if exclude:
+            movements = movements.exclude(**exclude)
+
+        with transaction.atomic():
+            cls.revert(item_id, date)
+            open_layers = list(cls.get_open_layers(item_id))
+            last_cost = cls.get_last_cost(item_id)
+            layers, touched, consumptions = cls.process(movements, 
+                open_layers, last_cost)
+            cls.objects.bulk_update([layer for layer in touched 
+                if layer.pk], ["remaining"], batch_size=1000)
+            cls.save_layers(layers, consumptions)
+
+    @classmethod
+    def process(cls, movements, open_layers: list=None, last_cost=0) -> tuple:
+        """
+        Procesa en memoria los movimientos indicados (en orden) sobre las 
+        capas abiertas.
+
+        Returns:
+            tuple: (capas nuevas, capas modificadas, consumos), sin guardar.
+        """
+        import collections
+        inputs = StockBalance.get_input_types()
+        queue = collections.deque(open_layers or [])
+        layers, touched, consumptions = [], dict(), []
+
+        for movement in movements:
+            if movement.document.doctype.generic in inputs:
+                layer = cls.push(movement, last_cost)
+                layers.append(layer)
+                queue.append(layer)
+                continue
+            objs, new_consumptions = cls.consume(movement, queue, last_cost)
+            for layer in objs:
+                touched[id(layer)] = layer
+            consumptions += new_consumptions
+            last_cost = new_consumptions[-1].cost if new_consumptions else (
+                last_cost)
+            while queue and (queue[0].remaining <= 0):
+                queue.popleft()
+        return layers, list(touched.values()), consumptions
+
+    @staticmethod
+    def save_layers(layers: list, consumptions: list, batch_size: int=1000):
+        """
+        Guarda las capas nuevas y sus consumos. Como bulk_create no devuelve 
+        los ids en todas las bases de datos, se obtienen a partir del 
+        movimiento de cada capa.
+        """
+        CostLayer.objects.bulk_create(layers, batch_size=batch_size)
+        if any(layer.pk is None for layer in layers):
+            ids = dict(CostLayer.objects.filter(movement__in=[
+                layer.movement_id for layer in layers]).values_list(
+                "movement_id", "id"))
+            for layer in layers:
+                layer.pk = ids[layer.movement_id]
+        for consumption in consumptions:
+            if consumption.layer:
+                consumption.layer_id = consumption.layer.pk
+        CostLayerConsumption.objects.bulk_create(consumptions, 
+            batch_size=batch_size)
+
+    @classmethod
+    def rebuild(cls, company, batch_size: int=1000, progress=None) -> int:
+        """
+        Reconstruye todas las capas y consumos de la empresa indicada. Los 
+        movimientos se leen en una sola consulta ordenada por artículo.
+
+        Parameters:
+            progress (callable): si se indica, se invocará como 
+            progress(done, total) después de guardar cada lote de artículos.
+
+        Returns:
+            int: cantidad de artículos procesados.
+        """
+        import itertools
+        company_id = getattr(company, "pk", company)
+        movements = Movement.objects.filter(
+            document__doctype__company=company_id, item__isnull=False, 
+            document__doctype__generic__in=cls.get_types()).select_related(
+            "document__doctype").order_by("item_id", *Movement.COST_ORDERING)
+        total = movements.values("item_id").distinct().count()
+        done = 0
+
+        with transaction.atomic():
+            CostLayerConsumption.objects.filter(company=company_id).delete()
+            cls.objects.filter(company=company_id).delete()
+            layers, consumptions = [], []
+            for item_id, group in itertools.groupby(movements.iterator(), 
+                key=lambda movement: movement.item_id):
+                objs, touched, item_consumptions = cls.process(group)
+                layers += objs
+                consumptions += item_consumptions
+                done += 1
+                if len(layers) + len(consumptions) >= batch_size:
+                    cls.save_layers(layers, consumptions, batch_size)
+                    layers, consumptions = [], []
+                    if progress:
+                        progress(done, total)
+            cls.save_layers(layers, consumptions, batch_size)
+        if progress:
+            progress(done, total)
+        return done
+
+    @classmethod
+    def get_valuation(cls, company, item=None) -> Decimal:
+        """Obtiene el valor del inventario (restante x costo) de las capas."""
+        qs = cls.objects.filter(company=getattr(company, "pk", company), 
+            remaining__gt=0)
+        if item:
+            qs = qs.filter(item=item)
+        return qs.aggregate(v=Sum(F("remaining") * F("cost"), 
+            output_field=models.DecimalField()))["v"] or 0
+
+    @staticmethod
+    def get_cogs(company, start=None, end=None, item=None) -> Decimal:
+        """
+        Obtiene el costo de lo vendido (o salido) entre las fechas indicadas 
+        (inclusive) a partir de los consumos de las capas.
+        """
+        qs = CostLayerConsumption.objects.filter(
+            company=getattr(company, "pk", company))
+        if start:
+            qs = qs.filter(date__gte=start)
+        if end:
+            qs = qs.filter(date__lte=end)
+        if item:
+            qs = qs.filter(item=item)
+        return qs.aggregate(v=Sum(F("quantity") * F("cost"), 
+            output_field=models.DecimalField()))["v"] or 0
+
+
+class CostLayerConsumption(ModelBase):
+    """
+    Cantidad de una capa de costo consumida por un movimiento de salida. Si 
+    no hay capa, la salida superó la existencia y se costeó con el último 
+    costo conocido.
+    """
+    tags = None
+
+    item = models.ForeignKey(Item, on_delete=models.CASCADE, 
+    verbose_name=_l("artículo"))
+
+    movement = models.ForeignKey(Movement, on_delete=models.CASCADE, 
+    verbose_name=_l("movimiento de salida"))
+
+    layer = models.ForeignKey(CostLayer, on_delete=models.CASCADE, 
+    blank=True, null=True, verbose_name=_l("capa de costo"))
+
+    date = models.DateField(_l("fecha"))
+
+    quantity = models.DecimalField(_l("cantidad"), max_digits=22, 
+    decimal_places=2, default=0)
+
+    cost = models.DecimalField(_l("costo unitario"), max_digits=22, 
+    decimal_places=4, default=0)
+
+    class Meta:
+        verbose_name = _l("consumo de capa de costo")
+        verbose_name_plural = _l("consumos de capas de costo")
+        ordering = ["id"]
+        indexes = [
+            models.Index(fields=["item", "date"], 
+                name="costlayerconsumption_date_idx"),
+        ]
+
+    def __str__(self):
+        return f"{self.date} {self.item} {self.quantity} x {self.cost}"
@@ -1,13 +1,17 @@
 import copy
+import datetime
 import timeit
+from unittest import mock
 
 from django.core.exceptions import ValidationError
 from django.db.utils import IntegrityError
 
 from base.tests import BaseTestCase
 from company.tests.tests_models import get_or_create_company
+from document.models import Document
 from document.tests.tests_models import get_or_create_document
-from inventory.models import (Item, ItemFamily, ItemGroup, Movement)
+from inventory.models import (Item, ItemFamily, ItemGroup, Movement, 
+    StockBalance, StockCheckpoint, CostLayer, ItemToken)
 from finance.models import Tax
 
 
@@ -28,6 +32,23 @@ class ItemTest(BaseTestCase):
         item2.code = self.item.code
         self.assertRaises(IntegrityError, item2.save)
 
+    def test_code_is_not_repeated_after_delete(self):
+        company = self.item.company
+        item2 = Item.objects.create(codename="item2", name="item2", 
+            company=company)
+        self.assertEqual(int(item2.code), int(self.item.code) + 1)
+        item2.delete()
+        item3 = Item.objects.create(codename="item3", name="item3", 
+            company=company)
+        self.assertEqual(int(item3.code), int(self.item.code) + 2)
+
+        # Reserva de un bloque de códigos.
+        items = [Item(codename=f"bulk{i}", name="bulk", company=company) 
+            for i in range(3)]
+        Item.assign_codes(items)
+        self.assertEqual([int(item.code) for item in items], 
+            [int(item3.code) + i for i in (1, 2, 3)])
+
     def test_codename_is_uppercase(self):
         self.assertEqual(self.item.codename, "ITEM")
 
@@ -141,6 +162,321 @@ class ItemTest(BaseTestCase):
         self.assertLess(timeit.timeit(movement.get_available, number=1), 0.1)
 
         
+class ItemTokenTest(BaseTestCase):
+
+    def setUp(self):
+        self.company = get_or_create_company()
+        group = ItemGroup.objects.create(company=self.company, name="Bebidas")
+        self.cola = Item.objects.create(company=self.company, codename="CC-500",
+            name="Refresco de cola", group=group)
+        self.lemon = Item.objects.create(company=self.company, codename="LM-1",
+            name="Limonada", description="Bebida de limón natural")
+
+    def test_prefix_search(self):
+        self.assertEqual(ItemToken.search(self.company, "refr col"), 
+            [self.cola.pk])
+        self.assertEqual(ItemToken.search(self.company, "limon"), 
+            [self.lemon.pk])
+        self.assertEqual(ItemToken.search(self.company, "cola limon"), [])
+        self.assertEqual(ItemToken.search(self.company, ""), [])
+
+    def test_ranking_and_update(self):
+        # El nombre pesa más que la descripción.
+        self.cola.description = "sabor a limonada"
+        self.cola.save()
+        self.assertEqual(ItemToken.search(self.company, "limonada"), 
+            [self.lemon.pk, self.cola.pk])
+        # Al cambiar el nombre del grupo se actualizan sus artículos.
+        self.cola.group.name = "Gaseosas"
+        self.cola.group.save()
+        self.assertEqual(ItemToken.search(self.company, "gase"), [self.cola.pk])
+        self.assertEqual(ItemToken.search(self.company, "bebidas"), [])
+
+    def test_rebuild(self):
+        ItemToken.objects.all().delete()
+        self.assertEqual(ItemToken.rebuild(self.company), 2)
+        self.assertEqual(ItemToken.search(self.company, "cc 500"), 
+            [self.cola.pk])
+
+
+class StockBalanceTest(BaseTestCase):
+
+    def setUp(self):
+        document = copy.copy(get_or_create_document())
+        doctype = copy.copy(document.doctype)
+        doctype.pk = None
+        doctype.code = "test6"
+        doctype.generic = doctype.INVENTORY_INPUT
+        doctype.save()
+        document.pk = None
+        document.doctype = doctype
+        document.save()
+        self.document = document
+        self.item = Item.objects.create(company=doctype.company, name="item", 
+            codename="item")
+        self.movement = Movement.objects.create(document=document, 
+            item=self.item, quantity=10, price=0, discount=0)
+
+    def test_the_item_available_field_is_maintained(self):
+        self.item.refresh_from_db()
+        self.assertEqual(self.item.available, 10)
+        self.assertEqual(self.item.get_global_available(), 10)
+        # Una instancia desactualizada no sobrescribe el disponible.
+        stale_item = Item.objects.get(pk=self.item.pk)
+        Movement.objects.create(document=self.document, item=self.item, 
+            quantity=5, price=0, discount=0)
+        stale_item.save()
+        self.assertEqual(self.item.get_available(), 15)
+
+    def test_movement_delete(self):
+        self.movement.delete()
+        self.assertEqual(self.item.get_available(self.document.warehouse), 0)
+        self.assertEqual(self.item.get_available(), 0)
+
+    def test_document_warehouse_change(self):
+        old_warehouse = self.document.warehouse
+        new_warehouse = copy.copy(old_warehouse)
+        new_warehouse.pk = None
+        new_warehouse.save()
+        self.document.warehouse = new_warehouse
+        self.document.save()
+        self.assertEqual(self.item.get_available(old_warehouse), 0)
+        self.assertEqual(self.item.get_available(new_warehouse), 10)
+        self.assertEqual(self.item.get_available(), 10)
+
+    def test_rebuild(self):
+        StockBalance.objects.all().update(inputs=0, outputs=0, available=0)
+        Item.objects.all().update(available=0, available_json={})
+        count = StockBalance.rebuild(self.document.doctype.company)
+        self.assertEqual(count, Item.objects.filter(
+            company=self.document.doctype.company).count())
+        self.item.refresh_from_db()
+        self.assertEqual(self.item.get_available(self.document.warehouse), 10)
+        self.assertEqual(self.item.available, 10)
+        self.assertEqual(self.item.available_json["available"], 10)
+
+    def test_document_delete(self):
+        self.document.delete()
+        self.assertEqual(self.item.get_available(), 0)
+        self.assertEqual(StockBalance.objects.get(item=self.item).available, 0)
+
+    def test_service_items_have_no_stock(self):
+        """
+        Las entradas de un artículo de servicio no le dan disponible, ni al 
+        aplicarlas ni al reconstruir la existencia.
+        """
+        service = Item.objects.create(company=self.item.company, 
+            name="service", codename="service", is_service=True)
+        Movement.objects.create(document=self.document, item=service, 
+            quantity=5, price=0, discount=0)
+        Movement.bulk_import(self.document, [{"item": service.pk, 
+            "quantity": 3, "price": 0}])
+        company = self.document.doctype.company
+        warehouse = copy.copy(self.document.warehouse)
+        warehouse.pk = None
+        warehouse.save()
+        self.document.warehouse = warehouse
+        self.document.save()
+        for i in range(2):
+            service.refresh_from_db()
+            self.assertEqual(service.available, 0)
+            self.assertEqual(service.get_global_available(), 0)
+            self.assertFalse(StockBalance.objects.filter(item=service).exists())
+            self.assertNotIn(service, Item.objects.filter(company=company, 
+                available__gt=0))
+            StockBalance.rebuild(company)
+        self.assertEqual(service.available_json["available"], 0)
+
+
+class StockCheckpointTest(BaseTestCase):
+
+    def create_document(self, generic, date):
+        document = copy.copy(get_or_create_document())
+        doctype = copy.copy(document.doctype)
+        doctype.pk = None
+        doctype.code = f"t{doctype.__class__.objects.count()}"
+        doctype.generic = generic
+        doctype.save()
+        document.pk = None
+        document.doctype = doctype
+        document.date = date
+        document.save()
+        return document
+
+    def setUp(self):
+        self.input_document = self.create_document(
+            get_or_create_document().doctype.INVENTORY_INPUT, 
+            datetime.date(2026, 1, 15))
+        self.output_document = self.create_document(
+            get_or_create_document().doctype.INVENTORY_OUTPUT, 
+            datetime.date(2026, 3, 10))
+        self.item = Item.objects.create(
+            company=self.input_document.doctype.company, name="item", 
+            codename="item")
+        Movement.objects.create(document=self.input_document, item=self.item, 
+            quantity=10, price=0, discount=0)
+        Movement.objects.create(document=self.output_document, item=self.item,
+            quantity=4, price=0, discount=0)
+        self.warehouse = self.input_document.warehouse
+
+    def test_get_available_as_of(self):
+        StockCheckpoint.build_until(self.item.company, 
+            until=datetime.date(2026, 4, 30))
+        self.assertEqual(StockCheckpoint.get_last_date(self.item.company), 
+            datetime.date(2026, 4, 30))
+        self.assertEqual(self.item.get_available(
+            as_of=datetime.date(2025, 12, 31)), 0)
+        self.assertEqual(self.item.get_available(
+            as_of=datetime.date(2026, 2, 1)), 10)
+        self.assertEqual(self.item.get_available(self.warehouse, 
+            as_of=datetime.date(2026, 3, 31)), 6)
+        self.assertEqual(self.warehouse.get_stock(
+            as_of=datetime.date(2026, 3, 9))[self.item.pk], 10)
+
+    def test_backdated_movement_updates_checkpoints(self):
+        """
+        Un movimiento con fecha anterior a los cortes suma su cambio solo a 
+        los cortes de su artículo desde su fecha; no elimina los cortes.
+        """
+        other = Item.objects.create(company=self.item.company, name="other", 
+            codename="other")
+        Movement.objects.create(document=self.input_document, item=other, 
+            quantity=2, price=0, discount=0)
+        StockCheckpoint.build_until(self.item.company, 
+            until=datetime.date(2026, 4, 30))
+        other_checkpoints = list(StockCheckpoint.objects.filter(
+            item=other).values_list("date", "available"))
+        document = self.create_document(
+            self.input_document.doctype.generic, datetime.date(2026, 2, 10))
+        Movement.objects.create(document=document, item=self.item, 
+            quantity=1, price=0, discount=0)
+
+        self.assertEqual(StockCheckpoint.get_last_date(self.item.company), 
+            datetime.date(2026, 4, 30))
+        self.assertEqual(list(StockCheckpoint.objects.filter(
+            item=self.item).values_list("date", "available")), [
+                (datetime.date(2026, 4, 30), 7), 
+                (datetime.date(2026, 3, 31), 7), 
+                (datetime.date(2026, 2, 28), 11), 
+                (datetime.date(2026, 1, 31), 10)])
+        self.assertEqual(list(StockCheckpoint.objects.filter(
+            item=other).values_list("date", "available")), other_checkpoints)
+        self.assertEqual(self.item.get_available(
+            as_of=datetime.date(2026, 3, 31)), 7)
+
+        # Un almacén sin cortes recibe los que faltan desde la fecha.
+        warehouse = copy.copy(document.warehouse)
+        warehouse.pk = None
+        warehouse.save()
+        document.warehouse = warehouse
+        document.save()
+        self.assertEqual(StockCheckpoint.objects.filter(item=self.item, 
+            warehouse=document.warehouse).count(), 3)
+        self.assertEqual(self.item.get_available(document.warehouse, 
+            as_of=datetime.date(2026, 4, 30)), 1)
+        self.assertEqual(self.item.get_available(self.warehouse, 
+            as_of=datetime.date(2026, 4, 30)), 6)
+
+
+class ItemCostTest(BaseTestCase):
+
+    def create_document(self, generic, date):
+        document = StockCheckpointTest.create_document(self, generic, date)
+        document.doctype.affect_cost = True
+        document.doctype.save()
+        return document
+
+    def setUp(self):
+        doctype = get_or_create_document().doctype
+        self.purchase = self.create_document(doctype.PURCHASE, 
+            datetime.date(2026, 1, 10))
+        self.invoice = self.create_document(doctype.INVOICE, 
+            datetime.date(2026, 1, 20))
+        self.item = Item.objects.create(company=self.purchase.doctype.company,
+            name="item", codename="item")
+        Movement.objects.create(document=self.purchase, item=self.item, 
+            quantity=10, price=100, discount=0)
+        Movement.objects.create(document=self.invoice, item=self.item, 
+            quantity=4, price=150, discount=0)
+
+    def add_purchase(self, date, quantity, price):
+        document = self.create_document(self.purchase.doctype.PURCHASE, date)
+        return Movement.objects.create(document=document, item=self.item, 
+            quantity=quantity, price=price, discount=0)
+
+    def test_weighted_average_cost(self):
+        self.add_purchase(datetime.date(2026, 2, 1), 6, 160)
+        self.item.refresh_from_db()
+        # (6 x 100 + 6 x 160) / 12
+        self.assertEqual(self.item.get_average_cost(), 130)
+        movement = self.invoice.movement_set.get()
+        self.assertEqual(movement.cost, 100)
+        self.assertEqual(movement.get_margin(), 200)
+
+    def test_backdated_purchase_replays_the_cost(self):
+        self.add_purchase(datetime.date(2026, 1, 5), 10, 200)
+        self.item.refresh_from_db()
+        # Compra de 10 x 200 y 10 x 100 antes de la factura: costo 150.
+        self.assertEqual(self.item.get_average_cost(), 150)
+        self.assertEqual(self.invoice.movement_set.get().cost, 150)
+
+    def test_delete_and_currency_rate_change(self):
+        movement = self.add_purchase(datetime.date(2026, 2, 1), 6, 160)
+        movement.delete()
+        self.item.refresh_from_db()
+        self.assertEqual(self.item.get_average_cost(), 100)
+
+        self.purchase.currency_rate = 2
+        self.purchase.save()
+        self.item.refresh_from_db()
+        self.assertEqual(self.item.get_average_cost(), 200)
+
+        self.purchase.delete()
+        self.item.refresh_from_db()
+        self.assertEqual(self.item.get_average_cost(), 0)
+
+
+class CostLayerTest(BaseTestCase):
+
+    def setUp(self):
+        doctype = get_or_create_document().doctype
+        self.company = doctype.company
+        self.company.valuation = self.company.FIFO
+        self.company.save()
+        self.item = Item.objects.create(company=self.company, name="item", 
+            codename="item")
+        self.add_movement(doctype.PURCHASE, datetime.date(2026, 1, 10), 10, 100)
+        self.add_movement(doctype.PURCHASE, datetime.date(2026, 1, 15), 5, 200)
+        self.invoice = self.add_movement(doctype.INVOICE, 
+            datetime.date(2026, 1, 20), 12, 300)
+
+    def add_movement(self, generic, date, quantity, price):
+        document = StockCheckpointTest.create_document(self, generic, date)
+        return Movement.objects.create(document=document, item=self.item, 
+            quantity=quantity, price=price, discount=0)
+
+    def assertLayers(self, valuation, cogs):
+        self.assertEqual(CostLayer.get_valuation(self.company), valuation)
+        self.assertEqual(CostLayer.get_cogs(self.company), cogs)
+
+    def test_outputs_consume_the_oldest_layers(self):
+        self.assertLayers(3 * 200, 10 * 100 + 2 * 200)
+        self.assertEqual(self.invoice.get_fifo_cost_total(), 1400)
+
+    def test_backdated_input_and_delete(self):
+        self.add_movement(self.invoice.document.doctype.PURCHASE, 
+            datetime.date(2026, 1, 5), 4, 50)
+        self.assertLayers(2 * 100 + 5 * 200, 4 * 50 + 8 * 100)
+
+        self.invoice.delete()
+        self.assertLayers(4 * 50 + 10 * 100 + 5 * 200, 0)
+
+    def test_rebuild(self):
+        CostLayer.objects.update(remaining=0)
+        self.assertEqual(CostLayer.rebuild(self.company), 1)
+        self.assertLayers(3 * 200, 10 * 100 + 2 * 200)
+
+
 class ItemGroupTest(BaseTestCase):
     def setUp(self):
         company = get_or_create_company()
@@ -218,6 +554,49 @@ class MovementTest(BaseTestCase):
         local_total = total * self.movement.document.currency_rate
         self.assertEqual(local_total, self.movement.get_local_total())
 
+    def test_bulk_import(self):
+        document = self.movement.document
+        item = self.movement.item
+        rows = [{"item": item.pk, "quantity": "3", "price": "10"}, 
+            {"codename": "item", "quantity": 1, "price": 5, "discount": 1}]
+        movements = Movement.bulk_import(document, rows)
+        self.assertEqual([m.number for m in movements], [2, 3])
+        self.assertEqual(document.movement_set.count(), 3)
+        document.refresh_from_db()
+        self.assertEqual(document.amount, sum(m.get_amount() for m in 
+            document.movement_set.all()))
+
+        # Si una línea no es válida no se crea ningún movimiento.
+        rows = [{"item": item.pk, "quantity": 1, "price": 1}, 
+            {"item": 0, "quantity": 1, "price": 1},
+            {"item": item.pk, "quantity": -1, "price": 1}]
+        with self.assertRaises(ValidationError) as cm:
+            Movement.bulk_import(document, rows)
+        self.assertEqual(len(cm.exception.message_dict), 2)
+        self.assertEqual(document.movement_set.count(), 3)
+
+    def test_bulk_import_calculates_once(self):
+        """
+        Los totales del documento se calculan una sola vez por importación, 
+        también dentro de otro bloque deferred_totals.
+        """
+        document = self.movement.document
+        rows = [{"item": self.movement.item.pk, "quantity": 1, "price": 1}]
+        with mock.patch.object(Document, "calculate", autospec=True, 
+            side_effect=Document.calculate) as calculate:
+            Movement.bulk_import(document, rows * 3)
+            self.assertEqual(calculate.call_count, 1)
+
+            calculate.reset_mock()
+            with document.deferred_totals():
+                Movement.bulk_import(document, rows)
+                Movement.bulk_import(document, rows * 2)
+                self.assertEqual(calculate.call_count, 0)
+            self.assertEqual(calculate.call_count, 1)
+        document.refresh_from_db()
+        self.assertEqual(document.amount, sum(m.get_amount() for m in 
+            document.movement_set.all()))
+
     def test_document_company_is_item_company(self):
         """La empresa del documento debe ser la misma que la del artículo."""
         company2 = copy.copy(self.movement.item.company)
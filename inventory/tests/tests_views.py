@@ -0,0 +1,104 @@
+from unittest import mock
+
+from django import forms
+from django.urls import reverse
+
+from base.tests import BaseTestCase
+from company.tests.tests_models import get_or_create_company
+from document.tests.tests_models import get_or_create_document
+from inventory.models import Item, Movement
+from inventory.views import ItemListView, MovementListView
+from inventory.forms import ItemSearchForm, MovementSearchForm
+from user.tests.tests_models import get_or_create_user
+
+
+class ItemListViewTest(BaseTestCase):
+    """Prueba para la vista ItemListView."""
+
+    def setUp(self):
+        super().setUp()
+        self.company = get_or_create_company()
+        self.company.users.add(get_or_create_user())
+        self.client.login(username="test", password="test")
+        self.url = reverse("inventory-item-list", kwargs={
+            "company": self.company.pk})
+        for name in ("tornillo", "tuerca"):
+            item = Item(company=self.company, codename=name, name=name)
+            item.clean()
+            item.save()
+
+    def test_search_uses_token_index(self):
+        response = self.client.get(self.url, {"tags__icontains": "torn"})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([str(obj) for obj in response.context["object_list"]],
+            ["TORNILLO"])
+
+    def test_search_plan(self):
+        plan = ItemListView().get_search_plan({
+            "tags__icontains": "torn",
+            "code__icontains": "1",
+            "code__startswith": "1",
+            "group__exact": 1,
+            "description__icontains": "x",
+            "foo__bar": "x",
+            "name": "",
+        }, Item)
+        self.assertEqual({step["key"]: step["action"] for step in plan}, {
+            "tags__icontains": "declared",
+            "code__icontains": "rejected",
+            "code__startswith": "rewritten",
+            "group__exact": "indexed",
+            "description__icontains": "rejected",
+            "foo__bar": "rejected",
+        })
+        self.assertFalse(plan[0]["filter"].is_scan)
+
+    def test_rejected_filter_warns_user(self):
+        """Un filtro que no se aplica se avisa al usuario, sin DEBUG."""
+        class SearchForm(ItemSearchForm):
+            code__icontains = forms.CharField(label="Código", required=False)
+
+        with mock.patch.object(ItemListView, "search_form_class", SearchForm):
+            response = self.client.get(self.url, {"code__icontains": "23"})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.context["object_list"]), 2)
+        self.assertIn("No se aplicó el filtro 'Código' (recorre la tabla).",
+            [str(m) for m in response.context["messages"]])
+
+    def test_default_tags_search_is_rejected(self):
+        """
+        Los listados sin índice de palabras no recorren la tabla con la 
+        búsqueda general: la rechazan y lo avisan.
+        """
+        url = reverse("inventory-itemgroup-list", kwargs={
+            "company": self.company.pk})
+        response = self.client.get(url, {"tags__icontains": "torn"})
+        self.assertEqual(response.status_code, 200)
+        self.assertIn("No se aplicó el filtro 'Buscar...' (recorre la tabla).",
+            [str(m) for m in response.context["messages"]])
+
+
+class MovementListViewTest(BaseTestCase):
+    """Prueba para la vista MovementListView."""
+
+    def test_search_uses_item_token_index(self):
+        document = get_or_create_document()
+        for name in ("tornillo", "tuerca"):
+            item = Item(company=document.doctype.company, codename=name, 
+                name=name)
+            item.clean()
+            item.save()
+            Movement.objects.create(document=document, item=item, quantity=1,
+                price=0, discount=0)
+
+        form = MovementSearchForm({"item__tags__icontains": "torn"})
+        self.assertTrue(form.is_valid())
+        plan = MovementListView().get_search_plan(form.cleaned_data, Movement)
+        self.assertEqual([(step["key"], step["action"]) for step in plan], 
+            [("item__tags__icontains", "declared")])
+        self.assertFalse(plan[0]["filter"].is_scan)
+
+        qs = plan[0]["filter"].apply(Movement.objects.all(), plan[0]["value"],
+            company=document.doctype.company)
+        self.assertEqual([str(movement.item) for movement in qs], 
+            ["TORNILLO"])
@@ -1,4 +1,9 @@
 
+import csv
+import io
+import json
+
+from django.core.exceptions import ValidationError
 from django.shortcuts import render, get_object_or_404
 from django.utils.translation import gettext as _
 from django.views import generic
@@ -8,12 +13,13 @@ from dal import autocomplete
 
 from unoletutils.libs import text
 from unoletutils.views import (ListView, DetailView, UpdateView, CreateView, 
-    DeleteView, TemplateView, JsonResponseMixin)
+    DeleteView, TemplateView, JsonResponseMixin, SearchFilter)
 from company.models import Company
 from document.models import Document
-from inventory.models import (Item, ItemFamily, ItemGroup, Movement)
+from inventory.models import (Item, ItemFamily, ItemGroup, ItemToken, 
+    Movement)
 from inventory.forms import (ItemGroupForm, ItemFamilyForm, ItemForm, 
-    ItemSearchForm, MovementForm)
+    ItemSearchForm, MovementForm, MovementSearchForm)
 
 
 class Index(TemplateView):
@@ -103,6 +109,12 @@ class ItemListView(ListView):
         "get_global_available": "text-end",
     }
     search_form_class = ItemSearchForm
+    # La búsqueda usa el índice de palabras de los artículos (ItemToken).
+    search_filters = {
+        "tags__icontains": SearchFilter("pk", SearchFilter.TAGS, 
+            index=ItemToken.search),
+        "available__gt": SearchFilter("available", SearchFilter.GT),
+    }
 
 
 class ItemMovementListView(ListView):
@@ -125,6 +137,15 @@ class MovementListView(ListView):
     """Listado de movimienetos."""
     model = Movement
     template_name = "inventory/movement_list.html"
+    pagination_mode = ListView.CURSOR
+    cursor_ordering = ("-id",)
+    list_count_timeout = 60
+    search_form_class = MovementSearchForm
+    # La búsqueda usa el índice de palabras de los artículos (ItemToken).
+    search_filters = {
+        "item__tags__icontains": SearchFilter("item_id", SearchFilter.TAGS, 
+            index=ItemToken.search),
+    }
 
 
 class MovementDetailView(DetailView):
@@ -144,23 +165,22 @@ def item_list_jsonview(request, company: int) -> JsonResponse:
     except (TypeError, ValueError):
         limit = 20
     
-    qs = Item.active_objects.filter(company=company)
-
-    if request.GET.get("q"):
-        qs = qs.filter(tags__icontains=text.Text.get_tag(request.GET["q"]))
-    else:
-        qs = qs.none()
+    # Los ids se obtienen del índice de búsqueda, ordenados por relevancia.
+    ids = ItemToken.search(company, request.GET.get("q", ""), limit=limit, 
+        is_active=True)
+    qs = Item.active_objects.filter(company=company, pk__in=ids)
+    position = {pk: index for index, pk in enumerate(ids)}
 
-    qs = qs[:limit]
-    item_list = list(qs.values(
+    item_list = sorted(qs.values(
         "id", "code", "codename", "name", "description", 
         "group_id", "group__name",
         "family_id", "family__name",
         "tax_id", "tax__name", "tax__value", "tax__value_type",
         "min_price", "max_price", "available",
         "is_active"
-    ))
-    return JsonResponse({"data": {"items": item_list, "count": qs.count()}})
+    ), key=lambda item: position[item["id"]])
+    return JsonResponse({"data": {"items": item_list, 
+        "count": len(item_list)}})
 
 
 def json_response_error(field: str, message: str, code: str="", status=404):
@@ -217,7 +237,8 @@ def movement_form_jsonview(request, company: int, document: int) -> JsonResponse
         if form.is_valid():
             instance = form.save(commit=False)
             # Lógica. ....
-            instance.save()
+            with document.deferred_totals():
+                instance.save()
             return JsonResponse({"data": {"pk": instance.pk}})
         else:
             errors = form.errors.as_json()
@@ -228,6 +249,49 @@ def movement_form_jsonview(request, company: int, document: int) -> JsonResponse
     return JsonResponse({"data": {"company": company.pk, "document": document}})
 
     
+def movement_import_jsonview(request, company: int, document: int
+    ) -> JsonResponse:
+    """
+    Crea en lote los movimientos de un documento y devuelve un JsonResponse.
+
+    Los movimientos se reciben por POST como JSON ({"movements": [...]}) o 
+    como un archivo CSV en el campo 'file', con las columnas de 
+    Movement.bulk_import. Si alguna línea no es válida no se crea ninguna.
+    """
+    company = get_object_or_404(Company, pk=company)
+    document = get_object_or_404(Document, doctype__company=company, pk=document)
+
+    if not request.user.has_company_permission(company, 
+        "inventory.add_movement"):
+        return json_response_error("global", _("Permiso denegado."))
+
+    if request.method != "POST":
+        return json_response_error("global", _("Método no permitido."), 
+            "method", 405)
+
+    try:
+        if request.FILES.get("file"):
+            rows = list(csv.DictReader(io.TextIOWrapper(request.FILES["file"], 
+                encoding="utf-8-sig")))
+        else:
+            rows = json.loads(request.body)
+            rows = rows.get("movements") if isinstance(rows, dict) else rows
+    except (ValueError, csv.Error, UnicodeDecodeError):
+        return json_response_error("global", _("El formato no es válido."), 
+            "invalid", 400)
+
+    if ((not isinstance(rows, list)) or (not rows) or 
+        (not all(isinstance(row, dict) for row in rows))):
+        return json_response_error("global", 
+            _("Debe indicar al menos un movimiento."), "required", 400)
+
+    try:
+        movements = Movement.bulk_import(document, rows)
+    except (ValidationError) as e:
+        return JsonResponse({"errors": e.message_dict}, status=400)
+    return JsonResponse({"data": {"count": len(movements)}})
+
+
 def movement_delete_jsonview(request, company, document) -> JsonResponse:
     """Elimina un movimiento y retorna un JsonResponse."""
     # Realizamos una consulta compleja para asegurarnos que la 
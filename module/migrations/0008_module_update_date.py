@@ -0,0 +1,18 @@
+# Generated by Django 3.1.14 on 2026-10-18 17:57
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('module', '0007_auto_20210114_1730'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='module',
+            name='update_date',
+            field=models.DateTimeField(auto_now=True, null=True, verbose_name='fecha de modificación'),
+        ),
+    ]
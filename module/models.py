@@ -1,5 +1,10 @@
 
-from django.db import models
+import time
+
+from django.db import models, transaction
+from django.db.models import Count, Max
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
 from django.utils.translation import gettext as _
 from django.utils.translation import gettext_lazy as _l
 from django.urls import reverse, reverse_lazy
@@ -37,6 +42,13 @@ class Module(ModelBase):
     ICON_CHOICES.sort()
     ICON_CHOICES = tuple(ICON_CHOICES)
 
+    # Segundos entre cada comprobación de la versión del árbol en la base de
+    # datos, que es lo que tardan los demás procesos en ver un cambio.
+    TREE_CHECK_INTERVAL = 5
+
+    # Árbol de módulos en memoria de este proceso (ver get_tree).
+    _tree = None
+
     company = None
 
     name = models.CharField(_l("nombre"), max_length=70, unique=True)
@@ -55,6 +67,9 @@ class Module(ModelBase):
 
     css_textcolor = ColorField(_l("Color del texto"), default="#FFFFFF")
 
+    update_date = models.DateTimeField(_l("fecha de modificación"), 
+    auto_now=True, null=True)
+
     class Meta:
         verbose_name = _l("módulo")
         verbose_name_plural = _l("módulos")
@@ -76,15 +91,142 @@ class Module(ModelBase):
         return icons.get_url(self.icon_name)
 
     def get_svg(self, size: str=None, fill: str=None):
-        return icons.svg(self.icon_name, size=size, fill=fill, id=f"module_{self.id}")
+        # icons.render guarda en memoria el svg ya generado.
+        return icons.svg(self.icon_name, size=size, fill=fill, 
+            id=f"module_{self.id}")
+
+    @classmethod
+    def get_tree_version(cls) -> tuple:
+        """
+        Obtiene la versión del árbol de módulos desde la base de datos: la 
+        cantidad de módulos y su última fecha de modificación. Cambia cada 
+        vez que se crea, modifica o elimina un módulo, en cualquier proceso.
+        """
+        values = cls.objects.aggregate(count=Count("id"), 
+            last=Max("update_date"))
+        return (values["count"], values["last"])
+
+    @classmethod
+    def invalidate_tree(cls):
+        """Invalida el árbol de módulos en memoria de este proceso."""
+        cls._tree = None
+
+    @classmethod
+    def get_tree(cls) -> dict:
+        """
+        Obtiene el árbol de módulos, cargado con una sola consulta y guardado
+        en memoria del proceso. Su versión (get_tree_version) se comprueba a
+        lo sumo cada TREE_CHECK_INTERVAL segundos, así los cambios hechos en
+        otros procesos se ven en ese tiempo; los de este proceso, al momento.
+
+        El árbol solo guarda los valores de los módulos, las instancias se 
+        crean en cada llamada (ver get_by_url_name, get_children), así lo que
+        se modifique en ellas no pasa a otras peticiones.
+
+        Returns:
+            dict: {"version": tuple, "checked": float, "db": str, 
+            "fields": [attname], 
+            "rows": {pk: (valores)}, "url_names": {url_name: pk}, 
+            "children": {parent_id: (pk)}, "ancestors": {pk: (pk)}}.
+        """
+        tree = cls._tree
+        now = time.monotonic()
+        if (tree is None) or (now - tree["checked"] > cls.TREE_CHECK_INTERVAL):
+            version = cls.get_tree_version()
+            if (tree is None) or (tree["version"] != version):
+                tree = cls.build_tree(version)
+            tree["checked"] = now
+            cls._tree = tree
+        return tree
+
+    @classmethod
+    def build_tree(cls, version: tuple=None) -> dict:
+        """Construye el árbol de módulos (ver get_tree)."""
+        if version is None:
+            version = cls.get_tree_version()
+        fields = [f.attname for f in cls._meta.concrete_fields]
+        qs = cls.objects.values_list(*fields)
+        rows = {row[fields.index(cls._meta.pk.attname)]: row for row in qs}
+        parents = {pk: row[fields.index("parent_id")] 
+            for pk, row in rows.items()}
+        children = dict()
+        ancestors = dict()
+
+        for pk, parent_id in parents.items():
+            children.setdefault(parent_id, []).append(pk)
+            out = []
+            current = parent_id if parent_id in rows else None
+            while (current is not None) and (not current in out):
+                out.append(current)
+                current = parents.get(current)
+            out.reverse()
+            ancestors[pk] = tuple(out)
+
+        return {
+            "version": version, 
+            "checked": time.monotonic(),
+            "db": qs.db,
+            "fields": fields,
+            "rows": rows,
+            "url_names": {row[fields.index("url_name")]: pk 
+                for pk, row in rows.items()}, 
+            "children": {k: tuple(v) for k, v in children.items()},
+            "ancestors": ancestors,
+        }
+
+    @classmethod
+    def from_tree(cls, pk: int):
+        """
+        Crea una nueva instancia del módulo indicado con los valores del 
+        árbol, con su padre y sus ancestros (get_ancestors) ya resueltos.
+        """
+        tree = cls.get_tree()
+        if not pk in tree["rows"]:
+            return None
+        fields = tree["fields"]
+        modules = [cls.from_db(tree["db"], fields, tree["rows"][i]) 
+            for i in tree["ancestors"][pk] + (pk,)]
+        for parent, obj in zip(modules, modules[1:]):
+            obj.parent = parent
+        obj = modules[-1]
+        obj._ancestors = tuple(modules[:-1])
+        return obj
+
+    @classmethod
+    def get_by_url_name(cls, url_name: str):
+        """Obtiene el módulo del árbol con el url_name indicado o None."""
+        return cls.from_tree(cls.get_tree()["url_names"].get(url_name))
+
+    @classmethod
+    def get_children(cls, parent=None) -> list:
+        """Obtiene los módulos hijos del indicado, o los principales."""
+        pks = cls.get_tree()["children"].get(getattr(parent, "pk", parent), ())
+        return [cls.from_tree(pk) for pk in pks]
+
+    @classmethod
+    def get_descendants(cls, parent=None) -> list:
+        """Obtiene todos los módulos por debajo del indicado."""
+        out = []
+        for obj in cls.get_children(parent):
+            out.append(obj)
+            out.extend(cls.get_descendants(obj))
+        return out
+
+    def get_ancestors(self) -> tuple:
+        """Obtiene los módulos padres, desde el principal hasta el inmediato."""
+        ancestors = getattr(self, "_ancestors", None)
+        if ancestors is None:
+            module = self.get_by_url_name(self.url_name)
+            ancestors = module.get_ancestors() if module else tuple()
+        return ancestors
 
     @staticmethod
     def get_from_request(request):
         """Obtiene el modulo a partir del request.resolver_match.url_name."""
-        try:
-            return Module.objects.get(url_name=request.resolver_match.url_name)
-        except (Module.DoesNotExist):
+        resolver_match = getattr(request, "resolver_match", None)
+        if resolver_match is None:
             return None
+        return Module.get_by_url_name(resolver_match.url_name)
         
     def build_url(self, **kwargs):
         """
@@ -92,3 +234,14 @@ class Module(ModelBase):
         pasados se pasarán igual a la función reverse de Django.
         """
         return reverse(self.url_name, kwargs=kwargs)
+
+
+@receiver(post_save, sender=Module)
+@receiver(post_delete, sender=Module)
+def invalidate_module_tree(sender, **kwargs):
+    """
+    Invalida el árbol de módulos de este proceso al cambiar un módulo. Los 
+    demás procesos lo detectan con su versión (ver Module.get_tree).
+    """
+    Module.invalidate_tree()
+    transaction.on_commit(Module.invalidate_tree)
@@ -1,3 +1,66 @@
-from django.test import TestCase
+from django.test import RequestFactory
+from django.utils import timezone
 
-# Create your tests here.
+from base.tests import BaseTestCase
+from module.models import Module
+
+
+class ModuleModelTest(BaseTestCase):
+
+    def test_tree_is_loaded_once_and_invalidated(self):
+        parent = Module.objects.create(name="test", url_name="test-parent",
+            icon_name="file-text")
+        child = Module.objects.create(name="test child", 
+            url_name="test-child", parent=parent, icon_name="file-text")
+
+        Module.get_tree()
+        with self.assertNumQueries(0):
+            module = Module.get_by_url_name("test-child")
+            self.assertEqual(module.get_ancestors(), (parent,))
+            self.assertEqual(module.parent, parent)
+            self.assertIn(child, Module.get_children(parent))
+            self.assertIn(child, Module.get_descendants())
+            self.assertEqual(module.get_svg(), module.get_svg())
+
+        request = RequestFactory().get("/")
+        request.resolver_match = type("ResolverMatch", (), 
+            {"url_name": "test-child"})
+        self.assertEqual(Module.get_from_request(request), child)
+
+        # Al modificar un módulo el árbol se vuelve a cargar.
+        child.parent = None
+        child.save()
+        self.assertEqual(Module.get_by_url_name("test-child").get_ancestors(), 
+            tuple())
+        child.delete()
+        self.assertIsNone(Module.get_by_url_name("test-child"))
+
+    def test_tree_returns_new_instances(self):
+        """Lo que se modifique en un módulo del árbol no pasa a otra llamada."""
+        parent = Module.objects.create(name="test", url_name="test-parent",
+            icon_name="file-text")
+        Module.objects.create(name="test child", url_name="test-child", 
+            parent=parent, icon_name="file-text")
+        module = Module.get_by_url_name("test-child")
+        module.name = "changed"
+        module.parent.name = "changed"
+        self.assertIsNot(module, Module.get_by_url_name("test-child"))
+        module = Module.get_by_url_name("test-child")
+        self.assertEqual(module.name, "test child")
+        self.assertEqual(module.get_ancestors()[0].name, "test")
+
+    def test_tree_sees_changes_from_other_processes(self):
+        """
+        Los cambios hechos en otro proceso (sin las señales de este) se ven 
+        al comprobar la versión en la base de datos.
+        """
+        Module.objects.create(name="test", url_name="test-parent", 
+            icon_name="file-text")
+        Module.get_tree()
+        Module.objects.filter(url_name="test-parent").update(name="other",
+            update_date=timezone.now() + timezone.timedelta(seconds=1))
+        with self.assertNumQueries(0):
+            self.assertEqual(Module.get_by_url_name("test-parent").name, 
+                "test")
+        Module._tree["checked"] -= Module.TREE_CHECK_INTERVAL + 1
+        self.assertEqual(Module.get_by_url_name("test-parent").name, "other")
@@ -1,6 +1,6 @@
 from django.contrib import admin
 
-from person.models import (Person, IdentificationType)
+from person.models import (Person, IdentificationType, PersonBalance)
 
 
 @admin.register(Person)
@@ -10,4 +10,11 @@ class PersonAdmin(admin.ModelAdmin):
 
 @admin.register(IdentificationType)
 class IdentificationTypeAdmin(admin.ModelAdmin):
-    list_display = ("name", )
\ No newline at end of file
+    list_display = ("name", )
+
+
+@admin.register(PersonBalance)
+class PersonBalanceAdmin(admin.ModelAdmin):
+    list_display = ("person", "account", "balance", "days_0_30", "days_31_60",
+        "days_61_90", "days_over_90", "as_of")
+    list_filter = ("account",)
@@ -0,0 +1,34 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from company.models import Company
+from person.models import PersonBalance
+
+
+class Command(BaseCommand):
+    help = ("Reconstruye los balances de las personas de las empresas "
+        "indicadas (o de todas), con su antigüedad a la fecha de hoy. Debe "
+        "ejecutarse cada noche (por ejemplo con cron) para que los balances "
+        "pasen al rango de antigüedad que les corresponde. También repara "
+        "los balances, que durante el día se actualizan por diferencias.")
+
+    def add_arguments(self, parser):
+        parser.add_argument("--company", type=int, nargs="*", default=None,
+            help="ids de las empresas a reconstruir. Por defecto todas.")
+        parser.add_argument("--batch-size", type=int, default=1000,
+            help="cantidad de registros por lote.")
+
+    def handle(self, *args, **options):
+        qs = Company.objects.all()
+        if options["company"]:
+            qs = qs.filter(pk__in=options["company"])
+            if not qs:
+                raise CommandError("No existen las empresas indicadas.")
+
+        for company in qs:
+            start = time.time()
+            count = PersonBalance.rebuild(company, 
+                batch_size=options["batch_size"])
+            self.stdout.write(self.style.SUCCESS(f"{company}: {count:,} "
+                f"balances actualizados en {time.time() - start:.2f}s."))
@@ -0,0 +1,44 @@
+# Generated by Django 3.1.14 on 2026-10-18 16:53
+
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+import unoletutils.libs.text
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('company', '0004_company_valuation'),
+        ('person', '0009_auto_20210124_2044'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PersonBalance',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('account', models.CharField(choices=[('receivable', 'Cuenta por cobrar'), ('payable', 'Cuenta por pagar')], max_length=20, verbose_name='cuenta')),
+                ('total', models.DecimalField(decimal_places=4, default=0, max_digits=32, verbose_name='total')),
+                ('paid', models.DecimalField(decimal_places=4, default=0, max_digits=32, verbose_name='pagado')),
+                ('balance', models.DecimalField(decimal_places=4, default=0, max_digits=32, verbose_name='balance')),
+                ('count', models.IntegerField(default=0, verbose_name='documentos pendientes')),
+                ('days_0_30', models.DecimalField(decimal_places=4, default=0, max_digits=32, verbose_name='0 - 30 días')),
+                ('days_31_60', models.DecimalField(decimal_places=4, default=0, max_digits=32, verbose_name='31 - 60 días')),
+                ('days_61_90', models.DecimalField(decimal_places=4, default=0, max_digits=32, verbose_name='61 - 90 días')),
+                ('days_over_90', models.DecimalField(decimal_places=4, default=0, max_digits=32, verbose_name='más de 90 días')),
+                ('as_of', models.DateField(default=django.utils.timezone.localdate, verbose_name='antigüedad a la fecha')),
+                ('company', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='company.company', verbose_name='Empresa')),
+                ('person', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='person.person', verbose_name='persona')),
+            ],
+            options={
+                'verbose_name': 'balance de persona',
+                'verbose_name_plural': 'balances de personas',
+            },
+            bases=(models.Model, unoletutils.libs.text.Text),
+        ),
+        migrations.AddConstraint(
+            model_name='personbalance',
+            constraint=models.UniqueConstraint(fields=('person', 'account'), name='unique_personbalance_person_account'),
+        ),
+    ]
@@ -0,0 +1,68 @@
+import datetime
+
+from django.db import migrations
+from django.db.models import Sum, Count, Q
+from django.utils import timezone
+
+
+# Copia de PersonBalance.ACCOUNT_TYPES y AGING_BUCKETS. Las migraciones no 
+# deben importar los modelos actuales.
+ACCOUNT_TYPES = {
+    "receivable": ("invoice", "accounting_income"),
+    "payable": ("purchase", "invoice_return", "accounting_expense"),
+}
+AGING_BUCKETS = (("days_0_30", None, 30), ("days_31_60", 31, 60), 
+    ("days_61_90", 61, 90), ("days_over_90", 91, None))
+VALUES_FIELDS = ("total", "paid", "balance", "count") + tuple(
+    bucket[0] for bucket in AGING_BUCKETS)
+
+
+def populate_personbalance(apps, schema_editor):
+    """Construye los balances a partir de los documentos ya registrados."""
+    Document = apps.get_model("document", "Document")
+    PersonBalance = apps.get_model("person", "PersonBalance")
+
+    as_of = timezone.localdate()
+    aggregates = {"total": Sum("total"), "paid": Sum("paid"), 
+        "balance": Sum("balance"), 
+        "count": Count("id", filter=Q(balance__gt=0))}
+    for name, start, end in AGING_BUCKETS:
+        condition = Q()
+        if start is not None:
+            condition &= Q(date__lte=as_of - datetime.timedelta(start))
+        if end is not None:
+            condition &= Q(date__gte=as_of - datetime.timedelta(end))
+        aggregates[name] = Sum("balance", filter=condition)
+
+    accounts = {generic: account for account, types in ACCOUNT_TYPES.items() 
+        for generic in types}
+    qs = Document.objects.filter(person__isnull=False, 
+        doctype__generic__in=list(accounts)).order_by().values("person_id", 
+        "person__company_id", "doctype__generic").annotate(
+        **{f"sum_{k}": v for k, v in aggregates.items()})
+
+    balances = {}
+    for row in qs:
+        key = (row["person__company_id"], row["person_id"], 
+            accounts[row["doctype__generic"]])
+        values = balances.setdefault(key, dict.fromkeys(VALUES_FIELDS, 0))
+        for field in VALUES_FIELDS:
+            values[field] += row[f"sum_{field}"] or 0
+
+    PersonBalance.objects.bulk_create([
+        PersonBalance(company_id=company_id, person_id=person_id, 
+            account=account, as_of=as_of, **values)
+        for (company_id, person_id, account), values in balances.items()
+    ], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('document', '0029_populate_document_paid_balance'),
+        ('person', '0010_personbalance'),
+    ]
+
+    operations = [
+        migrations.RunPython(populate_personbalance, migrations.RunPython.noop),
+    ]
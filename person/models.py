@@ -1,5 +1,8 @@
-from django.db import models
-from django.db.models import Sum, F
+import datetime
+
+from django.db import models, transaction
+from django.db.models import Sum, F, Q, Count, Case, When, Value
+from django.utils import timezone
 from django.utils.translation import gettext as _
 from django.utils.translation import gettext_lazy as _l
 from django.core.validators import MinValueValidator, MaxValueValidator
@@ -198,16 +201,15 @@ class Person(ModelBase):
         """
         out = dict()
         types = DocumentType.TYPES_THAT_CAN_AFFECT_THE_ACCOUNT_RECEIVABLE
-        qs = self.document_set.filter(doctype__generic__in=types)
-        qs = qs.annotate(balance=F("total")-Sum("transaction__amount"))
-        qs = qs.filter(balance__gt=0)
+        qs = self.document_set.filter(doctype__generic__in=types, 
+            balance__gt=0)
         out["queryset"] = qs
         out["totals"] = qs.aggregate(
             Sum("total"), 
-            Sum("transaction__amount"),
-            Sum("balance")
+            Sum("paid"),
+            Sum("balance"),
+            count=Count("id"),
         )
-        out["totals"]["count"] = qs.count()
         return out
 
     def get_document_account_payable_pending_payment(self):
@@ -221,34 +223,36 @@ class Person(ModelBase):
         out = dict()
         types = DocumentType.TYPES_THAT_CAN_AFFECT_THE_ACCOUNT_PAYABLE
         qs = self.document_set.filter(doctype__generic__in=types)
-        qs = qs.annotate(balance=F("total")-Sum("transaction__amount"))
         out["queryset"] = qs.filter(balance__gt=0)
         out["totals"] = qs.aggregate(
             Sum("total"), 
-            Sum("transaction__amount"),
+            Sum("paid"),
             Sum("balance")
         )
         return out
 
+    def get_account_balance(self, account: str):
+        """
+        Obtiene el balance de esta persona en la cuenta indicada 
+        (PersonBalance.RECEIVABLE o PersonBalance.PAYABLE), o None.
+        """
+        return self.personbalance_set.filter(account=account).first()
+
     def get_balance_account_receivable(self):
         """
         Obtiene el balance de la cuenta por cobrar de esta persona.
         (El balance que esta persona le debe a la empresa).
         """
-        types = DocumentType.TYPES_THAT_CAN_AFFECT_THE_ACCOUNT_RECEIVABLE
-        # Solo documentos que afectan la cuenta por cobrar.
-        qs = self.document_set.filter(doctype__generic__in=types)
-        return qs.aggregate(s=Sum("total")-Sum("transaction__amount")).get("s", 0)
+        balance = self.get_account_balance(PersonBalance.RECEIVABLE)
+        return balance.balance if balance else 0
 
     def get_balance_account_payable(self):
         """
         Obtiene el balance de la cuenta por pagar de esta persona.
         (El balance que la empresa le debe a esta persona).
         """
-        types = DocumentType.TYPES_THAT_CAN_AFFECT_THE_ACCOUNT_PAYABLE
-        # Solo documentos que afectan la cuenta por cobrar.
-        qs = self.document_set.filter(doctype__generic__in=types)
-        return qs.aggregate(s=Sum("total")-Sum("transaction__amount")).get("s", 0)
+        balance = self.get_account_balance(PersonBalance.PAYABLE)
+        return balance.balance if balance else 0
 
     def get_balance(self):
         """
@@ -263,7 +267,247 @@ class Person(ModelBase):
         'get_balance_account_payable' para el balance que le debe la empresa a 
         dicho cliente.
         """
-        types = DocumentType.TYPES_THAT_CAN_ACCEPT_PAYMENTS
-        # Solo documentos que aceptan pagos.
-        qs = self.document_set.filter(doctype__generic__in=types)
-        return qs.aggregate(s=Sum("total")-Sum("transaction__amount")).get("s", 0)
\ No newline at end of file
+        qs = self.personbalance_set.all()
+        return qs.aggregate(s=Sum("balance"))["s"] or 0
+
+
+class PersonBalance(ModelBase):
+    """
+    Balance de una persona en la cuenta por cobrar o por pagar.
+
+    Es un resumen de los documentos de la persona que se mantiene cada vez 
+    que cambian los pagos o el total de uno de ellos, o su persona, tipo o 
+    fecha (ver Document.update_person_balances). Cada cambio aplica solo la
+    diferencia entre los valores anteriores y actuales del documento (ver 
+    apply_document). Así los listados y las verificaciones de crédito leen 
+    una fila, en lugar de recorrer todos los documentos y sus transacciones.
+
+    El balance pendiente se distribuye por antigüedad según la fecha del 
+    documento a la fecha as_of. Como la antigüedad cambia con los días, 
+    se recalcula cada noche con el comando refresh_person_balances.
+    """
+    tags = None
+
+    RECEIVABLE, PAYABLE = "receivable", "payable"
+    ACCOUNT_CHOICES = (
+        (RECEIVABLE, _l("Cuenta por cobrar")),
+        (PAYABLE, _l("Cuenta por pagar")),
+    )
+
+    # Tipos genéricos de documentos que afectan cada cuenta.
+    ACCOUNT_TYPES = {
+        RECEIVABLE: DocumentType.TYPES_THAT_CAN_AFFECT_THE_ACCOUNT_RECEIVABLE,
+        PAYABLE: DocumentType.TYPES_THAT_CAN_AFFECT_THE_ACCOUNT_PAYABLE,
+    }
+
+    # Rangos de antigüedad en días (campo, desde, hasta).
+    AGING_BUCKETS = (("days_0_30", None, 30), ("days_31_60", 31, 60), 
+        ("days_61_90", 61, 90), ("days_over_90", 91, None))
+
+    # Campos que se calculan de los documentos.
+    VALUES_FIELDS = ("total", "paid", "balance", "count") + tuple(
+        bucket[0] for bucket in AGING_BUCKETS)
+
+    # Valores de un documento (ver Document.get_values_in_db) que determinan
+    # lo que aporta al balance de su persona.
+    DOCUMENT_FIELDS = ("document__person_id", "document__doctype__generic", 
+        "document__date", "document__total", "document__paid", 
+        "document__balance")
+
+    person = models.ForeignKey(Person, on_delete=models.CASCADE,
+    verbose_name=_l("persona"))
+
+    account = models.CharField(_l("cuenta"), max_length=20, 
+    choices=ACCOUNT_CHOICES)
+
+    total = models.DecimalField(_l("total"), max_digits=32, decimal_places=4,
+    default=0)
+
+    paid = models.DecimalField(_l("pagado"), max_digits=32, decimal_places=4,
+    default=0)
+
+    balance = models.DecimalField(_l("balance"), max_digits=32, 
+    decimal_places=4, default=0)
+
+    count = models.IntegerField(_l("documentos pendientes"), default=0)
+
+    days_0_30 = models.DecimalField(_l("0 - 30 días"), max_digits=32, 
+    decimal_places=4, default=0)
+
+    days_31_60 = models.DecimalField(_l("31 - 60 días"), max_digits=32, 
+    decimal_places=4, default=0)
+
+    days_61_90 = models.DecimalField(_l("61 - 90 días"), max_digits=32, 
+    decimal_places=4, default=0)
+
+    days_over_90 = models.DecimalField(_l("más de 90 días"), max_digits=32, 
+    decimal_places=4, default=0)
+
+    as_of = models.DateField(_l("antigüedad a la fecha"), 
+    default=timezone.localdate)
+
+    class Meta:
+        verbose_name = _l("balance de persona")
+        verbose_name_plural = _l("balances de personas")
+        constraints = [
+            models.UniqueConstraint(fields=("person", "account"), 
+                name="unique_personbalance_person_account")
+        ]
+
+    def __str__(self):
+        return f"{self.person} ({self.get_account_display()}) = {self.balance}"
+
+    @classmethod
+    def get_account(cls, generic: str) -> str:
+        """Obtiene la cuenta que afecta el tipo genérico de documento."""
+        for account, types in cls.ACCOUNT_TYPES.items():
+            if generic in types:
+                return account
+
+    @classmethod
+    def get_aggregates(cls, as_of) -> dict:
+        """
+        Obtiene las expresiones que calculan, agrupando documentos, los 
+        valores de VALUES_FIELDS a la fecha indicada. Al anotarlas se usa el 
+        prefijo 'sum_', ya que sus nombres coinciden con campos de Document.
+        """
+        out = {"total": Sum("total"), "paid": Sum("paid"), 
+            "balance": Sum("balance"), 
+            "count": Count("id", filter=Q(balance__gt=0))}
+        for name, start, end in cls.AGING_BUCKETS:
+            condition = Q()
+            if start is not None:
+                condition &= Q(date__lte=as_of - datetime.timedelta(start))
+            if end is not None:
+                condition &= Q(date__gte=as_of - datetime.timedelta(end))
+            out[name] = Sum("balance", filter=condition)
+        return out
+
+    @classmethod
+    def get_values(cls, queryset, as_of=None) -> dict:
+        """
+        Calcula en una sola consulta agrupada los balances de las personas de
+        los documentos del queryset.
+
+        Returns:
+            dict: {(person_id, account): {field: value}}
+        """
+        as_of = as_of or timezone.localdate()
+        types = sum(cls.ACCOUNT_TYPES.values(), ())
+        qs = queryset.filter(person__isnull=False, doctype__generic__in=types)
+        aggregates = cls.get_aggregates(as_of)
+        qs = qs.order_by().values("person_id", "doctype__generic").annotate(
+            **{f"sum_{k}": v for k, v in aggregates.items()})
+
+        out = dict()
+        for row in qs.iterator():
+            key = (row["person_id"], cls.get_account(row["doctype__generic"]))
+            values = out.setdefault(key, dict.fromkeys(cls.VALUES_FIELDS, 0))
+            for field in cls.VALUES_FIELDS:
+                values[field] += row[f"sum_{field}"] or 0
+        return out
+
+    @classmethod
+    def get_document_changes(cls, values: dict, sign: int=1) -> dict:
+        """
+        Obtiene las expresiones para UPDATE que suman (sign=1) o restan 
+        (sign=-1) lo que aporta al balance un documento, con las claves de 
+        DOCUMENT_FIELDS. El rango de antigüedad depende de la fecha as_of de 
+        cada balance, por eso se resuelve en la misma sentencia con Case.
+        """
+        balance = values["document__balance"] or 0
+        changes = {
+            "total": F("total") + (values["document__total"] or 0) * sign,
+            "paid": F("paid") + (values["document__paid"] or 0) * sign,
+            "balance": F("balance") + balance * sign,
+            "count": F("count") + (sign if balance > 0 else 0),
+        }
+        date = values["document__date"]
+        for name, start, end in cls.AGING_BUCKETS:
+            # Igual que get_aggregates, con la condición sobre as_of.
+            condition = Q()
+            if start is not None:
+                condition &= Q(as_of__gte=date + datetime.timedelta(start))
+            if end is not None:
+                condition &= Q(as_of__lte=date + datetime.timedelta(end))
+            changes[name] = F(name) + Case(When(condition, 
+                then=Value(balance * sign)), default=Value(0), 
+                output_field=models.DecimalField(max_digits=32, 
+                decimal_places=4))
+        return changes
+
+    @classmethod
+    def apply_document(cls, previous: dict=None, current: dict=None):
+        """
+        Aplica a los balances la diferencia entre los valores anteriores 
+        (previous) y actuales (current) de un documento, con las claves de 
+        DOCUMENT_FIELDS: resta los anteriores y suma los actuales con 
+        sentencias UPDATE y F(), sin recorrer los demás documentos de la 
+        persona. Si la persona aún no tiene el balance de la cuenta, sus 
+        balances se calculan completos con update_persons.
+        """
+        if previous and current and all(previous[k] == current[k] 
+            for k in cls.DOCUMENT_FIELDS):
+            return
+
+        missing = set()
+        with transaction.atomic():
+            for values, sign in ((previous, -1), (current, 1)):
+                if not values:
+                    continue
+                person_id = values["document__person_id"]
+                account = cls.get_account(values["document__doctype__generic"])
+                if (not person_id) or (not account) or (person_id in missing):
+                    continue
+                updated = cls.objects.filter(person=person_id, 
+                    account=account).update(**cls.get_document_changes(values,
+                    sign))
+                if not updated:
+                    missing.add(person_id)
+            # Calculados desde los documentos ya guardados, incluyen este.
+            cls.update_persons(missing)
+
+    @classmethod
+    def update_persons(cls, persons, as_of=None):
+        """
+        Recalcula los balances de las personas indicadas (ids o instancias)
+        a partir de todos sus documentos. Se usa al crear el balance de una
+        persona; los cambios posteriores se aplican con apply_document.
+        """
+        ids = {getattr(p, "pk", p) for p in persons if p}
+        if not ids:
+            return
+        as_of = as_of or timezone.localdate()
+        values = cls.get_values(Document.objects.filter(person__in=ids), as_of)
+        companies = dict(Person.objects.filter(pk__in=ids).values_list("id", 
+            "company_id"))
+
+        with transaction.atomic():
+            for person_id in ids:
+                for account, _label in cls.ACCOUNT_CHOICES:
+                    defaults = values.get((person_id, account), 
+                        dict.fromkeys(cls.VALUES_FIELDS, 0))
+                    cls.objects.update_or_create(person_id=person_id, 
+                        account=account, defaults=dict(defaults, as_of=as_of,
+                        company_id=companies[person_id]))
+
+    @classmethod
+    def rebuild(cls, company, as_of=None, batch_size: int=1000) -> int:
+        """
+        Reconstruye los balances de todas las personas de la empresa 
+        indicada con una sola consulta agrupada. Retorna la cantidad de 
+        balances creados.
+        """
+        company_id = getattr(company, "pk", company)
+        as_of = as_of or timezone.localdate()
+        values = cls.get_values(Document.objects.filter(
+            doctype__company=company_id), as_of)
+
+        with transaction.atomic():
+            cls.objects.filter(company=company_id).delete()
+            cls.objects.bulk_create([
+                cls(company_id=company_id, person_id=person_id, 
+                    account=account, as_of=as_of, **fields)
+                for (person_id, account), fields in values.items()
+            ], batch_size=batch_size)
+        return len(values)
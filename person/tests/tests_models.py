@@ -1,11 +1,18 @@
 
 import copy
+import datetime
 
 from django.core.exceptions import ValidationError
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
 
 from base.tests import BaseTestCase
-from person.models import Person, IdentificationType
+from person.models import Person, IdentificationType, PersonBalance
 from company.tests.tests_models import get_or_create_company
+from document.tests.tests_models import get_or_create_document
+from inventory.models import Item, Movement
+from finance.models import Transaction
 
 
 class IdentificationTypeModelTest(BaseTestCase):
@@ -76,3 +83,87 @@ class PersonModelTest(BaseTestCase):
         
 
 
+
+
+class PersonBalanceModelTest(BaseTestCase):
+    """Test para el modelo PersonBalance."""
+
+    def test_balance_follows_documents_and_transactions(self):
+        document = get_or_create_document()
+        company = document.doctype.company
+        person = Person.objects.create(company=company, name="test", 
+            identification="12345678901", credit_limit=500)
+        document.pk = None
+        document.person = person
+        document.save()
+        item = Item.objects.create(company=company, name="test", 
+            codename="test")
+        Movement.objects.create(document=document, item=item, quantity=2, 
+            price=100, discount=0)
+        Transaction.objects.create(document=document, entry_amount=50)
+
+        balance = person.get_account_balance(PersonBalance.RECEIVABLE)
+        self.assertEqual((balance.total, balance.paid, balance.balance), 
+            (200, 50, 150))
+        self.assertEqual((balance.count, balance.days_0_30), (1, 150))
+        self.assertEqual(person.get_balance_account_receivable(), 150)
+        self.assertEqual(person.get_balance_account_payable(), 0)
+
+        # Al cambiar la fecha, el balance pasa a su rango de antigüedad.
+        document.date = timezone.localdate() - datetime.timedelta(45)
+        document.save()
+        balance.refresh_from_db()
+        self.assertEqual((balance.days_0_30, balance.days_31_60), (0, 150))
+
+        # La reconstrucción obtiene los mismos valores.
+        PersonBalance.rebuild(company)
+        rebuilt = person.get_account_balance(PersonBalance.RECEIVABLE)
+        self.assertEqual((rebuilt.balance, rebuilt.days_31_60), (150, 150))
+
+        document.delete()
+        self.assertEqual(person.get_balance_account_receivable(), 0)
+
+    def test_balance_is_updated_incrementally(self):
+        """
+        Los cambios aplican solo la diferencia del documento, sin recorrer
+        los demás, y coinciden con la reconstrucción completa.
+        """
+        document = get_or_create_document()
+        company = document.doctype.company
+        persons = [Person.objects.create(company=company, name=f"test{i}", 
+            identification=f"1234567890{i}") for i in range(2)]
+        item = Item.objects.create(company=company, name="test", 
+            codename="test")
+        documents = []
+        for i in range(3):
+            document = copy.copy(document)
+            document.pk = None
+            document.number = None
+            document.person = persons[0]
+            document.date = timezone.localdate() - datetime.timedelta(40 * i)
+            document.save()
+            Movement.objects.create(document=document, item=item, quantity=1,
+                price=100 * (i + 1), discount=0)
+            documents.append(document)
+
+        # Un pago no vuelve a agrupar los documentos de la persona.
+        transaction = Transaction(document=documents[0], entry_amount=30)
+        with CaptureQueriesContext(connection) as queries:
+            transaction.save()
+        self.assertFalse([q for q in queries.captured_queries 
+            if 'GROUP BY "document_document"."person_id"' in q["sql"]])
+
+        documents[1].person = persons[1]
+        documents[1].save()
+        documents[2].delete()
+
+        def get_values():
+            return {(b.person_id, b.account): [getattr(b, f) 
+                for f in PersonBalance.VALUES_FIELDS]
+                for b in PersonBalance.objects.filter(company=company)
+                if any(getattr(b, f) for f in PersonBalance.VALUES_FIELDS)}
+        values = get_values()
+        self.assertEqual(values[(persons[0].pk, PersonBalance.RECEIVABLE)][:4],
+            [100, 30, 70, 1])
+        PersonBalance.rebuild(company)
+        self.assertEqual(get_values(), values)
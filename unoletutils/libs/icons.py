@@ -3,6 +3,7 @@ Módulo para obtener iconos en formato .svg desde el directorio static de la app
 
 """
 import datetime
+import functools
 import re
 from pathlib import Path
 from django.conf import settings
@@ -11,7 +12,7 @@ from django.utils.html import format_html
 
 ICON_DIR = Path(__file__).resolve().parent.parent / 'static/icons'
 STATIC_URL = settings.STATIC_URL
-DATA = {} # Todos los íconos cargados aquí al iniciar el servidor.
+DATA = {} # Todos los íconos registrados aquí al iniciar el servidor.
 DEFAULT = "DEFAULT"
 RAISE_EXCEPTION = "RAISE_EXCEPTION"
 
@@ -25,16 +26,16 @@ class IconError(Exception):
 
 
 def populate():
-    """Carga los íconos en la variable 'DATA'."""
+    """
+    Registra los íconos en la variable 'DATA' (solo su ruta y url). El 
+    contenido de cada archivo se lee la primera vez que se usa (ver get_data).
+    """
     for path in ICON_DIR.iterdir():
-        try:
+        if path.is_file():
             DATA[path.name] = {
                 "path": path, 
                 "url": STATIC_URL + "icons/" + path.name,
-                "data": format_html(open(path, "r").read()),
             }
-        except (IOError):
-            continue
 
 
 def get_url(name: str, override: bool=True) -> str:
@@ -68,10 +69,20 @@ def get_data(name: str, override: bool=True) -> str:
     override = bool(override)
 
     if override == False:
-        #return open(ICON_DIR / name, "r").read() # Lanzará una excepción...
-        return DATA[name]
+        return load(DATA[name])
+
+    try:
+        return load(DATA[name])
+    except (KeyError, IOError):
+        return {"url": "", "path": "", "data": ""}
 
-    return DATA.get(name, {"url": "", "path": "", "data": ""})
+
+def load(data: dict) -> dict:
+    """Lee el contenido del ícono si aún no se ha leído."""
+    if not "data" in data:
+        with open(data["path"], "r") as f:
+            data["data"] = format_html(f.read())
+    return data
 
 
 def svg(name: str, size: str=None, fill: str=None, id: str=None, 
@@ -97,7 +108,7 @@ def svg(name: str, size: str=None, fill: str=None, id: str=None,
     fill = fill or 'var(--secondary)'
 
     try:
-        svg = get_data(name, override=False)["data"]
+        svg = render(name, size, fill)
     except (BaseException) as e:
         if on_error == RAISE_EXCEPTION:
             raise IconError(e) from e
@@ -105,43 +116,54 @@ def svg(name: str, size: str=None, fill: str=None, id: str=None,
             svg = DEFAULT_SVG
         else:
             svg = ""
-        return {"svg": svg, "size": size, "fill": fill, "name": name, "id": id}
 
-    # Eliminamos los saltos de línea y espacios extras.
-    svg = " ".join(svg.replace("\n", " ").split())
+    return {"svg": svg, "size": size, "fill": fill, "name": name, "id": id}
+
 
-    # if not id:
-    #     id = f"id-svg-{name}-fill-{fill}-size-{size}-{datetime.datetime.today()}"
-    #     id = text.Text.FormatCodename(id)
+# Expresiones de los atributos de la etiqueta svg que se reemplazan.
+SVG_TAG_RE = re.compile(r'<svg\s')
+WIDTH_RE = re.compile(r'\swidth=(["\']).*?["\']\s')
+HEIGHT_RE = re.compile(r'\sheight=(["\']).*?["\']\s')
+FILL_RE = re.compile(r'\sfill=(["\']).*?["\']\s')
+
+
+@functools.lru_cache(maxsize=2048)
+def render(name: str, size: str, fill: str) -> str:
+    """
+    Genera el svg del ícono con el tamaño y el color indicados. El resultado
+    se guarda en memoria, pues los mismos íconos se repiten en cada fila de
+    los listados (ver unoletutils.models.ModelBase.get_action).
+    """
+    svg = get_data(name, override=False)["data"]
+
+    # Eliminamos los saltos de línea y espacios extras.
+    svg = " ".join(svg.split())
 
     if size in ("", "none", "null", "auto"):
         if (" width=" in svg):
-            svg = re.sub(r'\swidth=(["\']).*?["\']\s', '', svg, count=1)
+            svg = WIDTH_RE.sub('', svg, count=1)
         
         if (" height=" in svg):
-            svg = re.sub(r'\sheight=(["\']).*?["\']\s', '', svg, count=1)
+            svg = HEIGHT_RE.sub('', svg, count=1)
 
     elif size:
         if (not " width=" in svg):
-            svg = re.sub(r'<svg\s', f'<svg width="{size}" ', svg, count=1)
+            svg = SVG_TAG_RE.sub(f'<svg width="{size}" ', svg, count=1)
         else:
-            svg = re.sub(r'\swidth=(["\']).*?["\']\s', f' width="{size}" ', 
-            svg, count=1)
+            svg = WIDTH_RE.sub(f' width="{size}" ', svg, count=1)
     
         if (not " height=" in svg):
-            svg = re.sub(r'<svg\s', f'<svg height="{size}" ', svg, count=1)
+            svg = SVG_TAG_RE.sub(f'<svg height="{size}" ', svg, count=1)
         else:
-            svg = re.sub(r'\sheight=(["\']).*?["\']\s', f' height="{size}" ', 
-            svg, count=1)
+            svg = HEIGHT_RE.sub(f' height="{size}" ', svg, count=1)
 
     if (not " fill=" in svg):
-        svg = re.sub(r'<svg\s', f'<svg fill="{fill}" ', svg, count=1)
+        svg = SVG_TAG_RE.sub(f'<svg fill="{fill}" ', svg, count=1)
     else:
-        svg = re.sub(r'\sfill=(["\']).*?["\']\s', f' fill="{fill}" ', svg, 
-        count=1)
+        svg = FILL_RE.sub(f' fill="{fill}" ', svg, count=1)
 
-    return {"svg": svg, "size": size, "fill": fill, "name": name, "id": id}
+    return svg
 
 
-# Al iniciar el servidor, se cargarán los iconos en la variable DATA.
+# Al iniciar el servidor, se registrarán los iconos en la variable DATA.
 populate()
\ No newline at end of file
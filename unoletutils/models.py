@@ -204,40 +204,29 @@ class ModelBase(models.Model, text.Text):
                 out[action] = act
         return out
 
+    # Nombre, ícono y color de cada acción (ver get_action).
+    ACTIONS_INFO = {
+        "create": (_l("Nuevo"), "plus-circle-fill", "var(--bs-success)"),
+        "update": (_l("Modificar"), "pencil-fill", "var(--bs-warning)"),
+        "delete": (_l("Eliminar"), "x-circle-fill", "var(--bs-danger)"),
+        "list": (_l("Lista"), "card-list", "var(--bs-dark)"),
+        "detail": (_l("Detalle"), "eye-fill", "var(--bs-primary)"),
+    }
+
     def get_action(self, action: str, size: str="1rem", fill: str=None) -> dict:
         """Obtiene la acción indicada."""
-
-        info = {
-            "create": {
-                "name": _("Nuevo"), 
-                "icon": icons.svg("plus-circle-fill", size=size, 
-                    fill=fill or "var(--bs-success)", on_error=icons.DEFAULT)}, 
-            "update": {
-                "name": _("Modificar"), 
-                "icon": icons.svg("pencil-fill", size=size, 
-                    fill=fill or "var(--bs-warning)", on_error=icons.DEFAULT)}, 
-            "delete": {
-                "name": _("Eliminar"), 
-                "icon": icons.svg("x-circle-fill", size=size, 
-                    fill=fill or "var(--bs-danger)", on_error=icons.DEFAULT)}, 
-            "list": {
-                "name": _("Lista"), 
-                "icon": icons.svg("card-list", size=size, 
-                    fill=fill or "var(--bs-dark)", on_error=icons.DEFAULT)}, 
-            "detail": {
-                "name": _("Detalle"), 
-                "icon": icons.svg("eye-fill", size=size, 
-                    fill=fill or "var(--bs-primary)", on_error=icons.DEFAULT)}, 
-        }
-
         try:
             url = str(getattr(self, f"get_{action}_url")())
         except (NoReverseMatch):
             return None
 
-        item = info[action]
-        item["url"] = url
-        return item
+        name, icon, default_fill = self.ACTIONS_INFO[action]
+        return {
+            "name": str(name), 
+            "icon": icons.svg(icon, size=size, fill=fill or default_fill, 
+                on_error=icons.DEFAULT),
+            "url": url,
+        }
 
     def get_barcode(self, code=None, strtype="code128"):
         """
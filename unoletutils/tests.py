@@ -4,6 +4,8 @@ from django.urls import reverse
 from user.tests.tests_models import get_or_create_user
 from company.tests.tests_models import get_or_create_company
 from warehouse.models import Warehouse
+from warehouse.tests.tests_models import get_or_create_warehouse
+from unoletutils.libs import icons
 
 
 class ViewDecoratorTest(TestCase):
@@ -50,3 +52,30 @@ class ViewDecoratorTest(TestCase):
         
         
 
+
+class IconsTest(TestCase):
+    """Test para 'unoletutils.libs.icons'."""
+
+    def test_svg_is_memoized(self):
+        icons.render.cache_clear()
+        svg = icons.svg("eye-fill", size="1rem", fill="red")["svg"]
+        self.assertIn(' width="1rem" ', svg)
+        self.assertIn(' fill="red" ', svg)
+        self.assertIs(icons.svg("eye-fill", size="1rem", fill="red")["svg"], svg)
+        self.assertEqual(icons.svg("no-existe", on_error=icons.DEFAULT)["svg"],
+            icons.DEFAULT_SVG)
+        self.assertRaises(icons.IconError, icons.svg, "no-existe")
+
+    def test_list_page_actions(self):
+        """
+        Las acciones de un listado de 100 filas solo generan cada ícono una 
+        vez (antes se generaban 5 íconos por acción y fila).
+        """
+        warehouse = get_or_create_warehouse()
+
+        icons.render.cache_clear()
+        for row in range(100):
+            warehouse.get_actions_links(size="1rem")
+        self.assertEqual(icons.render.cache_info().misses, 3)
+        self.assertEqual(icons.render.cache_info().hits, 297)
+
@@ -1,16 +1,47 @@
 import copy
+import csv
+import datetime
 import functools
-
-from django.core.exceptions import FieldError
+import hashlib
+import itertools
+import json
+import logging
+import operator
+import tempfile
+import warnings
+from decimal import Decimal
+
+from django.conf import settings
+
+from django.core import signing
+from django.core.cache import cache
+from django.core.exceptions import (FieldError, FieldDoesNotExist, 
+    ValidationError)
+from django.core.paginator import Paginator
+from django.db import DatabaseError, NotSupportedError
+from django.db.models import Q, QuerySet
+from django.utils.functional import cached_property
+from django.core.serializers.json import DjangoJSONEncoder
 from django.shortcuts import render, get_object_or_404, get_list_or_404
-from django.http import Http404
+from django.http import Http404, StreamingHttpResponse, FileResponse
+from django.utils import timezone
 from django.core.exceptions import PermissionDenied
 from django.utils.translation import gettext as _
 from django.utils.translation import gettext_lazy as _l
 from django.views import generic
 from django.contrib import messages
 
+try:
+    import openpyxl
+except (ImportError) as e:
+    openpyxl = None
+    warnings.warn(e)
+
 from base.forms import SearchForm
+from unoletutils.libs import text
+
+
+logger = logging.getLogger(__name__)
 
 
 class ViewError(Exception):
@@ -19,8 +50,10 @@ class ViewError(Exception):
 
 class ObjectCapsule:
     """
-    Encapsula una instancia de un models.Model para poder llamar a métodos 
-    declarados en la vista mediante el atributo de clase 'list_display'.
+    Encapsula una instancia de un models.Model para obtener los valores de 
+    las columnas declaradas en la vista mediante el atributo de clase 
+    'list_display'. Los demás atributos se buscan en la vista y luego en el 
+    objeto.
     """
 
     def __init__(self, view, obj):
@@ -36,29 +69,18 @@ class ObjectCapsule:
     def __bool__(self):
         return bool(self._obj)
 
-    def __getattribute__(self, name):
-        errors = []
-        try:
-            return getattr(super().__getattribute__("_view"), name)
-        except (AttributeError) as e:
-            errors.append(str(e))
-        try:
-            return getattr(super().__getattribute__("_obj"), name)
-        except (AttributeError) as e:
-            errors.append(str(e))
+    def __getattr__(self, name):
+        # Solo se llama cuando el atributo no es de la cápsula.
+        if name in ("_view", "_obj"):
+            raise AttributeError(name)
         try:
-            return super().__getattribute__(name)
-        except (AttributeError) as e:
-            errors.append(str(e))
-
-        raise AttributeError(". ".join(errors))
+            return getattr(self._view, name)
+        except (AttributeError):
+            return getattr(self._obj, name)
 
     def get_values(self):
         """Obtiene los valores de los campos declarados en list_display. """
-        return {
-            e[0]: {"value": self._obj.getattr(e[0]), 
-                "cssclass": self.get_list_display_cssclass().get(e[0], "")} 
-            for e in self._view.get_list_display()}
+        return self._view.get_list_display_values(self._obj)
 
 
 class QuerysetCapsule:
@@ -67,28 +89,269 @@ class QuerysetCapsule:
     de forma encapsulada con ObjectCapsule.
     """
 
-    def __init__(self, view, queryset):
+    def __init__(self, view, queryset, model=None):
         self._view = view 
         self._queryset = queryset 
+        # El queryset puede ser una lista (ej. una página de CursorPaginator).
+        self._model = model or getattr(queryset, "model", None)
 
     def __iter__(self):
         for obj in self._queryset:
             yield ObjectCapsule(self._view, obj)
 
     def __len__(self):
-        return len(self._queryset)
+        # Un queryset sin evaluar ni limitar se cuenta con COUNT(*) en lugar
+        # de traer todos sus registros.
+        queryset = self._queryset
+        if (isinstance(queryset, QuerySet) and (queryset._result_cache is None)
+            and (not queryset.query.is_sliced)):
+            return queryset.count()
+        return len(queryset)
 
     def __getitem__(self, index):
         if isinstance(index, int):
             return ObjectCapsule(self._view, self._queryset[index])
-        return QuerysetCapsule(self._view, self._queryset[index])
+        return QuerysetCapsule(self._view, self._queryset[index], 
+            model=self._model)
 
     def __getattribute__(self, name):
-        if name in ("_view", "_queryset", "__iter__"):
+        if name in ("_view", "_queryset", "_model", "__iter__"):
             return object.__getattribute__(self, name)
+        if name == "model":
+            return self._model
         return getattr(self._queryset, name)
 
 
+class CountPaginator(Paginator):
+    """
+    Paginador que obtiene el total de registros con la función indicada 
+    (ver BaseList.get_list_count). Si el total puede estar desactualizado 
+    se indica con count_is_approximate.
+    """
+
+    def __init__(self, *args, count_function=None, 
+        count_is_approximate=False, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.count_function = count_function
+        self.count_is_approximate = count_is_approximate
+
+    @cached_property
+    def count(self):
+        if self.count_function is None:
+            return super().count
+        return self.count_function(getattr(self.object_list, "_queryset", 
+            self.object_list))
+
+
+class CursorPaginator:
+    """
+    Paginador por cursor (keyset).
+
+    En lugar de saltar registros con OFFSET, cada página se obtiene filtrando
+    a partir de los valores de las columnas de ordering del último (o primer)
+    registro de la página anterior, de modo que una página profunda cuesta 
+    lo mismo que la primera si existe un índice sobre dichas columnas.
+
+    Las columnas deben ser campos del modelo, no nulos, y la última debe ser 
+    única (ej. ('-create_date', '-id')). Los cursores son firmados, así que 
+    un cursor alterado se ignora y se muestra la primera página.
+    """
+
+    # Nombre del parámetro del cursor en la url.
+    cursor_kwarg = "cursor"
+
+    SALT = "unoletutils.views.CursorPaginator"
+
+    def __init__(self, queryset, per_page: int, ordering, count_function=None,
+        count_is_approximate=False):
+        self.queryset = queryset
+        self.per_page = int(per_page)
+        self.count_function = count_function
+        self.count_is_approximate = count_is_approximate
+        self.ordering = []
+        self.fields = []
+        opts = queryset.model._meta
+        for name in ordering:
+            desc = name.startswith("-")
+            field = opts.pk if name.lstrip("-") == "pk" else opts.get_field(
+                name.lstrip("-"))
+            self.ordering.append((field.name, desc))
+            self.fields.append(field)
+
+    @cached_property
+    def count(self):
+        if self.count_function is None:
+            return self.queryset.count()
+        return self.count_function(self.queryset)
+
+    def get_order_by(self, reverse=False) -> list:
+        return [("-" if (desc != reverse) else "") + name 
+            for name, desc in self.ordering]
+
+    def encode_cursor(self, obj, previous=False) -> str:
+        """Crea el cursor que apunta al objeto indicado."""
+        return signing.dumps({"v": [field.value_to_string(obj) 
+            for field in self.fields], "p": bool(previous)}, salt=self.SALT, 
+            compress=True)
+
+    def decode_cursor(self, cursor: str):
+        """
+        Obtiene los valores y la dirección del cursor, o (None, False) si el
+        cursor no es válido.
+        """
+        try:
+            data = signing.loads(cursor, salt=self.SALT)
+            values = [field.to_python(value) 
+                for field, value in zip(self.fields, data["v"])]
+        except (signing.BadSignature, ValidationError, KeyError, TypeError,
+            ValueError):
+            return None, False
+        if len(values) != len(self.fields):
+            return None, False
+        return values, bool(data.get("p"))
+
+    def get_filter(self, values, previous=False) -> Q:
+        """
+        Condición de los registros posteriores (o anteriores si previous) a 
+        los valores indicados según el ordering:
+        (a < x) OR (a = x AND b < y) OR ...
+        """
+        condition = Q()
+        for i, ((name, desc), value) in enumerate(zip(self.ordering, values)):
+            lookup = "lt" if (desc != previous) else "gt"
+            q = Q(**{f"{name}__{lookup}": value})
+            for (prev_name, prev_desc), prev_value in zip(self.ordering[:i], 
+                values[:i]):
+                q &= Q(**{prev_name: prev_value})
+            condition |= q
+        return condition
+
+    def page(self, cursor: str=None) -> "CursorPage":
+        values, previous = (self.decode_cursor(cursor) if cursor 
+            else (None, False))
+        if values is None:
+            previous = False
+        qs = self.queryset.order_by(*self.get_order_by(reverse=previous))
+        if values is not None:
+            qs = qs.filter(self.get_filter(values, previous))
+
+        object_list = list(qs[:self.per_page + 1])
+        more = len(object_list) > self.per_page
+        object_list = object_list[:self.per_page]
+        if previous:
+            object_list.reverse()
+            has_next, has_previous = True, more
+        else:
+            has_next, has_previous = more, values is not None
+        return CursorPage(object_list, self, has_next, has_previous)
+
+
+class CursorPage:
+    """Página de CursorPaginator, con la interfaz usada de Page."""
+
+    is_cursor = True
+
+    def __init__(self, object_list, paginator, has_next, has_previous):
+        self.object_list = object_list
+        self.paginator = paginator
+        self._has_next = has_next
+        self._has_previous = has_previous
+
+    def __repr__(self):
+        return f"<CursorPage {len(self)} of {self.paginator.count}>"
+
+    def __len__(self):
+        return len(self.object_list)
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __getitem__(self, index):
+        return self.object_list[index]
+
+    def has_next(self):
+        return self._has_next and bool(self.object_list)
+
+    def has_previous(self):
+        return self._has_previous and bool(self.object_list)
+
+    def has_other_pages(self):
+        return self.has_next() or self.has_previous()
+
+    def get_next_cursor(self):
+        if self.has_next():
+            return self.paginator.encode_cursor(self.object_list[-1])
+
+    def get_previous_cursor(self):
+        if self.has_previous():
+            return self.paginator.encode_cursor(self.object_list[0], 
+                previous=True)
+
+
+class SearchFilter:
+    """
+    Filtro del formulario de búsqueda de un listado (ver 
+    BaseList.search_filters), que indica cómo se aplica el valor del campo 
+    del formulario sobre el campo 'field' del modelo.
+
+    Parameters:
+        field (str): campo del modelo, puede ser una ruta 'a__b'.
+
+        lookup (str): EXACT, PREFIX (rango [valor, valor + \\uffff), que usa 
+        el índice en cualquier base de datos), GT, GTE, LT, LTE, IN, ISNULL, 
+        TAGS o CONTAINS.
+
+        index (callable): para TAGS, función index(company, value, 
+        limit=None) del índice de búsqueda del modelo (ej. 
+        inventory.models.ItemToken.search) que devuelve los ids que 
+        coinciden, que se filtran con field__in. Sin índice, TAGS busca el 
+        texto normalizado con icontains.
+    """
+
+    EXACT, PREFIX, GT, GTE, LT, LTE, IN, ISNULL, TAGS, CONTAINS = (
+        "exact", "prefix", "gt", "gte", "lt", "lte", "in", "isnull", "tags", 
+        "contains")
+
+    def __init__(self, field: str, lookup: str=EXACT, index=None):
+        self.field = field
+        self.lookup = lookup
+        self.index = index
+
+    def __repr__(self):
+        return f"<SearchFilter {self.field} {self.lookup}>"
+
+    @property
+    def is_scan(self) -> bool:
+        """Si el filtro recorre toda la tabla en lugar de usar un índice."""
+        return (self.lookup == self.CONTAINS) or (
+            (self.lookup == self.TAGS) and (self.index is None))
+
+    def apply(self, queryset, value, company=None):
+        """Aplica el filtro al queryset con el valor indicado."""
+        if self.lookup == self.PREFIX:
+            return queryset.filter(**{f"{self.field}__gte": value, 
+                f"{self.field}__lt": f"{value}\uffff"})
+        if self.lookup == self.TAGS:
+            if self.index is not None:
+                return queryset.filter(**{f"{self.field}__in": self.index(
+                    company, value, limit=None)})
+            return queryset.filter(**{f"{self.field}__icontains": 
+                text.Text.get_tag(value)})
+        if self.lookup == self.CONTAINS:
+            return queryset.filter(**{f"{self.field}__icontains": value})
+        return queryset.filter(**{f"{self.field}__{self.lookup}": value})
+
+
+class Echo:
+    """
+    Objeto con la interfaz de un archivo que devuelve lo que se escribe, 
+    para generar las líneas de un csv.writer sin guardarlas en memoria.
+    """
+
+    def write(self, value):
+        return value
+
+
 class BaseView:
     """Clase base de las cuales heredarán nuestras vistas."""
 
@@ -194,9 +457,11 @@ class BaseView:
         context = super().get_context_data(**kwargs)
         user = self.request.user
         company = self.get_company()
-        # Permisos y grupos que posee y pertenece el usuario actual.
-        context["user_company_permissions"] = user.get_company_permissions(company)
-        context["user_company_groups"] = user.get_company_groups(company)
+        # Codenames de los permisos del usuario actual en la empresa, para 
+        # comprobarlos en la plantilla sin consultas adicionales. Ej:
+        # {% if "document.add_document" in company_perms %}
+        context["company_perms"] = user.get_company_permission_codenames(
+            company)
         return context
 
 
@@ -206,7 +471,58 @@ class BaseList(BaseView):
     list_display = [("__str__", _l("nombre"))]
     list_display_cssclass = {}
     list_display_links = ["__str__"]
+    # Columnas de list_display que se obtienen como anotaciones del queryset,
+    # en lugar de llamar al método del modelo en cada fila, de modo que la 
+    # página cueste las mismas consultas sin importar la cantidad de filas.
+    # Ej. {"get_balance": F("total") - F("paid")}
+    list_display_annotations = {}
+    # Campos relacionados que se obtienen junto al queryset (select_related).
+    list_select_related = ()
+    # Modo de paginación: OFFSET (páginas numeradas) o CURSOR (keyset, ver 
+    # CursorPaginator), este último por las columnas de cursor_ordering, que 
+    # deben estar indexadas.
+    OFFSET, CURSOR = "offset", "cursor"
+    pagination_mode = OFFSET
+    cursor_ordering = ("-pk",)
+    # Segundos que se guarda el total de registros del listado en la caché, 
+    # de modo que es aproximado (ver get_list_count). None para contarlos 
+    # en cada página.
+    list_count_timeout = None
     search_form_class = SearchForm
+    # Filtros declarados de los campos del formulario de búsqueda 
+    # {nombre del campo: SearchFilter}. Los campos no declarados se aplican 
+    # solo si usan un índice (ver plan_search_filter); así, la búsqueda por 
+    # 'tags__icontains' se rechaza (con un aviso) salvo en los listados que 
+    # la declaran con un índice de palabras (ej. inventory.views.ItemListView).
+    search_filters = {}
+
+    # Lookups que pueden usar un índice del campo, y los que obligan a 
+    # recorrer la tabla, que se reescriben como prefijo si el campo tiene 
+    # índice, o se rechazan.
+    INDEXED_LOOKUPS = ("exact", "gt", "gte", "lt", "lte", "in", "range", 
+        "isnull", "startswith")
+    SCAN_LOOKUPS = ("contains", "icontains", "istartswith", "endswith", 
+        "iendswith", "regex", "iregex", "iexact")
+
+    # Prefijo de los nombres de las anotaciones de list_display_annotations.
+    ANNOTATION_PREFIX = "list_"
+
+    # Exportación del listado completo (ver export). El formato se indica 
+    # en la url, ej. ?export=csv, junto a los filtros de búsqueda.
+    CSV, XLSX, NDJSON = "csv", "xlsx", "ndjson"
+    EXPORT_FORMATS = (CSV, XLSX, NDJSON)
+    export_kwarg = "export"
+    export_chunk_size = 2000
+
+    # Planes de list_display ya compilados de cada vista 
+    # {(modelo, columnas): plan}, hasta LIST_DISPLAY_PLANS_MAX por vista (ver 
+    # get_list_display_plan). Cada subclase tiene su propio diccionario.
+    _list_display_plans = {}
+    LIST_DISPLAY_PLANS_MAX = 32
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        cls._list_display_plans = dict()
 
     def get_search_form(self):
         if self.search_form_class:
@@ -226,29 +542,412 @@ class BaseList(BaseView):
             
         self.paginate_by = paginate_by
         qs = self.queryset_filter(super().get_queryset())
+        qs = self.annotate_list_display(qs)
         return QuerysetCapsule(view=self, queryset=qs)
 
+    def annotate_list_display(self, queryset):
+        """
+        Agrega al queryset las anotaciones y los select_related de las 
+        columnas de list_display.
+        """
+        plan = self.get_list_display_plan(queryset.model)
+        select_related = tuple(self.list_select_related) + tuple(
+            name for name in plan["select_related"] 
+            if not name in self.list_select_related)
+        if select_related:
+            queryset = queryset.select_related(*select_related)
+        if plan["annotations"]:
+            queryset = queryset.annotate(**plan["annotations"])
+        return queryset
+
+    def get_list_count(self, queryset) -> int:
+        """
+        Obtiene el total de registros del queryset. Si se indica 
+        list_count_timeout, se guarda en la caché de Django por esos 
+        segundos, y el total es aproximado: no se invalida al crear o 
+        eliminar registros, y como no se configura CACHES, la caché es la 
+        LocMemCache de cada proceso, así que cada uno tiene su propio total.
+        """
+        if not self.list_count_timeout:
+            return queryset.count()
+        sql, params = queryset.query.sql_with_params()
+        key = "list-count:" + hashlib.md5(f"{sql}{params}".encode()).hexdigest()
+        count = cache.get(key)
+        if count is None:
+            count = queryset.count()
+            cache.set(key, count, self.list_count_timeout)
+        return count
+
+    def get_paginator(self, queryset, per_page, orphans=0, 
+        allow_empty_first_page=True, **kwargs):
+        return CountPaginator(queryset, per_page, orphans=orphans, 
+            allow_empty_first_page=allow_empty_first_page, 
+            count_function=self.get_list_count, 
+            count_is_approximate=bool(self.list_count_timeout), **kwargs)
+
+    def paginate_queryset(self, queryset, page_size):
+        if self.pagination_mode != self.CURSOR:
+            return super().paginate_queryset(queryset, page_size)
+        paginator = CursorPaginator(getattr(queryset, "_queryset", queryset),
+            page_size, self.cursor_ordering, 
+            count_function=self.get_list_count, 
+            count_is_approximate=bool(self.list_count_timeout))
+        page = paginator.page(self.request.GET.get(
+            CursorPaginator.cursor_kwarg))
+        return (paginator, page, QuerysetCapsule(self, page.object_list, 
+            model=paginator.queryset.model), page.has_other_pages())
+
+    def get_list_display_plan(self, model=None) -> dict:
+        """
+        Obtiene el plan compilado de las columnas de list_display para el 
+        modelo: una función de acceso por columna y los campos relacionados 
+        que se obtienen con select_related para que las filas no consulten.
+
+        Se compila una sola vez por vista, modelo y columnas (si la vista ya 
+        tiene LIST_DISPLAY_PLANS_MAX planes, se compila sin guardarlo).
+
+        Returns:
+            dict: {"columns": [(name, accessor)], "select_related": tuple, 
+            "annotations": dict, "values_list": tuple de los campos de las
+            columnas, o None si alguna no es un campo}.
+        """
+        model = model or self.model
+        names = tuple(e[0] for e in self.get_list_display())
+        plans = self.__class__._list_display_plans
+        key = (model, names)
+        plan = plans.get(key)
+        if plan is None:
+            plan = self.compile_list_display(model, names)
+            if len(plans) < self.LIST_DISPLAY_PLANS_MAX:
+                plans[key] = plan
+        return plan
+
+    def compile_list_display(self, model, names) -> dict:
+        """Compila las columnas indicadas (ver get_list_display_plan)."""
+        columns = []
+        values = []
+        select_related = []
+        annotations = {}
+        for name in names:
+            if name in self.list_display_annotations:
+                attname = self.ANNOTATION_PREFIX + name
+                annotations[attname] = self.list_display_annotations[name]
+                columns.append((name, operator.attrgetter(attname)))
+                values.append(attname)
+                continue
+            if name == "__str__":
+                columns.append((name, str))
+                values.append(None)
+                continue
+
+            path = name.split("__")
+            opts = getattr(model, "_meta", None)
+            value = None
+            for n, attname in enumerate(path):
+                try:
+                    field = opts.get_field(attname)
+                except (FieldDoesNotExist, AttributeError):
+                    break
+                if not (field.many_to_one or 
+                    (field.one_to_one and field.concrete)):
+                    # Un campo del modelo (no un método) se puede obtener 
+                    # con values_list.
+                    if (n == len(path) - 1) and field.concrete and (
+                        not field.is_relation):
+                        value = name
+                    break
+                related = "__".join(path[:n + 1])
+                if not related in select_related:
+                    select_related.append(related)
+                opts = field.related_model._meta
+            columns.append((name, self.compile_accessor(path)))
+            values.append(value)
+
+        return {"columns": columns, "select_related": tuple(select_related),
+            "annotations": annotations, 
+            "values_list": None if None in values else tuple(values)}
+
+    @staticmethod
+    def compile_accessor(path):
+        """
+        Crea la función que obtiene el valor de la ruta 'a__b__c' de un 
+        objeto. Si algún relacionado es None devuelve None, y los métodos se 
+        llaman igual que lo haría la plantilla.
+        """
+        def accessor(obj):
+            for attname in path:
+                if obj is None:
+                    return None
+                obj = getattr(obj, attname)
+            if callable(obj) and not getattr(obj, "do_not_call_in_templates", 
+                False):
+                return obj()
+            return obj
+        return accessor
+
+    def get_list_display_values(self, obj) -> dict:
+        """Obtiene los valores de las columnas de list_display para obj."""
+        cssclass = self.get_list_display_cssclass()
+        return {name: {"value": accessor(obj), "cssclass": cssclass.get(name, "")}
+            for name, accessor in self.get_list_display_plan(
+                obj.__class__)["columns"]}
+
+    def get_list_display_value(self, obj, name: str):
+        """Obtiene el valor de la columna 'name' de list_display para obj."""
+        return self.get_list_display_values(obj)[name]["value"]
+
+    def get(self, request, *args, **kwargs):
+        export_format = request.GET.get(self.export_kwarg)
+        if export_format:
+            return self.export(export_format)
+        return super().get(request, *args, **kwargs)
+
+    def get_export_formats(self) -> tuple:
+        """Formatos de exportación disponibles."""
+        if openpyxl is None:
+            return tuple(f for f in self.EXPORT_FORMATS if f != self.XLSX)
+        return self.EXPORT_FORMATS
+
+    def get_export_urls(self) -> list:
+        """Obtiene [(formato, url)] para exportar el listado actual."""
+        params = self.request.GET.copy()
+        params.pop("page", None)
+        params.pop(CursorPaginator.cursor_kwarg, None)
+        out = []
+        for export_format in self.get_export_formats():
+            params[self.export_kwarg] = export_format
+            out.append((export_format, f"?{params.urlencode()}"))
+        return out
+
+    def get_export_rows(self, queryset):
+        """
+        Genera las filas (tuplas) de todo el listado, con los filtros de 
+        búsqueda y las columnas de list_display.
+
+        Los registros se leen por lotes con iterator(chunk_size), como tuplas
+        con values_list si todas las columnas son campos, de modo que la 
+        memoria no depende de la cantidad de registros.
+        """
+        plan = self.get_list_display_plan(queryset.model)
+        if plan["values_list"] is not None:
+            rows = queryset.values_list(*plan["values_list"]).iterator(
+                chunk_size=self.export_chunk_size)
+        else:
+            columns = [accessor for name, accessor in plan["columns"]]
+            rows = (tuple(accessor(obj) for accessor in columns) 
+                for obj in queryset.iterator(chunk_size=self.export_chunk_size))
+        for row in rows:
+            yield tuple(self.get_export_value(value) for value in row)
+
+    @staticmethod
+    def get_export_value(value):
+        """
+        Convierte el valor a uno que se pueda escribir en cualquier formato: 
+        las fechas con zona horaria a la hora local, y los objetos a texto.
+        """
+        if isinstance(value, datetime.datetime) and timezone.is_aware(value):
+            return timezone.make_naive(value)
+        if (value is None) or isinstance(value, (str, int, float, Decimal, 
+            datetime.date, datetime.time)):
+            return value
+        return str(value)
+
+    def get_export_filename(self, model, export_format: str) -> str:
+        return (f"{model._meta.model_name}-"
+            f"{timezone.localtime():%Y%m%d-%H%M%S}.{export_format}")
+
+    def export(self, export_format: str):
+        """
+        Exporta todo el listado en el formato indicado. CSV y NDJSON se 
+        envían mientras se generan (StreamingHttpResponse). XLSX se escribe 
+        en modo write_only de openpyxl a un archivo temporal que luego se 
+        envía, también sin cargar los registros en memoria.
+        """
+        if not export_format in self.get_export_formats():
+            raise Http404(f"El formato de exportación '{export_format}' no "
+                "está disponible.")
+
+        names = [e[0] for e in self.get_list_display()]
+        headers = [str(e[1]) for e in self.get_list_display()]
+        queryset = self.get_queryset()
+        queryset = getattr(queryset, "_queryset", queryset)
+        rows = self.get_export_rows(queryset)
+        filename = self.get_export_filename(queryset.model, export_format)
+
+        if export_format == self.CSV:
+            writer = csv.writer(Echo())
+            lines = itertools.chain(["\ufeff", writer.writerow(headers)], 
+                (writer.writerow(row) for row in rows))
+            response = StreamingHttpResponse(lines, 
+                content_type="text/csv; charset=utf-8")
+        elif export_format == self.NDJSON:
+            lines = (json.dumps(dict(zip(names, row)), cls=DjangoJSONEncoder) 
+                + "\n" for row in rows)
+            response = StreamingHttpResponse(lines, 
+                content_type="application/x-ndjson")
+        else:
+            workbook = openpyxl.Workbook(write_only=True)
+            sheet = workbook.create_sheet()
+            sheet.append(headers)
+            for row in rows:
+                sheet.append(row)
+            file = tempfile.TemporaryFile()
+            workbook.save(file)
+            file.seek(0)
+            return FileResponse(file, as_attachment=True, filename=filename,
+                content_type="application/vnd.openxmlformats-officedocument."
+                "spreadsheetml.sheet")
+
+        response["Content-Disposition"] = f'attachment; filename="{filename}"'
+        return response
+
     def queryset_filter(self, queryset):
         """
-        Filtra el queryset de acuerdo al los valores del diccionario pasado.
-        Las claves del diccionario deben ser nombres de campos válidos del 
-        modelo Ej. {'name': 'Unolet'} or {'name__contains': 'Uno'}
-        Las claves no válidas serán obviadas.
+        Filtra el queryset con los valores del formulario de búsqueda, según
+        el plan de get_search_plan. Con DEBUG, el plan y el EXPLAIN de la 
+        consulta quedan en self.search_plan y self.search_explain.
         """
         form = self.get_search_form()
-        if form.is_valid():
-            for key in form.cleaned_data:
-                value = form.cleaned_data[key]
-                print(key, value, type(value))
-                if value == "":
-                    continue
-                try:
-                    queryset = queryset.filter(**{key: value})
-                except (FieldError) as e:
-                    print(e)
-                    continue 
+        if (form is None) or (not form.is_valid()):
+            return queryset
+
+        plan = self.get_search_plan(form.cleaned_data, queryset.model)
+        company = self.get_company()
+        for step in plan:
+            if step["filter"] is not None:
+                queryset = step["filter"].apply(queryset, step["value"], 
+                    company=company)
+        self.warn_rejected_search_filters(form, plan)
+
+        if settings.DEBUG:
+            self.search_plan = plan
+            try:
+                self.search_explain = queryset.explain()
+            except (DatabaseError, NotSupportedError) as e:
+                self.search_explain = str(e)
+            for step in plan:
+                logger.debug("%s: %s=%r %s %s", self.__class__.__name__, 
+                    step["key"], step["value"], step["action"], step["note"])
         return queryset
 
+    def warn_rejected_search_filters(self, form, plan: list):
+        """
+        Avisa al usuario (una sola vez por petición) de los filtros del 
+        formulario de búsqueda que no se aplicaron.
+        """
+        if getattr(self, "_search_warned", False):
+            return
+        self._search_warned = True
+        for step in plan:
+            if step["filter"] is None:
+                field = form.fields.get(step["key"])
+                # La búsqueda general no tiene etiqueta, solo 'placeholder'.
+                label = (field and (field.label or 
+                    field.widget.attrs.get("placeholder"))) or step["key"]
+                messages.warning(self.request, _("No se aplicó el filtro "
+                    f"'{label}' ({step['note']})."))
+
+    def get_search_plan(self, data: dict, model) -> list:
+        """
+        Obtiene el plan de filtros para los valores del formulario de 
+        búsqueda: un paso por cada valor no vacío.
+
+        Returns:
+            list: [{"key", "value", "filter": SearchFilter o None si se 
+            rechaza, "action": 'declared', 'indexed', 'rewritten' o 
+            'rejected', "note"}].
+        """
+        plan = []
+        for key, value in data.items():
+            if value in ("", None):
+                continue
+            search_filter = self.search_filters.get(key)
+            if search_filter is not None:
+                action = "declared"
+                note = _("recorre la tabla") if search_filter.is_scan else ""
+            else:
+                search_filter, action, note = self.plan_search_filter(model, 
+                    key)
+            plan.append({"key": key, "value": value, "filter": search_filter,
+                "action": action, "note": note})
+        return plan
+
+    def plan_search_filter(self, model, key: str) -> tuple:
+        """
+        Planifica un campo del formulario no declarado en search_filters, 
+        con la forma 'campo__lookup' o 'relacion__campo__lookup'.
+
+        Returns:
+            tuple: (SearchFilter o None, action, note).
+        """
+        names = key.split("__")
+        lookup = "exact"
+        opts = model._meta
+        path = []
+        field = None
+        for i, name in enumerate(names):
+            try:
+                field = opts.get_field(name)
+            except (FieldDoesNotExist):
+                if (field is None) or (i != len(names) - 1):
+                    return None, "rejected", _("campo no válido")
+                lookup = name
+                break
+            path.append(name)
+            if field.is_relation and (i != len(names) - 1):
+                if not (field.many_to_one or field.one_to_one):
+                    return None, "rejected", _("relación múltiple")
+                opts = field.related_model._meta
+
+        indexed = self.is_indexed_field(field)
+        field_path = "__".join(path)
+        if lookup in self.INDEXED_LOOKUPS:
+            if not indexed:
+                return None, "rejected", _("campo sin índice")
+            if lookup == "startswith":
+                return SearchFilter(field_path, SearchFilter.PREFIX), \
+                    "rewritten", "startswith -> prefix"
+            return SearchFilter(field_path, lookup), "indexed", ""
+        # Los demás (contains, icontains, istartswith...) no pueden usar el 
+        # índice y no equivalen a un prefijo; para buscarlos sin recorrer la 
+        # tabla se declaran en search_filters con un índice de palabras (ver 
+        # inventory.models.ItemToken).
+        return None, "rejected", _("recorre la tabla")
+
+    @staticmethod
+    def is_indexed_field(field) -> bool:
+        """
+        Comprueba si el campo tiene un índice que lo tenga como primera 
+        columna, o como segunda después de la empresa (los listados siempre 
+        se filtran por empresa).
+        """
+        if field is None:
+            return False
+        if field.primary_key or field.unique or field.db_index or (
+            field.is_relation and field.many_to_one):
+            return True
+        opts = field.model._meta
+        groups = [index.fields for index in opts.indexes 
+            if getattr(index, "condition", None) is None]
+        groups += [constraint.fields for constraint in opts.constraints 
+            if getattr(constraint, "fields", None) and 
+            (getattr(constraint, "condition", None) is None)]
+        groups += list(opts.unique_together) + list(opts.index_together)
+        for fields in groups:
+            fields = [name.lstrip("-") for name in fields]
+            if fields[:1] == [field.name]:
+                return True
+            if (fields[:1] == ["company"]) and (fields[1:2] == [field.name]):
+                return True
+        return False
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        if settings.DEBUG:
+            context["search_plan"] = getattr(self, "search_plan", None)
+            context["search_explain"] = getattr(self, "search_explain", None)
+        return context
+
     def get_list_display(self):
         return self.list_display or [("__str__", _l("nombre"))]
 
@@ -331,8 +1030,9 @@ class DetailPrintView(DetailView):
         template_names = super().get_template_names()
         return [n.replace("detail.html", "print.html") for n in template_names]
 
-    def dispatch(self, request, *args, **kwargs):
-        # Al imprimir se guarda un registro en el historial de cambios.
+    def get(self, request, *args, **kwargs):
+        # Al imprimir se guarda un registro en el historial de cambios, luego
+        # de que dispatch comprueba los permisos.
         obj = self.get_object()
         if hasattr(obj, "history"):
             if bool(getattr(obj, "is_printed", False)):
@@ -348,7 +1048,7 @@ class DetailPrintView(DetailView):
             # agregado uno más (p) para identificar los de la impresión.
             history.history_type = "p" 
             history.save()
-        return super().dispatch(request, *args, **kwargs)
+        return super().get(request, *args, **kwargs)
 
 
 class JsonResponseMixin:
@@ -1,4 +1,5 @@
 from django.db import models
+from django.db.models import Q
 from django.contrib.sites.models import Site
 from django.contrib.auth.models import AbstractUser, PermissionsMixin, Group
 from django.core.exceptions import ObjectDoesNotExist
@@ -77,6 +78,35 @@ class User(AbstractUser):
         """Obtiene los grupos de este usuario para la empresa indicada."""
         return self.company_groups.filter(company=company)
 
+    def get_company_permission_codenames(self, company) -> frozenset:
+        """
+        Obtiene los codenames de los permisos de este usuario en la empresa, 
+        tanto los asignados directamente como los de sus grupos. Los 
+        superusuarios cuentan con todos los permisos de la empresa.
+
+        El conjunto se guarda en el propio usuario (request.user vive lo que 
+        dura la petición), así se obtiene con una sola consulta por petición. 
+        No se guarda entre peticiones, para que un permiso retirado deje de 
+        valer de inmediato en todos los procesos. Devuelve un conjunto vacío
+        si el usuario no pertenece a la empresa.
+        """
+        from company.models import CompanyPermission
+
+        if not company.user_has_access(self):
+            return frozenset()
+
+        permissions = getattr(self, "_company_permissions", None)
+        if permissions is None:
+            permissions = self._company_permissions = dict()
+        if company.pk not in permissions:
+            qs = CompanyPermission.objects.filter(company=company)
+            if not self.is_superuser:
+                qs = qs.filter(Q(user=self.pk) | 
+                    Q(companypermissiongroup__user=self.pk))
+            permissions[company.pk] = frozenset(qs.order_by().values_list(
+                "codename", flat=True).distinct())
+        return permissions[company.pk]
+
     def has_company_permission(self, company, permission) -> bool:
         """
         Comprueba si este usuario tiene el permiso indicado en la empresa.
@@ -86,6 +116,7 @@ class User(AbstractUser):
             permiso que desea comprobar. Los que se evalua es el campo codename
             del permiso, y este campo tiene esta estructura:
                 [app_label].[action]_[model_name] = 'user.add_user'.
+            Si es un iterable, basta con que tenga uno de ellos.
 
             company (company.models.Company): empresa donde se supone que debe
             tener el permiso dicho usuario.
@@ -96,30 +127,28 @@ class User(AbstractUser):
 
             Los superuser cuentan con todos los permisos, pero igual deben 
             pertenecer a la empresa en cuestión.
+
+            Los permisos pueden venir asignados directamente o a través de 
+            los grupos del usuario (ver get_company_permission_codenames).
         """
         if not company.user_has_access(self):
             return False
 
-        # Pausado mientras se desarrolla...
         if self.is_superuser:
             return True
 
-        user_company_permissions = self.get_company_permissions(company)
-        if isinstance(permission, str):
-            try:
-                user_company_permissions.get(codename=permission)
-            except (models.ObjectDoesNotExist):
-                return False
-            return True
-        elif isinstance(permission, (tuple, list)):
-            for perm in permission:
-                if self.has_company_permission(company, perm):
-                    return True
+        codenames = self.get_company_permission_codenames(company)
+        if not codenames:
             return False
 
-        if permission in user_company_permissions:
-            return True
-        return False
+        if isinstance(permission, str):
+            return permission in codenames
+        elif isinstance(permission, (tuple, list, set, frozenset)):
+            return any(self.has_company_permission(company, perm) 
+                for perm in permission)
+
+        return ((permission.company_id == company.pk) and 
+            (permission.codename in codenames))
 
     def assign_company_permission(self, company_permission, company):
         """
@@ -163,19 +192,16 @@ class User(AbstractUser):
         """Obtiene las empresas que este usuario tiene accesso."""
         return self.company_set.all() | self.admin_users_company_set.all()
 
-    def get_modules(self, parent=None, only_parent=True):
-        """Obtiene los módulos a los que este usuario puede acceder."""
+    def get_modules(self, parent=None, only_parent=True) -> list:
+        """
+        Obtiene los módulos a los que este usuario puede acceder: los hijos 
+        del indicado, o todos sus descendientes si only_parent es False.
+        """
         from module.models import Module
 
-        qs = Module.objects.filter(parent=parent)
-
         if bool(only_parent):
-            return qs 
-
-        for obj in qs:
-            qs = qs | self.get_modules(obj, only_parent=False)
-
-        return qs
+            return Module.get_children(parent)
+        return Module.get_descendants(parent)
 
 
 
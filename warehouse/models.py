@@ -65,4 +65,18 @@ class Warehouse(ModelBase):
         ordering = ["company", "is_active", "name"]
 
     def __str__(self):
-        return self.name
\ No newline at end of file
+        return self.name
+
+    def get_stock(self, as_of=None) -> dict:
+        """
+        Obtiene la existencia de los artículos en este almacén, actual o a la
+        fecha 'as_of' indicada (inclusive), en un diccionario 
+        {item_id: available}.
+        """
+        from inventory.models import StockCheckpoint
+        if as_of:
+            stock = StockCheckpoint.get_stock(self.company_id, as_of, 
+                warehouse=self)
+            return {item_id: available 
+                for (item_id, warehouse_id), available in stock.items()}
+        return dict(self.stockbalance_set.values_list("item_id", "available"))